@@ -1,12 +1,9 @@
-import os
-from openai import AzureOpenAI
+from src.llm_client import LLMClient
 
 
-client = AzureOpenAI(
-  azure_endpoint="https://petunia-gpt4o-mini.openai.azure.com/",
-  api_key=os.getenv("AZURE_API_KEY"),
-  api_version="2024-02-15-preview"
-)
+# The endpoint and API version are in the "azure" provider of src/llm_client.py (AZURE_OPENAI_ENDPOINT overrides the
+# endpoint), the API key is read from AZURE_API_KEY
+client = LLMClient("azure")
 
 
 message_text = [
@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from regressions import compare
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_ROOT, "benchmarks", "baselines", "import_time.json")
+
+# Modules imported by the controller and its worker processes
+MODULES = [
+    "src.maze",
+    "src.gridworld",
+    "src.vec_maze",
+    "src.evaluation",
+    "src.sandbox",
+    "memory",
+    "llm",
+    "miniproject_llm4controller",
+]
+
+
+def measure_import_time(module, repeats=5):
+    """
+    Measures the cumulative import time of a module in a fresh interpreter with python -X importtime.
+
+    :param module: String, the name of the module.
+    :param repeats: Integer, the number of interpreters started, the minimum time is kept.
+    :return: Float, the import time in milliseconds, or None if the import fails.
+    """
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            print(f"Import of {module} failed:\n{result.stderr.splitlines()[-1]}", file=sys.stderr)
+            return None
+        # Lines are "import time: self [us] | cumulative | imported package", the module itself is the last one
+        for line in reversed(result.stderr.splitlines()):
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2] == module:
+                times.append(int(fields[1]) / 1000)
+                break
+    return min(times) if times else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the modules of the repo.")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.5, help="Tolerated slowdown ratio over the baseline")
+    parser.add_argument("--save_baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {module: measure_import_time(module, args.repeats) for module in args.modules}
+    for module, time_ms in results.items():
+        print(f"{module:<32} {'failed' if time_ms is None else f'{time_ms:8.1f} ms'}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({module: time_ms for module, time_ms in results.items() if time_ms is not None}, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        regressions, failures = compare(results, {}, args.threshold)
+    else:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        regressions, failures = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Import time regressions (more than {args.threshold:.0%} over the baseline): {regressions}")
+    if failures:
+        print(f"Failed imports: {failures}")
+    if regressions or failures:
+        sys.exit(1)
+    if not args.save_baseline:
+        print("No import time regression.")
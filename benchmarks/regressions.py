@@ -0,0 +1,19 @@
+def compare(results, baseline, threshold):
+    """
+    Returns the measures that fail the regression gate: the ones that exceed their baseline by more than the threshold
+    (ratio), and the ones that failed (None), as a code path that now raises must not pass the gate.
+
+    :param results: Dictionary {name: measure, or None if the measure failed}.
+    :param baseline: Dictionary {name: measure} of the reference run.
+    :param threshold: Float, the tolerated slowdown ratio over the baseline.
+    :return: Tuple (regressions, failures), lists of names.
+    """
+    regressions = []
+    failures = []
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if value is None:
+            failures.append(name)
+        elif reference is not None and value > reference * (1 + threshold):
+            regressions.append(name)
+    return regressions, failures
@@ -0,0 +1,317 @@
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from regressions import compare  # benchmarks/ is on the path, as the directory of the script
+BASELINE_PATH = os.path.join(REPO_ROOT, "benchmarks", "baselines", "throughput.json")
+
+MAZE_SIZES = [(10, 10), (25, 25), (50, 50)]
+# Fractions of the cells toggled per step around src.distance.INCREMENTAL_MAX_RATIO, to locate the crossover
+TOGGLE_RATES = [5e-4, 2e-3, 1e-2]
+
+
+def _maze_reset(size, dynamic):
+    from src.maze import SimpleMaze
+
+    env = SimpleMaze(size=size, dynamic=dynamic, seed=0, render_mode=None)
+    n = 200
+
+    def run():
+        for _ in range(n):
+            env.reset()
+
+    return run, n
+
+
+def _maze_step(size, dynamic):
+    from src.maze import SimpleMaze
+
+    env = SimpleMaze(size=size, dynamic=dynamic, seed=0, render_mode=None)
+    n = 2000
+    actions = np.random.default_rng(0).integers(4, size=n).tolist()
+
+    def run():
+        env.reset(seed=0)
+        for action in actions:
+            _, _, terminated, truncated, _ = env.step(action)
+            if terminated or truncated:
+                env.reset()
+
+    return run, n
+
+
+def _distance_update(incremental, rate, size=(100, 100)):
+    """Updates of the distance field of a maze with 25% walls after toggles of the given fraction of its cells."""
+    from src.distance import DistanceField
+
+    rng = np.random.default_rng(0)
+    n_cells = size[0] * size[1]
+    maze = np.zeros(size)
+    maze.reshape(-1)[rng.integers(0, n_cells, size=n_cells // 4)] = 1
+    maze[0, 0] = maze[-1, -1] = 0
+    initial_maze = maze
+    distances = DistanceField(maze, (size[0] - 1, size[1] - 1), use_cache=False).distances.copy()
+    n = 50
+    # Toggles drawn in advance (never the goal), each run replays them from the same maze
+    toggles = [np.unique(rng.integers(1, n_cells - 1, size=max(1, int(n_cells * rate)))) for _ in range(n)]
+    mazes = []
+    for cells in toggles:
+        maze = maze.copy()
+        maze.reshape(-1)[cells] = maze.reshape(-1)[cells] == 0
+        mazes.append(maze)
+    ratio = 1.0 if incremental else 0.0
+
+    def run():
+        field = DistanceField(initial_maze, (size[0] - 1, size[1] - 1), distances=distances)
+        for cells, maze in zip(toggles, mazes):
+            field.update(cells, maze, full_recompute_ratio=ratio)
+
+    return run, n
+
+
+def _gridworld_step():
+    from src.gridworld import GridWorld
+
+    env = GridWorld(size=5, seed=0, render_mode=None)
+    n = 10000
+    actions = np.random.default_rng(0).integers(4, size=n).tolist()
+
+    def run():
+        env.reset(seed=0)
+        for action in actions:
+            _, done = env.step(action)
+            if done:
+                env.reset()
+
+    return run, n
+
+
+def _long_response(n_paragraphs=200):
+    """Assistant answer with a lot of reasoning around the code block, as long answers of reasoning models."""
+    prose = "The agent should move towards the goal while avoiding the walls, so we look at the neighbours first. " * 5
+    code = (
+        "```python\n"
+        "def action_function(observation, memory_dict):\n"
+        "    maze, (r, c) = observation\n"
+        "    return 1, memory_dict\n"
+        "```\n"
+    )
+    half = "\n\n".join([prose] * (n_paragraphs // 2))
+    return f"{half}\n\n{code}\n{half}"
+
+
+def _extract_function():
+    from miniproject_llm4controller import Agent
+
+    response = _long_response()
+    n = 2000
+
+    def run():
+        for _ in range(n):
+            Agent.extract_function(None, response)
+
+    return run, n
+
+
+def _compute_memory():
+    from memory import compute_memory
+
+    n = 2000
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(n):
+                compute_memory(1024 + i, 7e9, batch_size=4, embedding_size=4096)
+
+    return run, n
+
+
+def _calculate_gpu_memory():
+    from memory import bytes_per_dtype, calculate_gpu_memory
+
+    n = 20000
+    dtypes = list(bytes_per_dtype.values())
+
+    def run():
+        for i in range(n):
+            calculate_gpu_memory(7 + i % 70, dtypes[i % len(dtypes)])
+
+    return run, n
+
+
+class _StubCompletions:
+    def __init__(self):
+        self.answers = [
+            "Let us go right then down.\n```python\n"
+            "def action_function(observation, memory_dict):\n"
+            "    maze, (r, c) = observation\n"
+            "    if c < maze.shape[1] - 1 and maze[r, c + 1] == 0:\n"
+            "        return 1, memory_dict\n"
+            "    return 2, memory_dict\n"
+            "```\n",
+            "No better function this time.",
+        ]
+        self.n_calls = 0
+
+    def create(self, **request):
+        from src.llm_cache import to_namespace
+
+        content = self.answers[min(self.n_calls, len(self.answers) - 1)]
+        self.n_calls += 1
+        return to_namespace(
+            {
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+
+class _StubClient:
+    """Offline client answering with fixed completions, in place of openai.OpenAI."""
+
+    def __init__(self):
+        from types import SimpleNamespace
+
+        self.chat = SimpleNamespace(completions=_StubCompletions())
+
+
+def _offline_episode():
+    """
+    Full episode of the controller (agent creation and LLM request, steps, learning and next request) with a stubbed
+    LLM client, the inline backend and no evaluation, so that only the overhead of this process is measured.
+    """
+    import miniproject_llm4controller as controller
+    from src.maze import SimpleMaze
+
+    registry_dir = tempfile.mkdtemp(prefix="bench_policies_")
+    atexit.register(shutil.rmtree, registry_dir, ignore_errors=True)
+    config = {
+        "llm_cache_mode": "off",
+        "n_candidates": 1,
+        "stream_completions": False,
+        "exec_backend": "inline",
+        "n_eval_episodes": 0,
+        "policy_registry_path": registry_dir,
+    }
+    for name, value in config.items():
+        setattr(controller, name, value)
+    env = SimpleMaze(**controller.env_kwargs, seed=0, render_mode=None)
+    n = 5
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for ep in range(n):
+                agent = controller.Agent(client=_StubClient())
+                observation, info = env.reset(seed=ep)
+                agent.reset()
+                terminated = truncated = False
+                cum_reward = 0
+                while not (terminated or truncated):
+                    observation, reward, terminated, truncated, info = env.step(agent.act(observation))
+                    cum_reward += reward
+                agent.learn(cum_reward=cum_reward)
+
+    return run, n
+
+
+def _benchmarks():
+    """Returns the benchmarks by name, each a function returning (run, n_ops): run() executes n_ops operations."""
+    benchmarks = {}
+    for size in MAZE_SIZES:
+        for dynamic in [False, True]:
+            kind = "dynamic" if dynamic else "static"
+            benchmarks[f"maze.reset/{kind}/{size[0]}x{size[1]}"] = lambda size=size, dynamic=dynamic: _maze_reset(size, dynamic)
+            benchmarks[f"maze.step/{kind}/{size[0]}x{size[1]}"] = lambda size=size, dynamic=dynamic: _maze_step(size, dynamic)
+    for rate in TOGGLE_RATES:
+        for incremental in [True, False]:
+            kind = "incremental" if incremental else "full"
+            benchmarks[f"distance.update/{kind}/100x100/{rate:g}"] = lambda incremental=incremental, rate=rate: _distance_update(incremental, rate)
+    benchmarks["gridworld.step"] = _gridworld_step
+    benchmarks["agent.extract_function/long"] = _extract_function
+    benchmarks["memory.compute_memory"] = _compute_memory
+    benchmarks["memory.calculate_gpu_memory"] = _calculate_gpu_memory
+    benchmarks["controller.offline_episode"] = _offline_episode
+    return benchmarks
+
+
+BENCHMARKS = _benchmarks()
+
+
+def measure(name, repeats=5):
+    """
+    Measures the time per operation of a benchmark.
+
+    :param name: String, the name of the benchmark, a key of BENCHMARKS.
+    :param repeats: Integer, the number of runs, the minimum time is kept.
+    :return: Float, the time per operation in microseconds, or None if the benchmark fails (which fails the gate).
+    """
+    try:
+        run, n_ops = BENCHMARKS[name]()
+        run()  # warm up (imports, caches)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    except Exception as e:
+        print(f"Benchmark {name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+        return None
+    return min(times) / n_ops * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the hot paths of the repo (CPU only, no network). "
+        "Baselines are only comparable on the machine where they were saved."
+    )
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS), help="Names or prefixes of the benchmarks")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.3, help="Tolerated slowdown ratio over the baseline")
+    parser.add_argument("--save_baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if any(name.startswith(prefix) for prefix in args.benchmarks)]
+    results = {}
+    for name in names:
+        results[name] = measure(name, args.repeats)
+        time_us = results[name]
+        print(f"{name:<44} {'failed' if time_us is None else f'{time_us:12.2f} us/op {1e6 / time_us:14.0f} op/s'}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        # A partial run only replaces the benchmarks it measured, and a failed benchmark keeps its previous baseline
+        baseline.update({name: time_us for name, time_us in results.items() if time_us is not None})
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        regressions, failures = compare(results, {}, args.threshold)
+    else:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        regressions, failures = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Throughput regressions (more than {args.threshold:.0%} slower than the baseline): {regressions}")
+    if failures:
+        print(f"Failed benchmarks: {failures}")
+    if regressions or failures:
+        sys.exit(1)
+    if not args.save_baseline:
+        print("No throughput regression.")
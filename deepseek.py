@@ -1,11 +1,9 @@
 # Please install OpenAI SDK first: `pip3 install openai`
 
-import os
-from openai import OpenAI
+from src.llm_client import LLMClient
 
-deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
-
-client = OpenAI(api_key=deepseek_api_key, base_url="https://api.deepseek.com")
+# The API key is read from DEEPSEEK_API_KEY, see src/llm_client.py for the limits and retries
+client = LLMClient("deepseek")
 
 response = client.chat.completions.create(
     model="deepseek-chat",
@@ -16,4 +14,4 @@ response = client.chat.completions.create(
     stream=False
 )
 
-print(response.choices[0].message.content)
\ No newline at end of file
+print(response.choices[0].message.content)
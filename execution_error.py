@@ -1,6 +1,6 @@
 import traceback
-import io
-import sys
+
+from src.exec_errors import capture_error, compile_generated
 
 code = """
 def raise_error():
@@ -13,7 +13,7 @@ def print_hello():
 """
 
 exec_globals = {}
-exec(code, exec_globals)
+exec(compile_generated(code), exec_globals)
 
 func = exec_globals["print_hello"]
 
@@ -27,10 +27,9 @@ except Exception as e:
     stack_trace = traceback.format_exc()
     print(f"Stack Trace:\n{stack_trace}\n")
     
-    # Clean up the stack trace to remove the exec context frames
-    relevant_stack_trace = "\n".join(line for line in stack_trace.splitlines() if "<string>" in line)
-    print(f"Relevant Stack Trace:\n{relevant_stack_trace}\n")
+    # Keep only the frames of the generated code, with their lines in its source
+    error = capture_error(e, code)
+    print(f"Relevant Stack Trace:\n{error.format()}\n")
     
-    # Combine the output and error information
-    full_error_info = f"Stack Trace:\n{relevant_stack_trace} \nError Output:\n{e}"
-    print("\n" + full_error_info)
+    # Errors with the same type, message (up to numbers) and lines share their signature
+    print(f"Error signature: {error.signature}")
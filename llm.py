@@ -1,33 +1,507 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
-
-# Device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Device: {device}")
-
-# Model
-model_name = "gpt2"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name).to(device)
-dtype_model = model.dtype
-
-# Number of params
-num_params = sum(p.numel() for p in model.parameters())
-print(f"Number of parameters: {num_params}")
-
-# Inference
-prompt = "Q: What is the capital of France?\nA:"
-tokens = tokenizer(prompt, return_tensors="pt").to(device)
-outputs = model.generate(**tokens, max_length=100)
-answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
-print(answer)
-
-# Memory used
-from memory import get_model_size, compute_memory
-print(f"Memory used according to torch.cuda.memory_allocated: {torch.cuda.memory_allocated(device) / 1e9:.2f} GB\n")
-print(f"Memory used according to the formula: {get_model_size(model_name, 'float32'):.2f} GB\n")
-compute_memory(512, num_params, batch_size=1, embedding_size=768)
-
-# dtype of model
-dtype = model.dtype
-print(f"Model dtype: {dtype}")
\ No newline at end of file
+# Heavy dependencies (torch, transformers) are only imported when a model is loaded, so that importing this module is cheap.
+# For the same reason the HTTP server is in llm_server.py and the engine imports queue and threading when it is created.
+import time
+from collections import OrderedDict
+
+
+class ByteTokenizer:
+    """
+    Tokenizer of the tiny model: the bytes of the UTF-8 text, and two special tokens. It needs no download, so that
+    the server can run offline with a randomly initialized model.
+    """
+
+    eos_token_id = 256
+    pad_token_id = 257
+    vocab_size = 258
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, ids):
+        return bytes(i for i in ids if i < 256).decode("utf-8", errors="replace")
+
+
+def format_chat(tokenizer, messages):
+    """
+    Returns the token ids of the prompt of a conversation, with the chat template of the tokenizer if it has one.
+
+    :param tokenizer: A Hugging Face tokenizer or a ByteTokenizer.
+    :param messages: List of {"role", "content"} dicts.
+    :return: List of token ids, ending with the beginning of the assistant answer.
+    """
+    if getattr(tokenizer, "chat_template", None):
+        return list(tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True))
+    text = "".join(f"{message['role']}: {message['content']}\n" for message in messages) + "assistant: "
+    return tokenizer.encode(text)
+
+
+def prefix_points(tokenizer, messages, prompt_ids):
+    """
+    Returns the lengths of the prompt at which its keys and values are worth caching: the end of the first message
+    (the system prompt shared by all the requests of a run) and the end of the last one (the whole conversation so far,
+    which the next request of the conversation extends).
+
+    :param tokenizer: A Hugging Face tokenizer or a ByteTokenizer.
+    :param messages: List of {"role", "content"} dicts.
+    :param prompt_ids: List of token ids, as returned by format_chat(tokenizer, messages).
+    :return: List of lengths, only those where the tokens of the first messages are a prefix of the prompt.
+    """
+    points = []
+    for k in sorted({1, len(messages)}):
+        if getattr(tokenizer, "chat_template", None):
+            ids = list(tokenizer.apply_chat_template(messages[:k], add_generation_prompt=False, tokenize=True))
+        else:
+            ids = tokenizer.encode("".join(f"{message['role']}: {message['content']}\n" for message in messages[:k]))
+        if 0 < len(ids) < len(prompt_ids) and prompt_ids[: len(ids)] == ids:
+            points.append(len(ids))
+    return points
+
+
+class _TrieNode:
+    __slots__ = ("children", "parent", "token", "past_key_values", "nbytes")
+
+    def __init__(self, parent=None, token=None):
+        self.children = {}
+        self.parent = parent
+        self.token = token
+        self.past_key_values = None
+        self.nbytes = 0
+
+
+class PrefixCache:
+    def __init__(self, max_bytes=2 * 1024**3):
+        """
+        Keys and values of prompt prefixes, so that only the rest of a prompt is prefilled.
+
+        The prefixes are the paths of a trie of token ids, whose nodes may hold the keys and values of their prefix.
+        The least recently used ones are evicted to stay under max_bytes.
+
+        :param max_bytes: Integer, the memory of the cached keys and values (on the device of the model).
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.root = _TrieNode()
+        self._lru = OrderedDict()  # nodes holding keys and values, least recently used first
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _find(self, ids):
+        node = self.root
+        for token in ids:
+            node = node.children.get(token)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, ids):
+        node = self._find(ids)
+        return node is not None and node.past_key_values is not None
+
+    def lookup(self, ids):
+        """
+        Finds the longest cached prefix of a prompt, shorter than the prompt (its last token is always prefilled, for
+        the logits of the first generated token).
+
+        :param ids: List of token ids of the prompt.
+        :return: Tuple (length of the prefix, its past_key_values as a tuple of (key, value) per layer), (0, None) on a miss.
+        """
+        node, best, best_length = self.root, None, 0
+        for length, token in enumerate(ids[:-1], start=1):
+            node = node.children.get(token)
+            if node is None:
+                break
+            if node.past_key_values is not None:
+                best, best_length = node, length
+        if best is None:
+            self.stats["misses"] += 1
+            return 0, None
+        self.stats["hits"] += 1
+        self._lru.move_to_end(best)
+        return best_length, best.past_key_values
+
+    def insert(self, ids, past_key_values):
+        """
+        Caches the keys and values of a prefix, evicting the least recently used ones if needed.
+
+        :param ids: List of token ids of the prefix.
+        :param past_key_values: Tuple of (key, value) per layer, of sequence length len(ids).
+        """
+        nbytes = sum(key.nbytes + value.nbytes for key, value in past_key_values)
+        if nbytes > self.max_bytes:
+            return
+        node = self.root
+        for token in ids:
+            child = node.children.get(token)
+            if child is None:
+                child = node.children[token] = _TrieNode(node, token)
+            node = child
+        if node.past_key_values is not None:
+            self._lru.move_to_end(node)
+            return
+        node.past_key_values, node.nbytes = past_key_values, nbytes
+        self._lru[node] = None
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self._evict(next(iter(self._lru)))
+
+    def _evict(self, node):
+        del self._lru[node]
+        self.nbytes -= node.nbytes
+        node.past_key_values, node.nbytes = None, 0
+        self.stats["evictions"] += 1
+        # Prunes the branch of the trie that no longer leads to cached prefixes
+        while node.parent is not None and not node.children and node.past_key_values is None:
+            del node.parent.children[node.token]
+            node = node.parent
+
+    def __len__(self):
+        return len(self._lru)
+
+
+def _to_legacy_cache(past_key_values):
+    """Returns the keys and values of a model output as a tuple of (key, value) per layer."""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return tuple(past_key_values)
+
+
+def _from_legacy_cache(past_key_values):
+    """Converts a tuple of (key, value) per layer to the cache class of the installed transformers, if it has one."""
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return past_key_values
+    return DynamicCache.from_legacy_cache(past_key_values)
+
+
+# Small instruct model with a chat template, whose context (32k tokens) fits the prompts of the controller, which
+# contain the source of the environment (gpt2 only has 1024 tokens)
+DEFAULT_MODEL = "Qwen/Qwen2.5-0.5B-Instruct"
+
+
+def load_model(model_name=DEFAULT_MODEL, tiny=False, device=None):
+    """
+    Loads a causal language model and its tokenizer.
+
+    :param model_name: String, the Hugging Face model id or path.
+    :param tiny: Boolean, if True, a small GPT-2 is randomly initialized instead (with a ByteTokenizer), to test the
+        server without downloads.
+    :param device: String, the torch device, by default cuda if available.
+    :return: Tuple (model, tokenizer, device).
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer, GPT2Config, GPT2LMHeadModel
+
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    if tiny:
+        torch.manual_seed(0)
+        tokenizer = ByteTokenizer()
+        config = GPT2Config(
+            vocab_size=tokenizer.vocab_size,
+            n_positions=4096,
+            n_embd=64,
+            n_layer=2,
+            n_head=2,
+            bos_token_id=tokenizer.eos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+        model = GPT2LMHeadModel(config)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token_id = tokenizer.eos_token_id
+    return model.to(device).eval(), tokenizer, device
+
+
+class GenerationRequest:
+    def __init__(self, prompt_ids, max_tokens=256, temperature=1.0, top_p=1.0, cache_points=()):
+        """
+        A sequence to generate, whose tokens are sent to self.deltas as they are produced.
+
+        :param prompt_ids: List of token ids of the prompt.
+        :param max_tokens: Integer, the maximum number of generated tokens.
+        :param temperature: Float, 0 for greedy decoding.
+        :param top_p: Float, the probability mass kept by nucleus sampling.
+        :param cache_points: Lengths of the prefixes of the prompt to keep in the prefix cache (see prefix_points).
+        """
+        self.prompt_ids = prompt_ids
+        self.cache_points = cache_points
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        import queue
+
+        self.deltas = queue.Queue()  # text deltas, then None once the generation is over
+        self.generated_ids = []
+        self.finish_reason = None
+        self.error = None
+        self.cancelled = False  # set when the client goes away, the sequence is then dropped from its batch
+        self.created = time.time()
+
+    def __iter__(self):
+        """Yields the text deltas until the end of the generation."""
+        while True:
+            delta = self.deltas.get()
+            if delta is None:
+                break
+            yield delta
+        if self.error is not None:
+            raise RuntimeError("The generation failed.") from self.error
+
+    def text(self):
+        """Waits for the end of the generation and returns the whole text."""
+        return "".join(self)
+
+
+class BatchingEngine:
+    def __init__(
+        self, model, tokenizer, device, max_batch_size=8, max_wait_ms=10, max_padding_ratio=0.5, max_context=None, prefix_cache=None
+    ):
+        """
+        Generates the queued requests in batches, in a background thread.
+
+        A batch is formed from the requests received during a window of max_wait_ms after the first one. The waiting
+        requests are sorted by prompt length and a batch only takes prompts of similar lengths, so that no prompt is padded
+        by more than max_padding_ratio of the longest one. The other requests wait for the next batch.
+
+        :param model: Causal language model of transformers.
+        :param tokenizer: Tokenizer of the model (see load_model).
+        :param device: torch.device of the model.
+        :param max_batch_size: Integer, the maximum number of sequences generated together.
+        :param max_wait_ms: Float, the time waited for other requests before starting a batch.
+        :param max_padding_ratio: Float, the maximum fraction of padding tokens in a prompt of a batch.
+        :param max_context: Integer, the maximum length of prompt and answer, by default the one of the model. Longer
+            prompts are rejected by submit(), as cutting them would silently drop the system prompt.
+        :param prefix_cache: PrefixCache, if given, the prompts are prefilled one by one from their longest cached prefix
+            instead of all together from scratch. This is faster when the prompts share long prefixes, as the requests
+            of the controller, which all start with the source of the environment.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_padding_ratio = max_padding_ratio
+        config = getattr(model, "config", None)
+        self.max_context = max_context or getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", 2048)
+        self.prefix_cache = prefix_cache
+        import queue
+        import threading
+
+        self.stats = {"batches": 0, "sequences": 0, "generated_tokens": 0, "padding_tokens": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+        self._queue = queue.Queue()
+        self._pending = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, request):
+        """
+        Queues a GenerationRequest, whose deltas can then be read by iterating over it.
+
+        :raises ValueError: If the prompt and max_tokens do not fit in the context of the model.
+        """
+        budget = self.max_context - request.max_tokens
+        if budget <= 0:
+            raise ValueError(f"max_tokens must be smaller than the context of the model ({self.max_context} tokens).")
+        if len(request.prompt_ids) > budget:
+            raise ValueError(
+                f"The prompt has {len(request.prompt_ids)} tokens, more than the {budget} left by max_tokens "
+                f"({request.max_tokens}) in the context of the model ({self.max_context} tokens)."
+            )
+        self._queue.put(request)
+        return request
+
+    def _collect(self):
+        """Waits for requests, then gathers the ones received during the batching window."""
+        import queue
+
+        if not self._pending:
+            self._pending.append(self._queue.get())
+        deadline = time.perf_counter() + self.max_wait
+        while len(self._pending) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                self._pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        while True:  # requests that arrived during the previous batch
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def _next_batch(self):
+        """Takes from the pending requests the oldest one and the ones of the closest prompt lengths."""
+        self._pending.sort(key=lambda request: len(request.prompt_ids))
+        lengths = [len(request.prompt_ids) for request in self._pending]
+        lo = hi = min(range(len(self._pending)), key=lambda i: self._pending[i].created)
+        while hi - lo + 1 < self.max_batch_size:
+            # Extend the batch towards the closest length, while no prompt is padded more than max_padding_ratio
+            candidates = []
+            if lo > 0:
+                candidates.append((lengths[hi] - lengths[lo - 1], lo - 1, hi))
+            if hi < len(lengths) - 1:
+                candidates.append((lengths[hi + 1] - lengths[lo], lo, hi + 1))
+            candidates = [(gap, i, j) for gap, i, j in candidates if lengths[i] >= (1 - self.max_padding_ratio) * lengths[j]]
+            if not candidates:
+                break
+            _, lo, hi = min(candidates)
+        batch = self._pending[lo : hi + 1]
+        del self._pending[lo : hi + 1]
+        return batch
+
+    def _run(self):
+        while True:
+            self._collect()
+            batch = self._next_batch()
+            try:
+                self._generate(batch)
+            except Exception as e:
+                for request in batch:
+                    if request.finish_reason is None:
+                        request.error = e
+                        request.finish_reason = "error"
+                        request.deltas.put(None)
+
+    def _sample(self, logits, batch):
+        """Samples the next token of each sequence, with its own temperature and top_p."""
+        import torch
+
+        tokens = logits.argmax(dim=-1)
+        for i, request in enumerate(batch):
+            if request.temperature <= 0:
+                continue
+            probs = torch.softmax(logits[i].float() / request.temperature, dim=-1)
+            if request.top_p < 1:
+                sorted_probs, order = probs.sort(descending=True)
+                outside = sorted_probs.cumsum(dim=-1) - sorted_probs > request.top_p
+                probs = probs.scatter(0, order, sorted_probs.masked_fill(outside, 0))
+            tokens[i] = torch.multinomial(probs, 1)[0]
+        return tokens
+
+    def _prefill_batch(self, batch):
+        """
+        Prefills the left-padded prompts of a batch in a single forward pass.
+
+        :return: Tuple (logits of the last position, past_key_values, attention_mask, position_ids of the next token).
+        """
+        import torch
+
+        pad_id = self.tokenizer.pad_token_id
+        length = max(len(request.prompt_ids) for request in batch)
+        input_ids = torch.full((len(batch), length), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for i, request in enumerate(batch):
+            n = len(request.prompt_ids)
+            input_ids[i, length - n :] = torch.tensor(request.prompt_ids, dtype=torch.long)
+            attention_mask[i, length - n :] = 1
+        input_ids, attention_mask = input_ids.to(self.device), attention_mask.to(self.device)
+        position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, use_cache=True)
+        return outputs.logits[:, -1, :], outputs.past_key_values, attention_mask, position_ids[:, -1:] + 1
+
+    def _prefill_rows(self, batch):
+        """
+        Prefills the prompts one by one, starting from the longest prefix of each prompt found in the prefix cache, and
+        caches the keys and values of the prefixes of the prompt at its cache_points. The caches of the prompts are then
+        left-padded to the same length, to decode them together.
+
+        :return: Same as _prefill_batch.
+        """
+        import torch
+        import torch.nn.functional as F
+
+        logits, caches = [], []
+        for request in batch:
+            ids = request.prompt_ids
+            cached, past_key_values = self.prefix_cache.lookup(ids)
+            self.stats["cached_prompt_tokens"] += cached
+            outputs = self.model(
+                input_ids=torch.tensor([ids[cached:]], dtype=torch.long, device=self.device),
+                position_ids=torch.arange(cached, len(ids), device=self.device)[None],
+                past_key_values=_from_legacy_cache(past_key_values) if past_key_values is not None else None,
+                use_cache=True,
+            )
+            cache = _to_legacy_cache(outputs.past_key_values)
+            for point in request.cache_points:
+                if cached < point < len(ids) and ids[:point] not in self.prefix_cache:
+                    # Copies, so that the cache of the whole prompt is freed with the batch
+                    self.prefix_cache.insert(ids[:point], tuple((k[:, :, :point].clone(), v[:, :, :point].clone()) for k, v in cache))
+            logits.append(outputs.logits[0, -1])
+            caches.append(cache)
+
+        lengths = [len(request.prompt_ids) for request in batch]
+        length = max(lengths)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long, device=self.device)
+        for i, n in enumerate(lengths):
+            attention_mask[i, length - n :] = 1
+        self.stats["padding_tokens"] += len(batch) * length - sum(lengths)
+        # The dimension of the keys and values padded on the left is the sequence (batch, heads, sequence, head_dim)
+        past_key_values = tuple(
+            tuple(torch.cat([F.pad(cache[layer][j], (0, 0, length - n, 0)) for cache, n in zip(caches, lengths)]) for j in range(2))
+            for layer in range(len(caches[0]))
+        )
+        position_ids = torch.tensor(lengths, dtype=torch.long, device=self.device)[:, None]
+        return torch.stack(logits), _from_legacy_cache(past_key_values), attention_mask, position_ids
+
+    def _generate(self, batch):
+        """Prefills the prompts of a batch and decodes them step by step, streaming the tokens."""
+        import torch
+
+        self.stats["batches"] += 1
+        self.stats["sequences"] += len(batch)
+        self.stats["prompt_tokens"] += sum(len(request.prompt_ids) for request in batch)
+
+        texts = [""] * len(batch)
+        active = list(range(len(batch)))
+        with torch.no_grad():
+            if self.prefix_cache is None:
+                logits, past_key_values, attention_mask, position_ids = self._prefill_batch(batch)
+                self.stats["padding_tokens"] += int(attention_mask.numel() - attention_mask.sum())
+            else:
+                logits, past_key_values, attention_mask, position_ids = self._prefill_rows(batch)
+            for step in range(max(request.max_tokens for request in batch)):
+                tokens = self._sample(logits, batch)
+                for i in list(active):
+                    request = batch[i]
+                    token = int(tokens[i])
+                    if request.cancelled:
+                        request.finish_reason = "cancelled"
+                    elif token == self.tokenizer.eos_token_id:
+                        request.finish_reason = "stop"
+                    else:
+                        request.generated_ids.append(token)
+                        # Decoding the whole answer handles the tokens that end in the middle of a character
+                        text = self.tokenizer.decode(request.generated_ids)
+                        if not text.endswith("�") and len(text) > len(texts[i]):
+                            request.deltas.put(text[len(texts[i]) :])
+                            texts[i] = text
+                        if len(request.generated_ids) >= request.max_tokens:
+                            request.finish_reason = "length"
+                    if request.finish_reason is not None:
+                        active.remove(i)
+                        self.stats["generated_tokens"] += len(request.generated_ids)
+                        request.deltas.put(None)
+                if not active:
+                    break
+                # The finished sequences keep being decoded with the others, their tokens are ignored
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(batch), 1))], dim=-1)
+                outputs = self.model(
+                    input_ids=tokens[:, None],
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                )
+                past_key_values = outputs.past_key_values
+                logits = outputs.logits[:, -1, :]
+                position_ids = position_ids + 1
+
+
+if __name__ == "__main__":
+    # The server imports this module, it runs from there so that its classes are not defined twice
+    from llm_server import main
+
+    main()
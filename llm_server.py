@@ -0,0 +1,194 @@
+# OpenAI-compatible HTTP server of the BatchingEngine of llm.py, kept apart so that importing llm stays cheap
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm import DEFAULT_MODEL, BatchingEngine, GenerationRequest, PrefixCache, format_chat, load_model, prefix_points
+
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible endpoints /v1/chat/completions (with streaming) and /v1/models, served by server.engine."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, error_type="invalid_request_error"):
+        self._send_json(status, {"error": {"message": message, "type": error_type}})
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.model_name, "object": "model", "owned_by": "local"}]})
+        else:
+            self._send_error(404, f"Unknown path {self.path}.")
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_error(404, f"Unknown path {self.path}.")
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            tokenizer = self.server.engine.tokenizer
+            prompt_ids = format_chat(tokenizer, body["messages"])
+            cache_points = prefix_points(tokenizer, body["messages"], prompt_ids) if self.server.engine.prefix_cache is not None else ()
+            max_tokens = body.get("max_completion_tokens") or body.get("max_tokens") or self.server.default_max_tokens
+            temperature = body.get("temperature", 1.0)
+            top_p = body.get("top_p", 1.0)
+            # The n choices are separate sequences, which are batched together
+            requests = [
+                self.server.engine.submit(GenerationRequest(list(prompt_ids), max_tokens, temperature, top_p, cache_points))
+                for _ in range(body.get("n") or 1)
+            ]
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_error(400, f"Invalid request: {e}")
+            return
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model") or self.server.model_name
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            self._stream(requests, completion_id, model, include_usage)
+        else:
+            self._complete(requests, completion_id, model)
+
+    def _usage(self, requests):
+        prompt_tokens = len(requests[0].prompt_ids)
+        completion_tokens = sum(len(request.generated_ids) for request in requests)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def _complete(self, requests, completion_id, model):
+        try:
+            texts = [request.text() for request in requests]
+        except RuntimeError as e:
+            self._send_error(500, str(e.__cause__), "server_error")
+            return
+        choices = [
+            {"index": i, "message": {"role": "assistant", "content": text}, "finish_reason": request.finish_reason}
+            for i, (request, text) in enumerate(zip(requests, texts))
+        ]
+        self._send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                "usage": self._usage(requests),
+            },
+        )
+
+    def _stream(self, requests, completion_id, model, include_usage):
+        """Sends the deltas as server-sent events, in the format of the chunks of the OpenAI API."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        created = int(time.time())
+
+        def send(choices, usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            for i, request in enumerate(requests):
+                send([{"index": i, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+                for delta in request:
+                    send([{"index": i, "delta": {"content": delta}, "finish_reason": None}])
+                send([{"index": i, "delta": {}, "finish_reason": request.finish_reason}])
+            if include_usage:
+                send([], usage=self._usage(requests))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream, e.g. after the code block (see streaming.consume_stream)
+            for request in requests:
+                request.cancelled = True
+        except RuntimeError as e:
+            self.wfile.write(f"data: {json.dumps({'error': {'message': str(e.__cause__), 'type': 'server_error'}})}\n\n".encode("utf-8"))
+
+
+def make_server(engine, model_name, host="127.0.0.1", port=8000, default_max_tokens=512):
+    """
+    Creates the HTTP server of a BatchingEngine, each connection is handled by its own thread.
+
+    :param engine: BatchingEngine.
+    :param model_name: String, the model listed by /v1/models.
+    :param host: String, the address to listen on.
+    :param port: Integer, the port (0 for any free port, see server.server_address).
+    :param default_max_tokens: Integer, the max_tokens of the requests that do not set it.
+    :return: ThreadingHTTPServer, to run with serve_forever().
+    """
+    server = ThreadingHTTPServer((host, port), ChatCompletionsHandler)
+    server.daemon_threads = True
+    server.engine = engine
+    server.model_name = model_name
+    server.default_max_tokens = default_max_tokens
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a causal LM with an OpenAI-compatible /v1/chat/completions endpoint.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Hugging Face model id or path")
+    parser.add_argument("--tiny", action="store_true", help="Serve a tiny randomly initialized model (no download)")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--max_wait_ms", type=float, default=10)
+    parser.add_argument("--max_padding_ratio", type=float, default=0.5)
+    parser.add_argument("--max_tokens", type=int, default=512, help="Default max_tokens of the requests")
+    parser.add_argument("--prefix_cache_gb", type=float, default=2.0, help="Memory of the prompt prefix cache, 0 to disable it")
+    args = parser.parse_args()
+
+    model, tokenizer, device = load_model(args.model, tiny=args.tiny, device=args.device)
+    model_name = "tiny-random" if args.tiny else args.model
+    num_params = sum(p.numel() for p in model.parameters())
+    print(f"Model {model_name} on {device}, {num_params} parameters, dtype {model.dtype}")
+
+    # Memory of the model according to the planner
+    from memory import TransformerConfig, compute_memory
+
+    config = TransformerConfig.from_hf_config(model.config.to_dict(), num_parameters=num_params)
+    compute_memory(args.max_tokens, num_params, batch_size=args.max_batch_size, config=config, dtype=str(model.dtype).removeprefix("torch."))
+
+    engine = BatchingEngine(
+        model,
+        tokenizer,
+        device,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_padding_ratio=args.max_padding_ratio,
+        prefix_cache=PrefixCache(int(args.prefix_cache_gb * 1024**3)) if args.prefix_cache_gb > 0 else None,
+    )
+    server = make_server(engine, model_name, args.host, args.port, default_max_tokens=args.max_tokens)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/v1 (set LLM_BASE_URL to this address to use it in the controller)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Engine statistics: {engine.stats}")
+        if engine.prefix_cache is not None:
+            print(f"Prefix cache: {len(engine.prefix_cache)} prefixes, {engine.prefix_cache.nbytes / 1024**2:.1f} MB, {engine.prefix_cache.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,268 @@
-def compute_memory(n_i_n_o, P, batch_size=1, embedding_size=768):
+from typing import TYPE_CHECKING, Dict, Optional, Union
+import sys
+
+if TYPE_CHECKING:
+    import numpy as np  # imported by the planner functions, importing this module stays cheap
+
+GB = 1024 ** 3
+
+# Dictionary mapping dtype strings to their byte sizes
+bytes_per_dtype: Dict[str, float] = {
+    "int4": 0.5,
+    "int8": 1,
+    "float8": 1,
+    "float16": 2,
+    "bfloat16": 2,
+    "float32": 4,
+}
+
+# Integer formats store a float16 scale per group of weights
+quantized_dtypes = ("int4", "int8")
+
+
+def dtype_bytes(dtype: str, group_size: int = 128) -> float:
+    """Returns the number of bytes per value of a dtype, including the scales of the quantized dtypes.
+    Args:
+        dtype: A key of bytes_per_dtype
+        group_size: Number of weights sharing a float16 scale for the quantized dtypes
+    Returns:
+        Bytes per value
     """
-    Computes the model memory, input memory, and attention memory for a transformer model.
-    
+    if dtype not in bytes_per_dtype:
+        raise ValueError(f"Unsupported dtype: {dtype}. Supported types: {list(bytes_per_dtype.keys())}")
+    if dtype in quantized_dtypes:
+        return bytes_per_dtype[dtype] + bytes_per_dtype["float16"] / group_size
+    return bytes_per_dtype[dtype]
+
+
+class TransformerConfig:
+    def __init__(
+        self,
+        num_layers: int,
+        hidden_size: int,
+        num_heads: int,
+        vocab_size: int,
+        num_kv_heads: Optional[int] = None,
+        intermediate_size: Optional[int] = None,
+        gated_mlp: bool = False,
+        tie_embeddings: bool = True,
+        num_parameters: Optional[float] = None,
+    ):
+        """Hyperparameters of a decoder-only transformer, which determine its inference memory.
+        Args:
+            num_layers: Number of transformer blocks
+            hidden_size: Size of the residual stream (embedding size)
+            num_heads: Number of attention (query) heads
+            vocab_size: Size of the vocabulary
+            num_kv_heads: Number of key/value heads, smaller than num_heads with grouped-query attention (default num_heads)
+            intermediate_size: Size of the hidden layer of the MLP (default 4 * hidden_size)
+            gated_mlp: True for gated MLPs (SwiGLU, as Llama, Mistral, Qwen), which have three weight matrices
+            tie_embeddings: True if the output projection shares the weights of the input embeddings
+            num_parameters: Exact number of parameters if known, else it is estimated from the hyperparameters
+        """
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+        self.num_heads = num_heads
+        self.vocab_size = vocab_size
+        self.num_kv_heads = num_kv_heads or num_heads
+        self.intermediate_size = intermediate_size or 4 * hidden_size
+        self.gated_mlp = gated_mlp
+        self.tie_embeddings = tie_embeddings
+        self.num_parameters = num_parameters if num_parameters is not None else self.estimate_parameters()
+
+    @property
+    def head_dim(self) -> int:
+        return self.hidden_size // self.num_heads
+
+    def estimate_parameters(self) -> int:
+        """Counts the parameters of the weight matrices (biases and norms are negligible)."""
+        kv_size = self.num_kv_heads * self.head_dim
+        attention = 2 * self.hidden_size * self.hidden_size + 2 * self.hidden_size * kv_size  # q, o and k, v
+        mlp = (3 if self.gated_mlp else 2) * self.hidden_size * self.intermediate_size
+        embeddings = self.vocab_size * self.hidden_size * (1 if self.tie_embeddings else 2)
+        return self.num_layers * (attention + mlp) + embeddings
+
+    @classmethod
+    def from_hf_config(cls, config: dict, num_parameters: Optional[float] = None) -> "TransformerConfig":
+        """Builds the configuration from the config.json of a Hugging Face model (GPT-2 and Llama-like names).
+        Args:
+            config: Dictionary of the config.json (or model.config.to_dict())
+            num_parameters: Exact number of parameters if known
+        Returns:
+            TransformerConfig
+        """
+
+        def get(*keys, default=None):
+            for key in keys:
+                if config.get(key) is not None:
+                    return config[key]
+            return default
+
+        return cls(
+            num_layers=get("num_hidden_layers", "n_layer", "num_layers"),
+            hidden_size=get("hidden_size", "n_embd", "d_model"),
+            num_heads=get("num_attention_heads", "n_head"),
+            vocab_size=get("vocab_size"),
+            num_kv_heads=get("num_key_value_heads", "multi_query_group_num"),
+            intermediate_size=get("intermediate_size", "n_inner", "ffn_dim"),
+            gated_mlp=get("hidden_act", "activation_function", default="") in ("silu", "swiglu"),
+            tie_embeddings=get("tie_word_embeddings", default=True),
+            num_parameters=num_parameters,
+        )
+
+    @classmethod
+    def from_parameters(cls, num_parameters: float, hidden_size: int, vocab_size: int = 50257, head_dim: int = 64) -> "TransformerConfig":
+        """Guesses a GPT-2-like configuration from a number of parameters and an embedding size.
+        Args:
+            num_parameters: Number of parameters of the model
+            hidden_size: Embedding size
+            vocab_size: Size of the vocabulary (GPT-2 by default)
+            head_dim: Size of the attention heads
+        Returns:
+            TransformerConfig with the number of layers matching the number of parameters
+        """
+        per_layer = 12 * hidden_size ** 2  # 4 h^2 for the attention and 8 h^2 for the MLP
+        num_layers = max(1, round((num_parameters - vocab_size * hidden_size) / per_layer))
+        return cls(num_layers, hidden_size, max(1, hidden_size // head_dim), vocab_size, num_parameters=num_parameters)
+
+
+def inference_memory(
+    config: TransformerConfig,
+    batch_size=1,
+    seq_len=2048,
+    weight_dtype: str = "float16",
+    kv_dtype: Optional[str] = None,
+    activation_dtype: Optional[str] = None,
+    logits_dtype: str = "float32",
+    all_logits: bool = False,
+    flash_attention: bool = True,
+    group_size: int = 128,
+    reserved_gb: float = 0.0,
+) -> Dict[str, "np.ndarray"]:
+    """Estimates the memory needed to run a transformer on batch_size sequences of seq_len tokens.
+    The batch sizes and sequence lengths can be arrays, the memory is then computed for every pair (with the
+    NumPy broadcasting rules, see memory_grid).
+    - weights: num_parameters values of weight_dtype (with their scales for the quantized dtypes)
+    - kv_cache: keys and values of every layer, 2 * layers * batch * seq * kv_heads * head_dim values
+    - activations: peak of the temporary tensors of one layer during the prefill of the whole sequence (residual,
+      normed input, q/k/v, MLP hidden layer, and the attention scores batch * heads * seq^2 without flash attention)
+    - logits: batch * vocab values for the last token (or for every token with all_logits)
     Args:
-    n_i_n_o (int): Combined value of n_i + n_o (input size + number of generated tokens)
-    P (int): Number of parameters in the model
-    batch_size (int): Batch size for the computation
-    embedding_size (int): Size of the embeddings (typically 768 for GPT-2-like models)
-    
+        config: TransformerConfig of the model
+        batch_size: Integer or array of batch sizes
+        seq_len: Integer or array of sequence lengths (prompt and generated tokens)
+        weight_dtype: Dtype of the weights, quantized with int8/int4
+        kv_dtype: Dtype of the KV cache (default weight_dtype, or float16 for quantized weights)
+        activation_dtype: Dtype of the activations (default as kv_dtype)
+        logits_dtype: Dtype of the logits
+        all_logits: True if the logits of every position are kept (e.g. to score a sequence)
+        flash_attention: False if the attention scores are materialized
+        group_size: Number of weights sharing a scale for the quantized dtypes
+        reserved_gb: Memory reserved outside of the model (CUDA context, allocator fragmentation), in GB
     Returns:
-    None
+        Dictionary of arrays (in GB, 1024**3 bytes) "weights", "kv_cache", "activations", "logits" and "total",
+        of the broadcast shape of batch_size and seq_len
     """
-    # Constants
-    precision_bytes = 4  # 4 bytes for each parameter (32-bit precision)
-    
-    # 1. Model Memory (based on number of parameters)
-    model_memory = P * precision_bytes  # Memory taken by model parameters
+    import numpy as np
 
-    # 2. Input Memory (based on input size n_i and batch size)
-    input_memory = n_i_n_o * batch_size * embedding_size * precision_bytes
+    batch_size = np.asarray(batch_size, dtype=np.float64)
+    seq_len = np.asarray(seq_len, dtype=np.float64)
+    if kv_dtype is None:
+        kv_dtype = "float16" if weight_dtype in quantized_dtypes else weight_dtype
+    if activation_dtype is None:
+        activation_dtype = kv_dtype
+    kv_bytes = dtype_bytes(kv_dtype, group_size)
+    activation_bytes = dtype_bytes(activation_dtype, group_size)
+    tokens = batch_size * seq_len
+    kv_size = config.num_kv_heads * config.head_dim
 
-    # 3. Attention Memory (scales quadratically with the sequence length)
-    attention_memory = (n_i_n_o ** 2) * batch_size * precision_bytes
+    weights = config.num_parameters * dtype_bytes(weight_dtype, group_size)
+    kv_cache = 2 * config.num_layers * tokens * kv_size * kv_bytes
+    per_token = 2 * config.hidden_size + config.hidden_size + 2 * kv_size
+    per_token += (2 if config.gated_mlp else 1) * config.intermediate_size
+    activations = tokens * per_token * activation_bytes
+    if not flash_attention:
+        activations = activations + batch_size * config.num_heads * seq_len ** 2 * activation_bytes
+    logits = batch_size * (seq_len if all_logits else 1) * config.vocab_size * bytes_per_dtype[logits_dtype]
 
-    # Total Memory
-    total_memory = model_memory + input_memory + attention_memory
+    shape = np.broadcast(batch_size, seq_len).shape
+    breakdown = {
+        "weights": np.full(shape, weights / GB),
+        "kv_cache": np.broadcast_to(kv_cache / GB, shape),
+        "activations": np.broadcast_to(activations / GB, shape),
+        "logits": np.broadcast_to(logits / GB, shape),
+    }
+    breakdown["total"] = sum(breakdown.values()) + reserved_gb
+    return breakdown
 
-    # Print Results
-    print(f"Model Memory: {model_memory / (1024 ** 3):.2f} GB")
-    print(f"Input Memory: {input_memory / (1024 ** 3):.2f} GB")
-    print(f"Attention Memory: {attention_memory / (1024 ** 3):.2f} GB")
-    print(f"Total Memory: {total_memory / (1024 ** 3):.2f} GB")
 
-# Example Usage
-if __name__ == "__main__":
-    compute_memory(512, 124000000, batch_size=1, embedding_size=768)  # Adjust n_i+n_o and P as needed.
+def memory_grid(config: TransformerConfig, batch_sizes, seq_lens, **kwargs) -> Dict[str, "np.ndarray"]:
+    """Evaluates inference_memory on every pair of a grid of batch sizes and sequence lengths.
+    Args:
+        config: TransformerConfig of the model
+        batch_sizes: Sequence of batch sizes (rows of the grid)
+        seq_lens: Sequence of sequence lengths (columns of the grid)
+        **kwargs: Arguments of inference_memory (dtypes...)
+    Returns:
+        Dictionary of arrays (len(batch_sizes), len(seq_lens)) in GB, as returned by inference_memory
+    """
+    import numpy as np
 
+    batch_sizes = np.asarray(batch_sizes)[:, None]
+    seq_lens = np.asarray(seq_lens)[None, :]
+    return inference_memory(config, batch_sizes, seq_lens, **kwargs)
 
 
-from typing import Dict, Union
-from huggingface_hub import get_safetensors_metadata
-import argparse
-import sys
+def max_batch_size(config: TransformerConfig, seq_len, budget_gb: float, **kwargs):
+    """Returns the largest batch of sequences of seq_len tokens that fits in a memory budget.
+    Every term but the weights grows linearly with the batch size, so the batch is solved for directly.
+    Args:
+        config: TransformerConfig of the model
+        seq_len: Integer or array of sequence lengths
+        budget_gb: Memory available, in GB
+        **kwargs: Arguments of inference_memory (dtypes...)
+    Returns:
+        Integer (or array of integers for an array of sequence lengths), 0 if even the weights do not fit
+    """
+    import numpy as np
 
-# Dictionary mapping dtype strings to their byte sizes
-bytes_per_dtype: Dict[str, float] = {
-    "int4": 0.5,
-    "int8": 1,
-    "float8": 1,
-    "float16": 2,
-    "float32": 4,
-}
+    fixed = inference_memory(config, 0, seq_len, **kwargs)["total"]
+    per_sequence = inference_memory(config, 1, seq_len, **kwargs)["total"] - fixed
+    batch = np.floor(np.maximum(budget_gb - fixed, 0) / per_sequence).astype(np.int64)
+    return int(batch) if batch.ndim == 0 else batch
+
+
+def compute_memory(n_i_n_o, P, batch_size=1, embedding_size=768, config=None, dtype="float32", verbose=True, **kwargs):
+    """
+    Computes the memory needed to run a transformer model: weights, KV cache, activations and logits.
+
+    Args:
+    n_i_n_o (int): Combined value of n_i + n_o (input size + number of generated tokens)
+    P (int): Number of parameters in the model
+    batch_size (int): Batch size for the computation
+    embedding_size (int): Size of the embeddings (typically 768 for GPT-2-like models)
+    config (TransformerConfig): Hyperparameters of the model, guessed from P and embedding_size if None
+    dtype (str): Dtype of the weights (see bytes_per_dtype)
+    verbose (bool): Whether the breakdown is printed
+    **kwargs: Other arguments of inference_memory
+
+    Returns:
+    Dict: the memory in GB of each term ("weights", "kv_cache", "activations", "logits") and the "total"
+    """
+    if config is None:
+        config = TransformerConfig.from_parameters(P, embedding_size)
+    breakdown = {
+        key: float(value)
+        for key, value in inference_memory(config, batch_size, n_i_n_o, weight_dtype=dtype, **kwargs).items()
+    }
+
+    if verbose:
+        print(f"Model Memory: {breakdown['weights']:.2f} GB")
+        print(f"KV Cache Memory: {breakdown['kv_cache']:.2f} GB")
+        print(f"Activation Memory: {breakdown['activations']:.2f} GB")
+        print(f"Logits Memory: {breakdown['logits']:.2f} GB")
+        print(f"Total Memory: {breakdown['total']:.2f} GB")
+    return breakdown
 
 # Example
 # size = get_model_size("Qwen/Qwen2.5-7B-Instruct", "float16")
@@ -81,11 +293,14 @@ def calculate_gpu_memory(parameters: float, bytes: float) -> float:
     return memory
 
 
-def get_model_size(model_id: str, dtype: str = "float16") -> Union[float, None]:
+def get_model_size(model_id: str, dtype: str = "float16", metadata_cache_path: Optional[str] = "cache/model_metadata.json") -> Union[float, None]:
     """Get the estimated GPU memory requirement for a Hugging Face model.
+    The parameters are counted from the headers of the safetensors files on disk (a local directory or the Hugging Face
+    cache, see src/model_metadata.py), and from the Hub only when the model is not on disk.
     Args:
-        model_id: Hugging Face model ID (e.g., "facebook/opt-350m")
+        model_id: Hugging Face model ID (e.g., "facebook/opt-350m") or path of a local checkpoint
         dtype: Data type for model loading ("float16", "int8", etc.)
+        metadata_cache_path: JSON file caching the parameter counts of the local files, None to disable it
     Returns:
         Estimated GPU memory in GB, or None if estimation fails
     Examples:
@@ -100,11 +315,15 @@ def get_model_size(model_id: str, dtype: str = "float16") -> Union[float, None]:
                 f"Unsupported dtype: {dtype}. Supported types: {list(bytes_per_dtype.keys())}"
             )
 
-        metadata = get_safetensors_metadata(model_id)
-        if not metadata or not metadata.parameter_count:
-            raise ValueError(f"Could not fetch metadata for model: {model_id}")
+        model_parameters = _local_parameter_count(model_id, metadata_cache_path)
+        if model_parameters is None:
+            from huggingface_hub import get_safetensors_metadata  # Imported on first use, it is slow to import
+
+            metadata = get_safetensors_metadata(model_id)
+            if not metadata or not metadata.parameter_count:
+                raise ValueError(f"Could not fetch metadata for model: {model_id}")
+            model_parameters = sum(metadata.parameter_count.values())  # over all the dtypes of the checkpoint
 
-        model_parameters = list(metadata.parameter_count.values())[0]
         model_parameters = int(model_parameters) / 1_000_000_000  # Convert to billions
         return calculate_gpu_memory(model_parameters, bytes_per_dtype[dtype])
 
@@ -112,6 +331,27 @@ def get_model_size(model_id: str, dtype: str = "float16") -> Union[float, None]:
         print(f"Error estimating model size: {str(e)}", file=sys.stderr)
         return None
 
+
+def _local_parameter_count(model_id: str, metadata_cache_path: Optional[str]) -> Union[int, None]:
+    """Returns the number of parameters of a checkpoint on disk, or None if it is not on disk."""
+    from src.model_metadata import MetadataCache, model_metadata
+
+    cache = MetadataCache(metadata_cache_path) if metadata_cache_path is not None else None
+    try:
+        return model_metadata(model_id, cache=cache)["parameter_count"]
+    except FileNotFoundError:
+        return None
+
+# Example Usage
 if __name__ == "__main__":
+    import numpy as np
+
+    compute_memory(512, 124000000, batch_size=1, embedding_size=768)  # Adjust n_i+n_o and P as needed.
+
+    # Planning of a Llama-2-7B deployment on a 24 GB GPU
+    llama_7b = TransformerConfig(32, 4096, 32, 32000, intermediate_size=11008, gated_mlp=True, tie_embeddings=False)
+    seq_lens = np.array([512, 2048, 4096, 16384])
+    for dtype in ["float16", "int8", "int4"]:
+        print(f"{dtype}: largest batch for {seq_lens.tolist()} tokens: {max_batch_size(llama_7b, seq_lens, 24, weight_dtype=dtype).tolist()}")
     size = get_model_size("gpt2", "float32")
     print(f"Estimated GPU memory required: {size} GB")
@@ -1,32 +1,84 @@
+import asyncio
+import json
 import os
 import random
 import re
-import gymnasium as gym
+import time
 import numpy as np
-from openai import OpenAI
-import tensorboardX
-import tqdm
 
+import src.maze as maze
+from src.evaluation import evaluate_action_function, format_statistics
+from src.exec_errors import ExecError, capture_error
+from src.llm_cache import AsyncCachedClient, CachedClient, CompletionCache
+from src.llm_client import LLMClient, provider_config
+from src.history import ConversationHistory, function_hash
+from src.instrumentation import tracer
+from src.policy_registry import PolicyRegistry
+from src.sandbox import PolicyError, SandboxedPolicy
+from src.streaming import consume_async_stream, consume_stream
+from src.trajectory import TrajectoryRecorder
 
-# Initialize environment and agent : the environment is a wagon
-name_env = "maze"  # env coded in maze.py
-code_env = open("src/maze.py").read()
-tb_logger = tensorboardX.SummaryWriter(f"tensorboard/openai/{name_env}")
+# Heavy dependencies (openai, tensorboardX, tqdm) are imported on first use, so that importing this module is cheap
+# and has no side effect : the experiment only runs under main().
 
-import src.maze as maze
 
-env = maze.SimpleMaze(size=(10, 10), dynamic=False)
+# Configuration of the experiment : the environment is a wagon
+name_env = "maze"  # env coded in maze.py
+env_kwargs = {"size": (10, 10), "dynamic": False, "solvable_only": True}
+render_kwargs = {"render_mode": None, "render_every": 1}  # "human" to watch the episodes, "video" to record them
+n_eval_episodes = 32  # episodes run in worker processes to score each action function (0 to disable)
+n_eval_workers = os.cpu_count()
+llm_cache_mode = os.environ.get("LLM_CACHE_MODE", "read_through")  # "off", "read_through", "record" or "replay"
+llm_cache_path = "cache/llm_completions.sqlite"
+llm_base_url = os.environ.get("LLM_BASE_URL")  # e.g. http://127.0.0.1:8000/v1 for the local server of llm.py, None for OpenAI
+llm_provider = os.environ.get("LLM_PROVIDER", "openai" if llm_base_url is None else "local")  # see src/llm_client.py
+llm_model = os.environ.get("LLM_MODEL")  # model requested, None for the default model of the provider
+llm_slots = None  # semaphore bounding the requests in flight of several runs (see run_experiments.py), None for no bound
+max_history_tokens = 12000  # token budget of the conversation sent in each request
+n_candidates = 1  # action functions generated concurrently for each request, the best one is installed (each one is an API call)
+use_n_parameter = False  # if True, the candidates are sampled with the n parameter of a single request
+max_concurrent_requests = 4
+stream_completions = True  # if True, the answers are streamed and their code block is validated as soon as it is closed
+cancel_after_code = False  # if True, the stream is cancelled once a valid code block is received (cuts the prose after it, the cut answers are not cached)
+n_candidate_eval_episodes = 8  # quick episodes used to score each candidate
+eval_episode_timeout = 10.0  # time budget in seconds of each evaluation episode, run in worker processes killed beyond it
+exec_backend = "sandbox"  # "sandbox" runs the action function in a worker process with limits, "inline" in this process
+policy_timeout = 1.0  # time budget in seconds of each call to the action function in the sandbox
+policy_registry_path = "cache/policies"  # every version of the action function, with its bytecode and scores (best and active versions per run)
+n_repair_eval_episodes = 8  # quick episodes run to find the other errors of a failing function, fixed in the same request
+rollback_tolerance = 0.0  # a new function whose evaluation is worse than the best one by more than this is rolled back
+n_episodes = 50
+seed = None  # seed of the episode seeds, which are recorded with the trajectories
+trajectory_path = "trajectories"  # directory of the recorded trajectories (None to disable)
+trajectory_format = "npy"  # "npy" (memory-mapped), "npz" (compressed) or "parquet" (requires pyarrow)
+trace_path = "logs/trace_agent.json"  # Chrome trace of the run (open in Perfetto), None to disable the instrumentation
+log_dir = None  # tensorboard directory of the run, by default tensorboard/openai/<name_env>
+checkpoint_path = None  # JSON file of the state of the run, written after every episode and resumed from (None to disable)
+path_code_env = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "maze.py")  # env coded in maze.py
 
 
 # Create the agent
 class Agent:
-    def __init__(self):
-        # Initialize OpenAI API
-        self.client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-        self.model = "gpt-4o-mini"
+    def __init__(self, client=None, state=None):
+        # Initialize the client of the provider (rate limited, with retries), behind the completion cache
+        # (no API key is needed to replay a cached run)
+        if client is None and llm_cache_mode != "replay":
+            client = LLMClient(llm_provider, base_url=llm_base_url, model=llm_model, shared_slots=llm_slots)
+        self.client = CachedClient(client, CompletionCache(llm_cache_path, mode=llm_cache_mode))
+        self.model = llm_model or provider_config(llm_provider).model
         
         # Initialize the execution environment for the action function
         self.exec_globals = {}
+        self.action_function_source = None
+        self.version = None
+        self.memory_dict = {}
+        self.policy = SandboxedPolicy(timeout=policy_timeout) if exec_backend == "sandbox" else None
+        # The run keeps its id across resumptions, so that it only rolls back to its own versions
+        self.registry = PolicyRegistry(policy_registry_path, run_id=None if state is None else state.get("run_id"))
+        # Scores are only compared between evaluations of the same kind
+        env_key = json.dumps(env_kwargs, sort_keys=True)
+        self.score_key = f"eval/{n_eval_episodes}/{env_key}" if n_eval_episodes > 0 else f"episode/{env_key}"
+        self.candidate_score_key = f"candidate/{n_candidate_eval_episodes}/{env_key}"
 
         # Initialize prompt for asking for the action function
         self.formalism = (
@@ -40,14 +92,22 @@ class Agent:
             "    return action, memory_dict\n"
             "```\n"
         )
-        self.messages = []
-        self.messages.append(
+        self.history = ConversationHistory(max_tokens=max_history_tokens, model=self.model)
+        self.messages = self.history.messages  # full transcript, the requests only send a budgeted view of it
+        self.n_episodes = 0
+        if state is not None:
+            # Resume the conversation of a checkpoint, without asking again for the action function
+            self.load_state_dict(state)
+            return
+        with open(path_code_env) as f:
+            code_env = f.read()
+        self.history.append(
             {
                 "role": "system",
                 "content": f"You are an RL agent that needs to produce code that solves an RL environment. The code of the environment is the following:\n\n{code_env}.",
             }
         )
-        self.messages.append(
+        self.history.append(
             {
                 "role": "user",
                 "content": (
@@ -60,37 +120,120 @@ class Agent:
         # Ask the assistant for the action function
         self.ask_for_action_function()
 
+    def state_dict(self):
+        """Returns the state of the agent (conversation and action function), as JSON-serializable data for checkpoints."""
+        return {
+            "history": self.history.state_dict(),
+            "action_function_source": self.action_function_source,
+            "n_episodes": self.n_episodes,
+            "run_id": self.registry.run_id,
+        }
+
+    def load_state_dict(self, state):
+        """Restores the conversation and reinstalls the action function of state_dict()."""
+        self.history.load_state_dict(state["history"])
+        self.n_episodes = state["n_episodes"]
+        if state["action_function_source"] is not None:
+            self.install_function(state["action_function_source"])
+
     def reset(self):
         self.memory_dict = {}
-        
+        if self.policy is not None:
+            self.policy.reset()
+
+    def current_memory_dict(self):
+        """Returns the memory_dict of the action function, which lives in the worker with the sandbox backend."""
+        if self.policy is None:
+            return self.memory_dict
+        try:
+            return self.policy.memory_dict()
+        except Exception:
+            return {}
+
     def act(self, observation):
+        with tracer.span("agent.act"):
+            return self._act(observation)
+
+    def _act(self, observation):
         num_attempts = 5
         for i in range(num_attempts):
             try:
                 # Execute the action function
-                action, self.memory_dict = self.exec_globals["action_function"](observation, self.memory_dict)
+                with tracer.span("action_function"):
+                    if self.policy is not None:
+                        return self.policy.act(observation)
+                    action, self.memory_dict = self.exec_globals["action_function"](observation, self.memory_dict)
                 return action
             except Exception as e:
-                # In case of an error, ask the assistant to redefine the function
-                print(
-                    f"Error in action function : {e}, trying to redefine it. ({i+1}/{num_attempts})"
-                )
-                self.messages.append(
-                    {
-                        "role": "user",
-                        "content": (
-                            f"An error happened when executing action_function. The observation was {observation}. The memory dict was {self.memory_dict}. The error was: {e}. "
-                            "Please redefine the action function so that it works correctly."
-                            f"{self.formalism}"
-                        ),
-                    }
-                )
-                self.ask_for_action_function()
+                # In case of an error, install the known fix of this error or ask the assistant to redefine the function
+                error = e.exec_error if isinstance(e, PolicyError) else capture_error(e, self.action_function_source)
+                print(f"Error in action function : {error}, trying to redefine it. ({i+1}/{num_attempts})")
+                if self.version is None:
+                    self.repair(error, observation)
+                    continue
+                self.registry.record_crash(self.version)
+                fixed = self.registry.fix(self.version, error.signature)
+                if fixed is not None and fixed != self.version:
+                    print(f"Installing the known fix {fixed} of error {error.signature}.")
+                    self.activate(fixed)
+                else:
+                    self.repair(error, observation)
 
+        # Fall back to the best version that never failed
+        best = self.registry.best(self.score_key)
+        if best is not None and best != self.version:
+            print(f"Rolling back to the best action function {best}.")
+            self.activate(best)
+            return self._act(observation)
         print("MESSAGES:")
         print(self.messages)
         raise ValueError("Action function could not be defined correctly.")
 
+    def repair(self, error, observation):
+        """
+        Asks for a fixed action function in a single request, which describes the error and the other distinct
+        errors of the function found by a quick evaluation, instead of discovering them one request at a time.
+
+        :param error: ExecError, the error raised during the episode.
+        :param observation: The observation on which the function failed.
+        """
+        failed_version = self.version
+        memory_dict = self.current_memory_dict()
+        errors = [(error, 1)]
+        if n_repair_eval_episodes > 0 and self.action_function_source is not None:
+            stats = evaluate_action_function(
+                self.action_function_source,
+                range(n_repair_eval_episodes),
+                env_kwargs=env_kwargs,
+                num_workers=n_eval_workers,
+                timeout=eval_episode_timeout,
+            )
+            errors += [
+                (ExecError.from_dict(other), other["count"])
+                for other in stats["exec_errors"]
+                if other["signature"] != error.signature
+            ]
+        description = "\n\n".join(
+            f"Error {k + 1}" + (f" (in {count} of {n_repair_eval_episodes} test episodes)" if k > 0 else "") + f":\n{other.format()}"
+            for k, (other, count) in enumerate(errors)
+        )
+        self.history.append(
+            {
+                "role": "user",
+                "content": (
+                    f"Errors happened when executing action_function. When it failed, the observation was {_short_repr(observation)} "
+                    f"and the memory dict was {_short_repr(memory_dict)}.\n\n{description}\n\n"
+                    "Please redefine the action function so that it works correctly in all these cases."
+                    f"{self.formalism}"
+                ),
+            },
+            kind="error",
+        )
+        self.ask_for_action_function()
+        if failed_version is not None and self.version != failed_version:
+            for other, count in errors:
+                self.registry.record_fix(failed_version, other.signature, self.version)
+
     def extract_function(self, response):
         """
         Extracts a Python function from a string containing reasoning and a code block.
@@ -104,89 +247,338 @@ class Agent:
         else:
             return None
 
+    def make_async_client(self):
+        """Creates the asyncio client, behind the same completion cache as the synchronous one."""
+        client = None
+        if isinstance(self.client.client, LLMClient):
+            client = self.client.client.async_client()  # shares the rate limits of the synchronous client
+        elif self.client.client is not None:
+            from openai import AsyncOpenAI
+
+            client = AsyncOpenAI(api_key=self.client.client.api_key, base_url=self.client.client.base_url)
+        return AsyncCachedClient(client, self.client.cache)
+
+    async def generate_candidates(self, n):
+        """
+        Requests n answers concurrently and scores the function of each answer as soon as it arrives.
+
+        :param n: Integer, the number of candidates.
+        :return: List of tuples (answer, evaluation statistics or None if the answer has no function).
+        """
+        messages = self.history.request_messages()
+        client = self.make_async_client()
+        semaphore = asyncio.Semaphore(max_concurrent_requests)
+        seeds = range(n_candidate_eval_episodes)
+
+        async def score(answer):
+            source = self.extract_function(answer)
+            if source is None:
+                return answer, None
+            # Functions already scored, in this run or an earlier one, are not evaluated again
+            try:
+                version = self.registry.register(source)
+            except SyntaxError:
+                version = None
+            stats = self.registry.score(version, self.candidate_score_key) if version is not None else None
+            if stats is None:
+                # The untrusted candidates run in a worker process, killed if an episode exceeds the timeout
+                stats = await asyncio.to_thread(
+                    evaluate_action_function, source, seeds, env_kwargs=env_kwargs, num_workers=1, timeout=eval_episode_timeout
+                )
+                if version is not None:
+                    self.registry.record_score(version, self.candidate_score_key, stats)
+            return answer, stats
+
+        async def request(i):
+            async with semaphore:
+                if stream_completions:
+                    stream = await client.chat.completions.create(
+                        model=self.model, messages=messages, cache_salt=i, stream=True, stream_options={"include_usage": True}
+                    )
+                    answer = (await consume_async_stream(stream, cancel_after_code=cancel_after_code)).text
+                else:
+                    completion = await client.chat.completions.create(model=self.model, messages=messages, cache_salt=i)
+                    answer = completion.choices[0].message.content
+            return await score(answer)
+
+        try:
+            if use_n_parameter:
+                completion = await client.chat.completions.create(model=self.model, messages=messages, n=n)
+                return await asyncio.gather(*[score(choice.message.content) for choice in completion.choices])
+            return await asyncio.gather(*[request(i) for i in range(n)])
+        finally:
+            if client.client is not None:
+                await client.client.close()
+
+    def ask_for_best_answer(self, n):
+        """Generates n candidate answers and returns the one whose function has the best quick evaluation."""
+        candidates = asyncio.run(self.generate_candidates(n))
+        scored = [(stats["mean_return"], i) for i, (answer, stats) in enumerate(candidates) if stats is not None]
+        print(f"Scores of the {n} candidates: {[round(score, 3) for score, i in scored]}")
+        if not scored:
+            return candidates[0][0]
+        best_score, best_i = max(scored)
+        return candidates[best_i][0]
+
+    def stream_answer(self):
+        """Streams an answer, whose code block is compiled and validated as soon as it is closed."""
+        stream = self.client.chat.completions.create(
+            model=self.model, messages=self.history.request_messages(), stream=True, stream_options={"include_usage": True}
+        )
+        result = consume_stream(stream, cancel_after_code=cancel_after_code)
+        if result.error is not None:
+            print(f"Invalid action function in the streamed answer: {result.error}")
+        elif result.cancelled:
+            print("Stream cancelled after the code block.")
+        return result.text
+
     def ask_for_action_function(self):
+        with tracer.span("agent.ask_for_action_function", cat="llm"):
+            self._ask_for_action_function()
+
+    def _ask_for_action_function(self):
         print(f"Asking the model {self.model} for action function...")
         # Ask the assistant for the action function
-        answer_assistant = (
-            self.client.chat.completions.create(
-                model=self.model,  # Replace with your preferred model
-                messages=self.messages,
+        if n_candidates > 1:
+            answer_assistant = self.ask_for_best_answer(n_candidates)
+        elif stream_completions:
+            answer_assistant = self.stream_answer()
+        else:
+            answer_assistant = (
+                self.client.chat.completions.create(
+                    model=self.model,  # Replace with your preferred model
+                    messages=self.history.request_messages(),
+                )
+                .choices[0]
+                .message.content
             )
-            .choices[0]
-            .message.content
-        )
         print(f"Answer of assistant: {answer_assistant}")
 
         # Extract the action function from the assistant's answer
         action_function = self.extract_function(answer_assistant)
 
         if action_function is not None:
-            # Execute the code to define the action function
-            exec(action_function, self.exec_globals)
-            assert "action_function" in self.exec_globals and callable(
-                self.exec_globals["action_function"]
-            ), "Generated code does not define a callable 'action_function'."
+            self.install_function(action_function)
         else:
             # Unsure an action function was defined earlier
-            assert "action_function" in self.exec_globals, "No action function defined but this is required."
+            assert self.action_function_source is not None, "No action function defined but this is required."
             
         # Add the answer generated to the messages
-        self.messages.append(
+        self.history.append(
             {
                 "role": "assistant",
                 "content": answer_assistant,
-            }
+            },
+            kind="answer",
         )
 
 
-    def learn(self, cum_reward):
-        # Inform the agent of the reward
-        self.messages.append(
+    def install_function(self, source):
+        """Registers the source of an action function (see PolicyRegistry) and makes it the active version."""
+        self.activate(self.registry.register(source))
+
+    def activate(self, version):
+        """
+        Swaps in a version of the action function, in the sandbox worker or in exec_globals.
+
+        The previous function stays in place if the new one can not be imported.
+        """
+        if self.policy is not None:
+            self.policy.load_module(self.registry.module_path(version))
+        else:
+            self.exec_globals["action_function"] = self.registry.load(version)
+        self.registry.activate(version)
+        self.version = version
+        self.action_function_source = self.registry.source(version)
+
+    def rollback_if_regressed(self, stats):
+        """
+        Restores the best version if the evaluation of the active one is worse or has errors.
+
+        :param stats: Dict, the evaluation of the active version.
+        :return: String, the restored version, or None.
+        """
+        best = self.registry.best(self.score_key)
+        if best is None or best == self.version:
+            return None
+        best_return = self.registry.score(best, self.score_key)["mean_return"]
+        if stats["num_errors"] == 0 and stats["mean_return"] >= best_return - rollback_tolerance:
+            return None
+        self.activate(best)
+        return best
+
+    def learn(self, cum_reward, eval_stats=None):
+        # Inform the agent of the reward, and of the statistics of the evaluation episodes if any
+        if eval_stats is not None:
+            result = f"The episode has ended with a cumulative reward of {cum_reward}. Evaluated {format_statistics(eval_stats)}. "
+        else:
+            result = f"The episode has ended with a cumulative reward of {cum_reward}."
+        stats = eval_stats if eval_stats is not None else {"mean_return": cum_reward, "num_errors": 0}
+        self.history.record_episode(self.n_episodes, stats["mean_return"], self.action_function_source)
+        self.n_episodes += 1
+        self.registry.record_score(self.version, self.score_key, stats)
+        restored = self.rollback_if_regressed(stats)
+        if restored is not None:
+            print(f"The action function regressed, rolled back to {restored}.")
+            result += (
+                f" This is worse than the best function so far, which was restored: \n```python\n{self.action_function_source}\n```\n"
+            )
+        self.history.append(
             {
                 "role": "user",
                 "content": (
-                    f"The episode has ended with a cumulative reward of {cum_reward}."
+                    f"{result}"
                     "You can now try to propose an improved action function if you wish so. If so, please follow the same formalism as before."
                     "If you don't, you can simply not output any function in your answer."
                 ),
-            }
+            },
+            kind="result",
         )
         # Ask the assistant for the action function
         self.ask_for_action_function()
 
 
-agent = Agent()
+def _short_repr(value, max_chars=1000):
+    """Returns the repr of a value for the prompt, truncated to max_chars characters."""
+    text = repr(value)
+    return text if len(text) <= max_chars else f"{text[:max_chars]}... ({len(text) - max_chars} more characters)"
 
 
-for ep in range(50):
-    # Initialize environment
-    print(f"Episode {ep}")
-    observation, info = env.reset()
-    agent.reset()
-    terminated = False
-    truncated = False
-    cum_reward = 0
-    t = 0
-    tqdm_bar = tqdm.tqdm(range(100), desc="Running episode")
+def _action_index(action):
+    """Returns the action as an integer for the trajectories, -1 if the action function returned something else."""
+    try:
+        return int(action)
+    except (TypeError, ValueError):
+        return -1
 
-    # Run episode
-    while not (terminated or truncated):
-        env.render()
-        action = agent.act(observation)
-        try:
-            observation, reward, terminated, truncated, info = env.step(action)
-        except Exception as e:
-            print(f"Error at {t} in step: {e}")
-            raise
-
-        # Logging
-        tqdm_bar.update(1)
-        t += 1
-        cum_reward += reward
-
-    # Learning
-    agent.learn(cum_reward=cum_reward)
-
-    tqdm_bar.close()
-    tb_logger.add_scalar("total_reward", cum_reward, ep)
-    print(f"Episode {ep} ended with a cumulative reward of {cum_reward}.")
+
+def load_checkpoint(path):
+    """Returns the checkpoint of a run written by save_checkpoint, or None if there is none."""
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """Writes the checkpoint of a run atomically, so that a crash leaves the previous one intact."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def main():
+    import tensorboardX
+    import tqdm
+
+    # Resume the run from its checkpoint: conversation, action function, next episode and state of the seed generator
+    checkpoint = load_checkpoint(checkpoint_path)
+    start_episode = 0 if checkpoint is None else checkpoint["episode"]
+    if checkpoint is not None:
+        print(f"Resuming the run from episode {start_episode} ({checkpoint_path}).")
+    # Steps logged after the checkpoint by the interrupted run are purged
+    tb_logger = tensorboardX.SummaryWriter(log_dir or f"tensorboard/openai/{name_env}", purge_step=start_episode or None)
+    if trace_path is not None:
+        tracer.enable()
+    env = maze.SimpleMaze(**env_kwargs, **render_kwargs)
+    agent = Agent() if checkpoint is None else Agent(state=checkpoint["agent"])
+    rng = np.random.default_rng(seed)
+    if checkpoint is not None:
+        rng.bit_generator.state = checkpoint["rng_state"]
+    rewards = [] if checkpoint is None else checkpoint["rewards"]
+    recorder = None
+    if trajectory_path is not None:
+        run_path = checkpoint["trajectory_run_path"] if checkpoint is not None else None
+        run_path = run_path or os.path.join(trajectory_path, name_env, time.strftime("%Y%m%d-%H%M%S"))
+        recorder = TrajectoryRecorder(run_path, format=trajectory_format)
+
+    for ep in range(start_episode, n_episodes):
+        # Initialize environment
+        print(f"Episode {ep}")
+        episode_seed = int(rng.integers(2**31))
+        observation, info = env.reset(seed=episode_seed)
+        agent.reset()
+        if recorder is not None:
+            recorder.begin_episode(ep, seed=episode_seed, function_hash=function_hash(agent.action_function_source))
+        terminated = False
+        truncated = False
+        cum_reward = 0
+        t = 0
+        tqdm_bar = tqdm.tqdm(range(100), desc="Running episode")
+
+        # Run episode
+        while not (terminated or truncated):
+            with tracer.span("env.render", cat="env"):
+                env.render()
+            action = agent.act(observation)
+            if recorder is not None:
+                # The maze and the position are updated in place by the step
+                maze_before, agent_pos = observation[0].copy(), np.array(observation[1])
+            try:
+                with tracer.span("env.step", cat="env"):
+                    observation, reward, terminated, truncated, info = env.step(action)
+            except Exception as e:
+                print(f"Error at {t} in step: {e}")
+                raise
+            if recorder is not None:
+                recorder.record(
+                    maze=maze_before, agent_pos=agent_pos, action=_action_index(action), reward=reward, terminated=terminated
+                )
+
+            # Logging
+            tqdm_bar.update(1)
+            t += 1
+            cum_reward += reward
+
+        tqdm_bar.close()
+        if recorder is not None:
+            recorder.end_episode()
+        tb_logger.add_scalar("total_reward", cum_reward, ep)
+        rewards.append(cum_reward)
+        print(f"Episode {ep} ended with a cumulative reward of {cum_reward}.")
+
+        # Evaluation of the action function over several seeds, in parallel
+        eval_stats = None
+        if n_eval_episodes > 0:
+            seeds = range(ep * n_eval_episodes, (ep + 1) * n_eval_episodes)
+            with tracer.span("evaluation", cat="eval"):
+                eval_stats = evaluate_action_function(
+                    agent.action_function_source, seeds, env_kwargs=env_kwargs, num_workers=n_eval_workers, timeout=eval_episode_timeout
+                )
+            for key in ["mean_return", "std_return", "success_rate", "mean_steps", "num_errors"]:
+                tb_logger.add_scalar(f"eval/{key}", eval_stats[key], ep)
+            print(f"Action function evaluated {format_statistics(eval_stats)}.")
+
+        # Learning
+        agent.learn(cum_reward=cum_reward, eval_stats=eval_stats)
+        if tracer.enabled:
+            totals = tracer.log_episode(tb_logger, ep)
+            print("Time spent: " + ", ".join(f"{name} {total:.0f}ms" for name, total in sorted(totals.items())))
+        if checkpoint_path is not None:
+            if recorder is not None:
+                recorder.flush(sync=True)  # the trajectories of the episodes of the checkpoint are on disk before it
+            save_checkpoint(
+                checkpoint_path,
+                {
+                    "episode": ep + 1,
+                    "agent": agent.state_dict(),
+                    "rng_state": rng.bit_generator.state,
+                    "rewards": rewards,
+                    "trajectory_run_path": recorder.path if recorder is not None else None,
+                },
+            )
+
+    tb_logger.close()
+    if recorder is not None:
+        recorder.close()
+    if trace_path is not None:
+        tracer.export_chrome_trace(trace_path)
+        print(f"Trace of the run written to {trace_path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,64 @@
-import jax
-from jax import numpy as jnp
-from craftax.craftax_env import make_craftax_env_from_name
-
-rng = jax.random.PRNGKey(0)
-rng, _rng = jax.random.split(rng)
-rngs = jax.random.split(_rng, 3)
-
-# Create environment
-env = make_craftax_env_from_name("Craftax-Symbolic-v1", auto_reset=True)
-env_params = env.default_params
-
-# Get an initial state and observation
-obs, state = env.reset(rngs[0], env_params)
-print(f"Initial observation: {obs}, shape : {obs.shape}")
-print(f"Initial state: {state}")
-
-# Pick random action
-action = env.action_space(env_params).sample(rngs[1])
-
-# Step environment
-obs, state, reward, done, info = env.step(rngs[2], state, action, env_params)
-print(f"Observation after stepping: {obs}")
-print(f"State after stepping: {state}")
-print(f"Reward: {reward}")
-print(f"Done: {done}")
-print(f"Info: {info}")
\ No newline at end of file
+import argparse
+import time
+
+# jax and craftax are imported by main(), so that importing this script does not load them nor start a rollout
+
+parser = argparse.ArgumentParser(description="Batched random rollouts in Craftax.")
+parser.add_argument("--env", default="Craftax-Symbolic-v1")
+parser.add_argument("--num_envs", type=int, default=1024)
+parser.add_argument("--num_steps", type=int, default=1000, help="Steps of each environment per jitted rollout")
+parser.add_argument("--num_chunks", type=int, default=1)
+parser.add_argument("--host_policy", action="store_true", help="Run the policy in NumPy through a host callback")
+parser.add_argument("--reset_ratio", type=int, default=16, help="Environments per generated world, 0 to reset each one")
+parser.add_argument("--seed", type=int, default=0)
+
+
+def main(args):
+    import jax
+    import numpy as np
+    from craftax.craftax_env import make_craftax_env_from_name
+
+    from src.craftax_rollout import CraftaxRollout
+
+    # Create environment
+    env = make_craftax_env_from_name(args.env, auto_reset=True)
+    env_params = env.default_params
+    num_actions = env.action_space(env_params).n
+
+    # Random policies, batched over the environments
+    if args.host_policy:
+        np_rng = np.random.default_rng(args.seed)
+
+        def policy(obs):
+            return np_rng.integers(0, num_actions, size=len(obs))
+
+    else:
+
+        def policy(rng, obs):
+            return jax.random.randint(rng, (obs.shape[0],), 0, num_actions)
+
+    runner = CraftaxRollout(
+        env, env_params, policy, args.num_envs, args.num_steps, host_policy=args.host_policy, reset_ratio=args.reset_ratio or None
+    )
+    carry = runner.init(jax.random.PRNGKey(args.seed))
+    start = time.perf_counter()
+    carry = jax.block_until_ready(runner.rollout(carry))
+    print(f"Compilation and first rollout: {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    for _ in range(args.num_chunks - 1):
+        carry = runner.rollout(carry)
+    carry = jax.block_until_ready(carry)
+    if args.num_chunks > 1:
+        n_steps = (args.num_chunks - 1) * args.num_envs * args.num_steps
+        print(f"{n_steps / (time.perf_counter() - start):.0f} steps/s")
+
+    stats = runner.statistics(carry)
+    print(f"Steps: {stats['num_steps']}, episodes: {stats['num_episodes']}")
+    print(f"Mean return: {stats['mean_return']:.2f}, mean length: {stats['mean_length']:.1f}")
+    for name, rate in stats["achievements"].items():
+        if rate > 0:
+            print(f"  {name}: {rate:.1%}")
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
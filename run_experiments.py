@@ -0,0 +1,182 @@
+import argparse
+import collections
+import inspect
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+import miniproject_llm4controller as controller
+
+# Short names of the grid axes, the other keys are globals of the controller or arguments of SimpleMaze
+ALIASES = {"model": "llm_model", "provider": "llm_provider"}
+
+parser = argparse.ArgumentParser(
+    description="Run a sweep of controller runs (e.g. maze sizes x dynamic x models x seeds) in parallel processes, "
+    "each resumable from its checkpoint."
+)
+parser.add_argument("spec", help='JSON file {"name", "base": {global: value}, "grid": {global or maze argument: [values]}}')
+parser.add_argument("--output_dir", default="experiments")
+parser.add_argument("--max_parallel", type=int, default=2, help="Runs executed at the same time")
+parser.add_argument("--llm_budget", type=int, default=8, help="LLM requests in flight over all the runs, 0 for no bound")
+parser.add_argument("--max_attempts", type=int, default=3, help="Attempts of a failing run, each resumed from its checkpoint")
+parser.add_argument("--dry_run", action="store_true", help="Only list the runs and their status")
+
+
+def expand_grid(spec):
+    """
+    Returns the runs of a sweep, as a dictionary {run id: overrides of the controller globals}, in the order of the grid.
+    The run id names the value of each axis with more than one value, e.g. "size=25x25-dynamic=True-seed=1".
+    """
+    base = dict(spec.get("base", {}))
+    grid = spec.get("grid", {})
+    # Arguments of the maze that a run can set in its env_kwargs (the rendering ones come from render_kwargs)
+    maze_arguments = set(inspect.signature(controller.maze.SimpleMaze.__init__).parameters) - {"self"}
+    maze_arguments -= set(controller.render_kwargs) | {"video_path"}
+    runs = {}
+    for values in itertools.product(*grid.values()):
+        point = dict(zip(grid, values))
+        run_id = "-".join(f"{key}={_format_value(value)}" for key, value in point.items() if len(grid[key]) > 1) or "run"
+        overrides = dict(base)
+        env_kwargs = dict(overrides.get("env_kwargs", controller.env_kwargs))
+        for key, value in point.items():
+            key = ALIASES.get(key, key)
+            if key in env_kwargs:
+                env_kwargs[key] = tuple(value) if isinstance(value, list) else value
+            elif hasattr(controller, key):
+                overrides[key] = value
+            elif key in maze_arguments:
+                env_kwargs[key] = tuple(value) if isinstance(value, list) else value
+            else:
+                raise ValueError(f"Unknown grid axis {key}, neither a global of the controller nor an argument of SimpleMaze.")
+        overrides["env_kwargs"] = env_kwargs
+        runs[run_id] = overrides
+    return runs
+
+
+def _format_value(value):
+    if isinstance(value, (list, tuple)):
+        return "x".join(str(v) for v in value)
+    return str(value).replace("/", "_")
+
+
+def run_config(run_dir, overrides, n_eval_workers):
+    """Returns the globals of the controller for a run, with all its outputs in its directory."""
+    config = {
+        "n_eval_workers": n_eval_workers,
+        "render_kwargs": {"render_mode": None, "render_every": 1},
+        **overrides,
+        "log_dir": os.path.join(run_dir, "tensorboard"),
+        "checkpoint_path": os.path.join(run_dir, "checkpoint.json"),
+        "trajectory_path": os.path.join(run_dir, "trajectories") if overrides.get("trajectory_path", "") is not None else None,
+        "trace_path": os.path.join(run_dir, "trace.json") if overrides.get("trace_path", "") is not None else None,
+        "policy_registry_path": os.path.join(run_dir, "policies"),
+        # Each run has its own completion cache, or the runs of different seeds would get the same answers
+        "llm_cache_path": os.path.join(run_dir, "llm_completions.sqlite"),
+    }
+    return config
+
+
+def read_status(run_dir):
+    path = os.path.join(run_dir, "status.json")
+    if not os.path.exists(path):
+        return {"status": "pending", "attempts": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_status(run_dir, **status):
+    checkpoint = controller.load_checkpoint(os.path.join(run_dir, "checkpoint.json"))
+    if checkpoint is not None:
+        status["episode"] = checkpoint["episode"]
+        status["rewards"] = checkpoint["rewards"]
+    tmp_path = os.path.join(run_dir, "status.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, os.path.join(run_dir, "status.json"))
+
+
+def _run(run_dir, config, llm_slots):
+    """Entry point of the process of a run: its output goes to log.txt and it resumes from its checkpoint."""
+    # Termination by the scheduler unwinds the stack, so that the LLM slots held by the run are released
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    log = open(os.path.join(run_dir, "log.txt"), "a", buffering=1)
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+    print(f"\n=== {time.strftime('%Y-%m-%d %H:%M:%S')} pid {os.getpid()} ===")
+    for name, value in config.items():
+        setattr(controller, name, value)
+    controller.llm_slots = llm_slots
+    controller.main()
+
+
+def main(args):
+    with open(args.spec) as f:
+        spec = json.load(f)
+    name = spec.get("name") or os.path.splitext(os.path.basename(args.spec))[0]
+    sweep_dir = os.path.join(args.output_dir, name)
+    runs = expand_grid(spec)
+    n_eval_workers = max(1, (os.cpu_count() or 1) // args.max_parallel)
+
+    pending = collections.deque()
+    for run_id, overrides in runs.items():
+        run_dir = os.path.join(sweep_dir, run_id)
+        status = read_status(run_dir)
+        print(f"{run_id:<48} {status['status']:<12} episode {status.get('episode', 0)}")
+        if status["status"] != "done":
+            pending.append((run_id, status["attempts"]))
+    if args.dry_run or not pending:
+        return
+
+    # The processes are forked so that the semaphore of the LLM budget is shared by all the runs
+    ctx = multiprocessing.get_context("fork")
+    llm_slots = ctx.BoundedSemaphore(args.llm_budget) if args.llm_budget > 0 else None
+    running = {}  # sentinel: (run_id, attempts, process)
+    print(f"Running {len(pending)} runs of {name}, {args.max_parallel} at a time.")
+    try:
+        while pending or running:
+            while pending and len(running) < args.max_parallel:
+                run_id, attempts = pending.popleft()
+                run_dir = os.path.join(sweep_dir, run_id)
+                os.makedirs(run_dir, exist_ok=True)
+                config = run_config(run_dir, runs[run_id], n_eval_workers)
+                with open(os.path.join(run_dir, "config.json"), "w") as f:
+                    json.dump(config, f, indent=2)
+                process = ctx.Process(target=_run, args=(run_dir, config, llm_slots), name=run_id)
+                process.start()
+                running[process.sentinel] = (run_id, attempts + 1, process)
+                write_status(run_dir, status="running", attempts=attempts + 1, pid=process.pid)
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                run_id, attempts, process = running.pop(sentinel)
+                process.join()
+                run_dir = os.path.join(sweep_dir, run_id)
+                if process.exitcode == 0:
+                    status = "done"
+                elif attempts < args.max_attempts:
+                    status = "retrying"
+                    pending.append((run_id, attempts))
+                else:
+                    status = "failed"
+                write_status(run_dir, status=status, attempts=attempts, exitcode=process.exitcode)
+                print(f"{run_id}: {status} (attempt {attempts}, exit code {process.exitcode}), see {run_dir}/log.txt")
+    except KeyboardInterrupt:
+        print("Interrupted, the runs resume from their checkpoint on the next call.")
+        for run_id, attempts, process in running.values():
+            process.terminate()
+            process.join()
+            write_status(os.path.join(sweep_dir, run_id), status="interrupted", attempts=attempts - 1)
+        sys.exit(130)
+
+    for run_id in runs:
+        status = read_status(os.path.join(sweep_dir, run_id))
+        rewards = status.get("rewards") or [0]
+        print(f"{run_id:<48} {status['status']:<12} mean reward of the last 10 episodes {sum(rewards[-10:]) / len(rewards[-10:]):.2f}")
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
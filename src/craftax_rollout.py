@@ -0,0 +1,169 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+
+def _add_wide(counter, amount):
+    """
+    Adds to counters of 64 bits stored as (low, high) uint32 words in their last axis: JAX runs without x64 by default,
+    and int32 counts of steps overflow after 2**31, which large batched runs reach.
+
+    :param counter: uint32 array of shape (..., 2).
+    :param amount: Non-negative integer array of shape (...), smaller than 2**32.
+    """
+    amount = amount.astype(jnp.uint32)
+    low = counter[..., 0] + amount
+    high = counter[..., 1] + (low < amount).astype(jnp.uint32)  # the low word wrapped around
+    return jnp.stack([low, high], axis=-1)
+
+
+def _wide_value(counter):
+    """Returns the values of counters of _add_wide on the host, as int64."""
+    counter = np.asarray(counter, dtype=np.uint64)
+    return (counter[..., 0] + (counter[..., 1] << np.uint64(32))).astype(np.int64)
+
+
+class CraftaxRollout:
+    def __init__(self, env, env_params, policy, num_envs, num_steps, host_policy=False, reset_ratio=None):
+        """
+        Batched rollouts of a Craftax environment, with reset/step vmapped over the environments and the
+        time loop run by jax.lax.scan inside a single jitted function.
+
+        The policy is batched, it receives the observations of all the environments at once:
+        - if host_policy is False, policy(rng, obs) -> actions must be traceable by JAX, and the whole rollout is jitted.
+        - if host_policy is True, policy(obs) -> actions is any Python/NumPy function, called once per step
+          through jax.pure_callback with obs as a (num_envs, obs_dim) numpy array.
+
+        Episode returns, lengths and achievements are accumulated on the device, only the final statistics are copied back.
+
+        Craftax auto-resets by generating a new world at every step for every environment, which dominates the cost
+        of a step. With a reset_ratio, only num_envs // reset_ratio worlds are generated per step and the environments
+        that are done draw one of them at random (two environments may then restart from the same world).
+
+        :param env: The Craftax environment, e.g. make_craftax_env_from_name("Craftax-Symbolic-v1", auto_reset=True).
+        :param env_params: The parameters of the environment.
+        :param policy: The batched policy, returning num_envs integer actions.
+        :param num_envs: Integer, the number of environments stepped in parallel.
+        :param num_steps: Integer, the number of steps of each environment in one call to rollout().
+        :param host_policy: Boolean, if True, the policy is called on the host instead of being traced.
+        :param reset_ratio: Integer, the number of environments per generated world, None to let the environment auto-reset.
+        """
+        self.env = env
+        self.env_params = env_params
+        self.policy = policy
+        self.num_envs = num_envs
+        self.num_steps = num_steps
+        self.host_policy = host_policy
+        self.reset_ratio = reset_ratio
+        self._reset = jax.vmap(env.reset, in_axes=(0, None))
+        if reset_ratio is None:
+            self._step = jax.vmap(env.step, in_axes=(0, 0, 0, None))
+        else:
+            self.num_resets = max(1, num_envs // reset_ratio)
+            self._step_env = jax.vmap(env.step_env, in_axes=(0, 0, 0, None))
+            self._reset_env = jax.vmap(env.reset_env, in_axes=(0, None))
+            self._step = self._optimistic_step
+
+        # Achievements are logged in the info dict (non-zero at the end of an episode), their names come from its structure
+        def first_step(rng):
+            obs, state = self._reset(jax.random.split(rng, num_envs), env_params)
+            return self._step(jax.random.split(rng, num_envs), state, jnp.zeros(num_envs, jnp.int32), env_params)
+
+        info = jax.eval_shape(first_step, jax.random.PRNGKey(0))[4]
+        self.achievement_keys = sorted(key for key in info if key.startswith("Achievements/"))
+        self.achievement_names = [key.split("/", 1)[1] for key in self.achievement_keys]
+
+        self.init = jax.jit(self._init)
+        self.rollout = jax.jit(self._rollout)
+
+    def _optimistic_step(self, rngs, state, actions, env_params):
+        """Vmapped step where the environments that are done restart from one of num_resets new worlds."""
+        obs, state, reward, done, info = self._step_env(rngs, state, actions, env_params)
+        rng_reset, rng_choice = jax.random.split(jax.random.fold_in(rngs[0], 1))
+        obs_reset, state_reset = self._reset_env(jax.random.split(rng_reset, self.num_resets), env_params)
+        chosen = jax.random.randint(rng_choice, (self.num_envs,), 0, self.num_resets)
+
+        def select(reset, current):
+            mask = done.reshape(done.shape + (1,) * (current.ndim - 1))
+            return jnp.where(mask, reset[chosen], current)
+
+        state = jax.tree_util.tree_map(select, state_reset, state)
+        return select(obs_reset, obs), state, reward, done, info
+
+    def _act(self, rng, obs):
+        if not self.host_policy:
+            return self.policy(rng, obs).astype(jnp.int32)
+
+        def callback(obs):
+            return np.asarray(self.policy(np.asarray(obs)), dtype=np.int32)
+
+        return jax.pure_callback(callback, jax.ShapeDtypeStruct((self.num_envs,), jnp.int32), obs)
+
+    def _init(self, rng):
+        """Resets all the environments, returns the carry (rng, state, obs, episode returns and lengths, stats) of the rollouts."""
+        rng, rng_reset = jax.random.split(rng)
+        obs, state = self._reset(jax.random.split(rng_reset, self.num_envs), self.env_params)
+        stats = {
+            "num_episodes": jnp.zeros(2, jnp.uint32),
+            "sum_returns": jnp.zeros((), jnp.float32),
+            "sum_lengths": jnp.zeros(2, jnp.uint32),
+            "num_steps": jnp.zeros(2, jnp.uint32),
+            "achievement_counts": jnp.zeros((len(self.achievement_keys), 2), jnp.uint32),
+        }
+        episode_returns = jnp.zeros(self.num_envs, jnp.float32)
+        episode_lengths = jnp.zeros(self.num_envs, jnp.int32)
+        return rng, state, obs, episode_returns, episode_lengths, stats
+
+    def _scan_step(self, carry, _):
+        rng, state, obs, episode_returns, episode_lengths, stats = carry
+        rng, rng_act, rng_step = jax.random.split(rng, 3)
+        actions = self._act(rng_act, obs)
+        obs, state, reward, done, info = self._step(jax.random.split(rng_step, self.num_envs), state, actions, self.env_params)
+        episode_returns = episode_returns + reward
+        episode_lengths = episode_lengths + 1
+        achievements = jnp.stack([info[key] for key in self.achievement_keys], axis=-1) > 0
+        stats = {
+            "num_episodes": _add_wide(stats["num_episodes"], done.sum()),
+            "sum_returns": stats["sum_returns"] + jnp.where(done, episode_returns, 0.0).sum(),
+            "sum_lengths": _add_wide(stats["sum_lengths"], jnp.where(done, episode_lengths, 0).sum()),
+            "num_steps": _add_wide(stats["num_steps"], jnp.asarray(self.num_envs)),
+            "achievement_counts": _add_wide(stats["achievement_counts"], (achievements & done[:, None]).sum(axis=0)),
+        }
+        episode_returns = jnp.where(done, 0.0, episode_returns)
+        episode_lengths = jnp.where(done, 0, episode_lengths)
+        return (rng, state, obs, episode_returns, episode_lengths, stats), None
+
+    def _rollout(self, carry):
+        """Runs num_steps steps in every environment, returns the new carry."""
+        carry, _ = jax.lax.scan(self._scan_step, carry, None, length=self.num_steps)
+        return carry
+
+    def statistics(self, carry):
+        """
+        Copies the statistics of the episodes completed so far to the host.
+
+        :return: Dictionary with num_episodes, num_steps, mean_return, mean_length and the success rate of each achievement.
+        """
+        stats = jax.device_get(carry[-1])
+        num_episodes = int(_wide_value(stats["num_episodes"]))
+        denominator = max(num_episodes, 1)
+        return {
+            "num_episodes": num_episodes,
+            "num_steps": int(_wide_value(stats["num_steps"])),
+            "mean_return": float(stats["sum_returns"]) / denominator,
+            "mean_length": int(_wide_value(stats["sum_lengths"])) / denominator,
+            "achievements": dict(zip(self.achievement_names, (_wide_value(stats["achievement_counts"]) / denominator).tolist())),
+        }
+
+    def run(self, seed=0, num_chunks=1):
+        """
+        Runs num_chunks calls of rollout() (num_envs * num_steps * num_chunks steps in total), episodes continuing across chunks.
+
+        :param seed: Integer, the seed of the environments and of the JAX policy.
+        :param num_chunks: Integer, the number of rollouts.
+        :return: The statistics of the completed episodes, see statistics().
+        """
+        carry = self.init(jax.random.PRNGKey(seed))
+        for _ in range(num_chunks):
+            carry = self.rollout(carry)
+        return self.statistics(carry)
@@ -0,0 +1,172 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Distance of walls and of the cells from which the goal can not be reached
+UNREACHABLE = np.iinfo(np.int32).max // 2
+
+# Initial distance fields of the last layouts, keyed by a hash of the maze and the goal
+_cache = OrderedDict()
+CACHE_MAX_BYTES = 256 * 1024 ** 2
+_cache_bytes = 0
+
+# Fraction of toggled cells above which a full recompute is faster than the incremental update, measured by the
+# distance.update benchmarks of benchmarks/throughput.py (about 10-20 toggled cells in a 100x100 maze with 25% walls)
+INCREMENTAL_MAX_RATIO = 2e-3
+
+
+def _neighbor_offsets(width):
+    """Offsets of the 4 neighbors of a cell in a flat padded grid of the given width."""
+    return np.array([-width, 1, width, -1])
+
+
+def _bfs(free, sources, dist, offsets):
+    """Frontier-based BFS from the sources (whose distance is set) over the free cells, in place."""
+    frontier = sources
+    d = 0
+    while frontier.size > 0:
+        d += 1
+        neighbors = (frontier[:, None] + offsets).ravel()
+        neighbors = np.unique(neighbors[free[neighbors] & (dist[neighbors] == UNREACHABLE)])
+        dist[neighbors] = d
+        frontier = neighbors
+
+
+def _relax(free, frontier, dist, offsets):
+    """Propagates distance decreases from the frontier cells until no distance changes, in place."""
+    while frontier.size > 0:
+        neighbors = frontier[:, None] + offsets
+        candidate = np.broadcast_to(dist[frontier][:, None] + 1, neighbors.shape)
+        improved = free[neighbors] & (candidate < dist[neighbors])
+        neighbors, candidate = neighbors[improved], candidate[improved]
+        np.minimum.at(dist, neighbors, candidate)
+        frontier = np.unique(neighbors)
+
+
+def _cache_put(key, dist):
+    """Adds a field to the LRU cache, evicting the oldest ones above CACHE_MAX_BYTES."""
+    global _cache_bytes
+    _cache[key] = dist
+    _cache_bytes += dist.nbytes
+    while _cache_bytes > CACHE_MAX_BYTES and len(_cache) > 1:
+        _cache_bytes -= _cache.popitem(last=False)[1].nbytes
+
+
+class DistanceField:
+    def __init__(self, maze, goal_pos, use_cache=True, distances=None):
+        """
+        Shortest-path distance (in steps) from every cell of a maze to the goal, computed by BFS.
+
+        The grid is stored flat with a border of walls, so that neighbors never go out of bounds.
+        Walls and cells that can not reach the goal have the distance UNREACHABLE.
+
+        :param maze: 2D array, 1 for walls and 0 for empty cells.
+        :param goal_pos: Tuple (r, c), the position of the goal.
+        :param use_cache: Boolean, if True, the field of a layout already seen is copied from the cache.
+        :param distances: 2D array, the distances of the maze if they are already known (e.g. from a layout bank).
+        """
+        self.rows, self.cols = maze.shape
+        self.width = self.cols + 2
+        self.offsets = _neighbor_offsets(self.width)
+        self.goal_pos = tuple(goal_pos)
+        self.free = np.zeros((self.rows + 2) * self.width, dtype=bool)
+        self._inner(self.free)[...] = maze == 0
+
+        if distances is not None:
+            self.dist = np.full(self.free.shape, UNREACHABLE, dtype=np.int32)
+            self._inner(self.dist)[...] = distances
+            return
+        key = None
+        if use_cache:
+            key = hashlib.blake2b(self.free.tobytes() + repr(self.goal_pos).encode(), digest_size=16).digest()
+            if key in _cache:
+                _cache.move_to_end(key)
+                self.dist = _cache[key].copy()
+                return
+        self.recompute()
+        if key is not None:
+            _cache_put(key, self.dist.copy())
+
+    def _inner(self, flat):
+        """View of the cells of the maze (without the border) in a flat padded array."""
+        return flat.reshape(self.rows + 2, self.width)[1:-1, 1:-1]
+
+    def _padded(self, cells):
+        """Converts flat indices of the maze to flat indices of the padded grid."""
+        return (cells // self.cols + 1) * self.width + cells % self.cols + 1
+
+    @property
+    def distances(self):
+        """Read-only (rows, cols) view of the distances."""
+        view = self._inner(self.dist)
+        view.flags.writeable = False
+        return view
+
+    def distance(self, pos):
+        """Returns the distance from a position to the goal (UNREACHABLE if the goal can not be reached)."""
+        return int(self.dist[(pos[0] + 1) * self.width + pos[1] + 1])
+
+    def recompute(self):
+        """Computes the whole field from scratch."""
+        self.dist = np.full(self.free.shape, UNREACHABLE, dtype=np.int32)
+        goal = np.array([(self.goal_pos[0] + 1) * self.width + self.goal_pos[1] + 1])
+        self.dist[goal] = 0
+        _bfs(self.free, goal, self.dist, self.offsets)
+
+    def update(self, cells, maze, full_recompute_ratio=INCREMENTAL_MAX_RATIO):
+        """
+        Updates the field after some cells of the maze were toggled, only recomputing the affected cells.
+
+        Closed cells invalidate the cells whose shortest paths all went through them, level by level,
+        then the invalidated and opened cells get their distance back from their valid neighbors.
+        This only pays off for sparse toggles: at the default wall change rate of SimpleMaze (5% of the cells per
+        step) the field is always recomputed from scratch, the incremental update is used below about 0.2%.
+
+        :param cells: Array of flat indices (r * cols + c) of the toggled cells.
+        :param maze: 2D array, the maze after the toggles.
+        :param full_recompute_ratio: Float, above this fraction of toggled cells the field is recomputed from scratch,
+            which is faster as the cost of the incremental update grows with the depth of the affected regions.
+        """
+        cells = self._padded(np.asarray(cells, dtype=np.int64))
+        self._inner(self.free)[...] = maze == 0
+        if len(cells) > full_recompute_ratio * self.rows * self.cols:
+            self.recompute()
+            return
+
+        opened = cells[self.free[cells] & (self.dist[cells] == UNREACHABLE)]
+        closed = cells[~self.free[cells] & (self.dist[cells] != UNREACHABLE)]
+
+        # Invalidate the cells that depended on the closed cells, in increasing order of distance
+        closed_levels = self.dist[closed]
+        self.dist[closed] = UNREACHABLE
+        invalid = [closed]
+        if closed.size > 0:
+            level = closed_levels.min()
+            frontier = closed[closed_levels == level]  # invalid cells at distance level
+            while True:
+                # A child loses its distance if none of its other neighbors is still at distance level
+                children = (frontier[:, None] + self.offsets).ravel()
+                children = np.unique(children[self.free[children] & (self.dist[children] == level + 1)])
+                has_parent = (self.dist[children[:, None] + self.offsets] == level).any(axis=1)
+                lost = children[~has_parent]
+                self.dist[lost] = UNREACHABLE
+                invalid.append(lost)
+                level += 1
+                frontier = np.concatenate([lost, closed[closed_levels == level]])
+                if frontier.size == 0:
+                    remaining = closed_levels[closed_levels > level]
+                    if remaining.size == 0:
+                        break
+                    level = remaining.min()
+                    frontier = closed[closed_levels == level]
+
+        # Distance of the invalidated and opened cells from their valid neighbors, then propagation of the decreases
+        seeds = np.unique(np.concatenate(invalid + [opened]))
+        seeds = seeds[self.free[seeds]]
+        if seeds.size > 0:
+            neighbor_dist = self.dist[seeds[:, None] + self.offsets].min(axis=1)
+            reachable = neighbor_dist < UNREACHABLE
+            seeds = seeds[reachable]
+            self.dist[seeds] = neighbor_dist[reachable] + 1
+            _relax(self.free, seeds, self.dist, self.offsets)
@@ -0,0 +1,227 @@
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.exec_errors import ExecError, capture_error, compile_generated, group_errors
+from src.maze import SimpleMaze
+
+# State of a worker process, set once by _init_worker
+_worker_action_function = None
+_worker_load_error = None
+_worker_env = None
+_worker_source = None
+
+
+def load_action_function(source):
+    """
+    Executes the source of a generated action function in a fresh namespace.
+
+    :param source: String, the code defining action_function(observation, memory_dict).
+    :return: The action_function callable.
+    """
+    exec_globals = {}
+    exec(compile_generated(source), exec_globals)
+    assert "action_function" in exec_globals and callable(
+        exec_globals["action_function"]
+    ), "Generated code does not define a callable 'action_function'."
+    return exec_globals["action_function"]
+
+
+def run_episode(action_function, env, seed, source=None):
+    """
+    Runs one episode of the action function in the environment.
+
+    :param action_function: Callable (observation, memory_dict) -> (action, memory_dict).
+    :param env: The environment, reset with the given seed (which selects the layout if it has a layout bank).
+    :param seed: Integer, the seed of the episode.
+    :param source: String, the source of the action function, to report the lines of its errors.
+    :return: Dict with the seed, the return, the number of steps, whether the goal was reached, the error if any
+        (as a string, and structured under exec_error, see ExecError.to_dict) and the optimal number of steps if
+        the environment has a distance field.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    observation, info = env.reset(seed=seed)
+    optimal_steps = info.get("optimal_steps")
+    memory_dict = {}
+    cum_reward, t, reward, error = 0, 0, 0, None
+    terminated = truncated = False
+    while not (terminated or truncated):
+        try:
+            action, memory_dict = action_function(observation, memory_dict)
+            observation, reward, terminated, truncated, info = env.step(action)
+        except Exception as e:
+            error = capture_error(e, source)
+            break
+        cum_reward += reward
+        t += 1
+    return {
+        "seed": seed,
+        "return": cum_reward,
+        "steps": t,
+        "success": reward == 1,
+        "error": None if error is None else str(error),
+        "exec_error": None if error is None else error.to_dict(),
+        "optimal_steps": optimal_steps,
+    }
+
+
+def _load(source):
+    """Returns the action function of the source and the error (ExecError) raised when loading it, if any."""
+    try:
+        return load_action_function(source), None
+    except Exception as e:
+        return None, capture_error(e, source)
+
+
+def _error_result(seed, error):
+    """Result of an episode that could not run, see run_episode."""
+    return {
+        "seed": seed,
+        "return": 0,
+        "steps": 0,
+        "success": False,
+        "error": str(error),
+        "exec_error": error.to_dict(),
+        "optimal_steps": None,
+    }
+
+
+def _run_episodes(action_function, load_error, env, seeds, source=None):
+    if load_error is not None:
+        return [_error_result(seed, load_error) for seed in seeds]
+    return [run_episode(action_function, env, seed, source) for seed in seeds]
+
+
+def _init_worker(source, env_kwargs):
+    """Loads the action function and builds the environment once per worker process."""
+    global _worker_action_function, _worker_load_error, _worker_env, _worker_source
+    _worker_action_function, _worker_load_error = _load(source)
+    _worker_env = SimpleMaze(**env_kwargs)
+    _worker_source = source
+
+
+def _run_worker_episode(seed):
+    return _run_episodes(_worker_action_function, _worker_load_error, _worker_env, [seed], _worker_source)[0]
+
+
+def aggregate_results(results):
+    """
+    Aggregates per-episode results into summary statistics.
+
+    :param results: List of dicts as returned by run_episode.
+    :return: Dict of statistics over the episodes, with the per-episode results under "episodes".
+    """
+    returns = np.array([r["return"] for r in results], dtype=np.float64)
+    steps = np.array([r["steps"] for r in results], dtype=np.float64)
+    errors = [r["error"] for r in results if r["error"] is not None]
+    # Extra steps taken compared to the shortest path, over the episodes where the goal was reached
+    gaps = [r["steps"] - r["optimal_steps"] for r in results if r["success"] and r["optimal_steps"] is not None]
+    return {
+        "num_episodes": len(results),
+        "mean_return": float(returns.mean()),
+        "std_return": float(returns.std()),
+        "min_return": float(returns.min()),
+        "max_return": float(returns.max()),
+        "success_rate": float(np.mean([r["success"] for r in results])),
+        "mean_steps": float(steps.mean()),
+        "num_errors": len(errors),
+        "errors": sorted(set(errors)),
+        "exec_errors": [
+            {**error.to_dict(), "count": count}
+            for error, count in group_errors(ExecError.from_dict(r["exec_error"]) for r in results if r["exec_error"] is not None)
+        ],
+        "mean_optimality_gap": float(np.mean(gaps)) if gaps else None,
+        "episodes": results,
+    }
+
+
+def _worker_context():
+    """
+    Context of the pools of workers, which are started from a process running other threads (e.g. the event loop
+    scoring the candidates, the trajectory and tensorboard writers): forkserver, as a plain fork could copy a lock held
+    by another thread and deadlock the worker. The server imports the main module and this one once, the workers are
+    forked from it (scripts must then have a __main__ guard).
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", __name__])
+    return context
+
+
+def _run_with_timeout(source, seeds, env_kwargs, num_workers, timeout):
+    """
+    Runs the episodes in a pool of worker processes, which is killed as soon as an episode exceeds the timeout.
+    The episodes that did not finish are reported with a TimeoutError.
+    """
+    pool = _worker_context().Pool(num_workers, initializer=_init_worker, initargs=(source, env_kwargs))
+    try:
+        pending = [(seed, pool.apply_async(_run_worker_episode, (seed,))) for seed in seeds]
+        results = []
+        for i, (seed, result) in enumerate(pending):
+            try:
+                results.append(result.get(timeout))
+            except multiprocessing.TimeoutError:
+                error = ExecError("TimeoutError", f"The episode did not end within {timeout} seconds.")
+                results += [r.get() if r.ready() else _error_result(s, error) for s, r in pending[i:]]
+                break
+    finally:
+        pool.terminate()
+    return results
+
+
+def evaluate_action_function(source, seeds, env_kwargs=None, num_workers=None, timeout=None):
+    """
+    Scores an action function over several episodes, in a pool of worker processes.
+
+    Each worker executes the source of the function once and builds its own SimpleMaze,
+    then runs the episodes of the seeds it is given.
+
+    :param source: String, the code defining action_function(observation, memory_dict).
+    :param seeds: Iterable of integers, one episode is run per seed.
+    :param env_kwargs: Dict, keyword arguments of SimpleMaze (e.g. size, dynamic, layout_bank). The path of a layout
+        bank is opened by each worker, and the memory-mapped layouts are shared by all of them.
+    :param num_workers: Integer, the number of processes (defaults to the number of cores). With 1 or less and no
+        timeout, episodes are run in the current process (thread-safe, each call has its own function and environment).
+    :param timeout: Float, the time budget in seconds of each episode, None for no limit. With a timeout, the episodes
+        always run in worker processes, which are killed if an episode exceeds it (e.g. an infinite loop of the
+        function). That episode and the ones that did not finish get a TimeoutError.
+    :return: Dict of statistics, see aggregate_results.
+    """
+    seeds = list(seeds)
+    env_kwargs = env_kwargs or {}
+    num_workers = min(num_workers or os.cpu_count(), len(seeds))
+
+    if timeout is not None:
+        results = _run_with_timeout(source, seeds, env_kwargs, max(num_workers, 1), timeout)
+    elif num_workers <= 1:
+        action_function, load_error = _load(source)
+        results = _run_episodes(action_function, load_error, SimpleMaze(**env_kwargs), seeds, source)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=_worker_context(),
+            initializer=_init_worker,
+            initargs=(source, env_kwargs),
+        ) as pool:
+            chunksize = max(1, len(seeds) // (4 * num_workers))
+            results = list(pool.map(_run_worker_episode, seeds, chunksize=chunksize))
+    return aggregate_results(results)
+
+
+def format_statistics(stats):
+    """Formats evaluation statistics as a short text for the prompt and the logs."""
+    text = (
+        f"over {stats['num_episodes']} episodes, mean return {stats['mean_return']:.3f} "
+        f"(std {stats['std_return']:.3f}, min {stats['min_return']:.3f}, max {stats['max_return']:.3f}), "
+        f"success rate {stats['success_rate']:.0%}, mean episode length {stats['mean_steps']:.1f} steps"
+    )
+    if stats["mean_optimality_gap"] is not None:
+        text += f", {stats['mean_optimality_gap']:.1f} steps more than the shortest path when reaching the goal"
+    if stats["num_errors"] > 0:
+        text += f", {stats['num_errors']} episodes ended with an error: {'; '.join(stats['errors'][:3])}"
+    return text
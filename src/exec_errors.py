@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import re
+import traceback
+
+# Name given to the code of the generated functions when it is compiled from a string
+GENERATED_FILENAME = "<action_function>"
+# Modules of the policy registry (see PolicyRegistry.module_path)
+_POLICY_MODULE = re.compile(r"policy_[0-9a-f]+\.py$")
+
+
+def compile_generated(source):
+    """Compiles generated code under GENERATED_FILENAME, so that its frames can be found in tracebacks."""
+    return compile(source, GENERATED_FILENAME, "exec")
+
+
+def is_generated(filename):
+    """Returns True if a code filename is the one of a generated function."""
+    return filename == GENERATED_FILENAME or _POLICY_MODULE.search(os.path.basename(filename)) is not None
+
+
+class ExecError:
+    def __init__(self, error_type, message, frames=()):
+        """
+        Structured error raised by generated code.
+
+        :param error_type: String, the name of the exception class.
+        :param message: String, the message of the exception.
+        :param frames: List of dicts {"line", "function", "code"}, the frames of the traceback that are in the
+            generated code (innermost last), with the line number in its source and the text of the line.
+        """
+        self.error_type = error_type
+        self.message = message
+        self.frames = list(frames)
+
+    @property
+    def signature(self):
+        """
+        Hash identifying the failure: the exception type, its message with the numbers masked and the lines
+        of the generated code it went through. The same bug hit with other values has the same signature.
+        """
+        message = re.sub(r"\d+", "N", self.message)[:200]
+        key = [self.error_type, message, [(frame["function"], frame["line"]) for frame in self.frames]]
+        return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:12]
+
+    def __str__(self):
+        text = f"{self.error_type}: {self.message}"
+        if self.frames:
+            frame = self.frames[-1]
+            text += f" (line {frame['line']}, in {frame['function']}: {frame['code']})"
+        return text
+
+    def format(self):
+        """Formats the error with the lines of the generated code it went through, for the prompt."""
+        lines = [f"{self.error_type}: {self.message}"]
+        for frame in self.frames:
+            lines.append(f"  line {frame['line']}, in {frame['function']}: {frame['code']}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"error_type": self.error_type, "message": self.message, "frames": self.frames, "signature": self.signature}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["error_type"], data["message"], data["frames"])
+
+
+def capture_error(exc, source=None):
+    """
+    Extracts the frames of an exception that are in generated code.
+
+    :param exc: The exception.
+    :param source: String, the source of the generated code, used for the text of the lines when it can not be read
+        from the file of the code (code compiled with compile_generated).
+    :return: ExecError. If no frame is in generated code (e.g. the error is raised by the environment), the last frame
+        of the traceback is kept.
+    """
+    source_lines = source.splitlines() if source is not None else []
+
+    def line_text(filename, lineno, text):
+        if filename == GENERATED_FILENAME and 0 < lineno <= len(source_lines):
+            return source_lines[lineno - 1].strip()
+        return (text or "").strip()
+
+    if isinstance(exc, SyntaxError) and exc.filename is not None and is_generated(exc.filename):
+        lineno = exc.lineno or 0
+        frames = [{"line": lineno, "function": "<module>", "code": line_text(exc.filename, lineno, exc.text)}]
+        return ExecError(type(exc).__name__, exc.msg, frames)
+
+    summary = traceback.extract_tb(exc.__traceback__)
+    frames = [frame for frame in summary if is_generated(frame.filename)] or list(summary[-1:])
+    frames = [
+        {"line": frame.lineno, "function": frame.name, "code": line_text(frame.filename, frame.lineno, frame.line)}
+        for frame in frames
+    ]
+    return ExecError(type(exc).__name__, str(exc), frames)
+
+
+def group_errors(errors):
+    """
+    Deduplicates errors by signature.
+
+    :param errors: Iterable of ExecError.
+    :return: List of (ExecError, count), the first error of each signature, most frequent first.
+    """
+    groups = {}
+    for error in errors:
+        if error.signature in groups:
+            groups[error.signature][1] += 1
+        else:
+            groups[error.signature] = [error, 1]
+    return sorted((tuple(group) for group in groups.values()), key=lambda group: -group[1])
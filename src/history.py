@@ -0,0 +1,166 @@
+import hashlib
+from functools import lru_cache
+
+# Tokens added by the chat format around each message
+TOKENS_PER_MESSAGE = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """
+    Counts the tokens of a text locally, with tiktoken if it is installed.
+
+    Without tiktoken, the count is estimated as one token per 4 characters, which is
+    close enough to enforce a budget on English text and code.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def function_hash(source):
+    """Returns a short hash identifying the source of an action function."""
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:8]
+
+
+class ConversationHistory:
+    def __init__(self, max_tokens=12000, n_pinned=2, n_kept_errors=2, model="gpt-4o-mini"):
+        """
+        Full transcript of the conversation with the model, and the budgeted view of it sent in requests.
+
+        The first n_pinned messages (system prompt and task) are always sent. Then the most recent
+        messages are sent as long as they fit in max_tokens. The older turns are replaced by a compact
+        summary (episode -> return -> function hash), the best-scoring function so far and the latest errors.
+
+        :param max_tokens: Integer, the token budget of the messages sent in a request.
+        :param n_pinned: Integer, the number of messages at the start of the conversation that are always sent.
+        :param n_kept_errors: Integer, the number of latest error messages kept when they are out of the recent window.
+        :param model: String, the model whose tokenizer is used to count tokens.
+        """
+        self.max_tokens = max_tokens
+        self.n_pinned = n_pinned
+        self.n_kept_errors = n_kept_errors
+        self.model = model
+        self.messages = []
+        self.kinds = []
+        self.n_tokens = []
+        self.episodes = []
+        self.best = None
+
+    def append(self, message, kind="prompt"):
+        """
+        Adds a message to the transcript.
+
+        :param message: Dict with the role and the content of the message.
+        :param kind: String, "prompt", "answer", "result" (end of an episode) or "error".
+        """
+        self.messages.append(message)
+        self.kinds.append(kind)
+        self.n_tokens.append(count_tokens(message["content"], self.model) + TOKENS_PER_MESSAGE)
+
+    def state_dict(self):
+        """Returns the transcript and the episode records, as JSON-serializable data for checkpoints."""
+        return {"messages": self.messages, "kinds": self.kinds, "n_tokens": self.n_tokens, "episodes": self.episodes, "best": self.best}
+
+    def load_state_dict(self, state):
+        """Restores the transcript and the episode records of state_dict() (the list of messages is updated in place)."""
+        self.messages[:] = state["messages"]
+        self.kinds = list(state["kinds"])
+        self.n_tokens = list(state["n_tokens"])
+        self.episodes = list(state["episodes"])
+        self.best = state["best"]
+
+    def record_episode(self, episode, score, function_source):
+        """
+        Records the score of the function used in an episode, to summarize the episode and track the best function.
+
+        :param episode: Integer, the index of the episode.
+        :param score: Float, the return (or mean evaluation return) of the episode.
+        :param function_source: String, the source of the action function used during the episode.
+        """
+        record = {
+            "episode": episode,
+            "score": score,
+            "hash": function_hash(function_source) if function_source else None,
+            "message_index": len(self.messages),  # the next message is the one reporting the result
+        }
+        self.episodes.append(record)
+        if function_source and (self.best is None or score > self.best["score"]):
+            self.best = {**record, "source": function_source}
+
+    def _summary_message(self, episodes):
+        lines = [f"episode {r['episode']} -> return {r['score']:.3f} -> function {r['hash']}" for r in episodes]
+        return {
+            "role": "user",
+            "content": "Summary of the earlier episodes (episode -> return -> function hash):\n" + "\n".join(lines),
+        }
+
+    def _has_best_source(self, i):
+        """Whether the message i contains the source of the best function."""
+        return self.best is not None and self.best["source"] in self.messages[i]["content"]
+
+    def _best_message(self):
+        return {
+            "role": "user",
+            "content": (
+                f"The best action function so far (function {self.best['hash']}, episode {self.best['episode']}, "
+                f"return {self.best['score']:.3f}) was:\n```python\n{self.best['source']}\n```"
+            ),
+        }
+
+    def request_messages(self):
+        """Returns the messages to send in the next request, within the token budget."""
+        if sum(self.n_tokens) <= self.max_tokens:
+            return list(self.messages)
+        pinned = self.messages[: self.n_pinned]
+        n_messages = len(self.messages)
+        budget = self.max_tokens - sum(self.n_tokens[: self.n_pinned])
+
+        # Budget taken by the replacement of the older turns, if they all have to be replaced
+        errors = [i for i in range(self.n_pinned, n_messages) if self.kinds[i] == "error"][-self.n_kept_errors :]
+        extras = [self._summary_message(self.episodes)] if self.episodes else []
+        best_tokens = 0
+        if self.best is not None:
+            best_tokens = count_tokens(self._best_message()["content"], self.model) + TOKENS_PER_MESSAGE
+        budget -= sum(count_tokens(m["content"], self.model) + TOKENS_PER_MESSAGE for m in extras) + best_tokens
+        budget -= sum(self.n_tokens[i] for i in errors)
+
+        # Most recent messages that fit in the budget, always including the last one. A kept error entering the
+        # window was already counted, and the best function is not repeated once the window contains its source.
+        start = n_messages
+        while start > self.n_pinned:
+            i = start - 1
+            cost = 0 if i in errors else self.n_tokens[i]
+            if best_tokens and self._has_best_source(i):
+                cost -= best_tokens
+                best_tokens = 0
+            if start < n_messages and cost > budget:
+                break
+            budget -= cost
+            start -= 1
+        # Do not start the window with an assistant answer separated from its question
+        while start < n_messages - 1 and self.messages[start]["role"] == "assistant":
+            start += 1
+        if start == self.n_pinned:
+            return list(self.messages)
+
+        replaced = []
+        summarized = [r for r in self.episodes if r["message_index"] < start]
+        if summarized:
+            replaced.append(self._summary_message(summarized))
+        if self.best is not None and not any(self._has_best_source(i) for i in range(start, n_messages)):
+            replaced.append(self._best_message())
+        replaced += [self.messages[i] for i in errors if i < start]
+        return pinned + replaced + self.messages[start:]
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), self.cat, self.args)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    def __init__(self, enabled=True, max_events=1_000_000):
+        """
+        Low-overhead spans and counters of the agent loop.
+
+        Each span is kept as a trace event (up to max_events, for export_chrome_trace) and its duration is added
+        to the latencies of the current episode (for log_episode). A disabled tracer records nothing.
+
+        :param enabled: Boolean, whether spans and counters are recorded.
+        :param max_events: Integer, the number of trace events kept, the next ones are only counted in the latencies.
+        """
+        self.enabled = enabled
+        self.max_events = max_events
+        self.pid = os.getpid()
+        # Timestamps are taken with perf_counter_ns, this offset converts them to the epoch
+        self.base_time_ns = time.time_ns() - time.perf_counter_ns()
+        self.events = []
+        self.counters = defaultdict(float)
+        self._durations = defaultdict(list)  # durations in ns of the spans of the current episode
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name, cat="agent", **args):
+        """Context manager timing a block, e.g. with tracer.span("env.step"): ..."""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, cat, args or None)
+
+    def record(self, name, start_ns, end_ns, cat="agent", args=None, tid=None):
+        """
+        Records a span timed by the caller.
+
+        :param start_ns: Integer, the start of the span, from time.perf_counter_ns().
+        :param end_ns: Integer, the end of the span, from time.perf_counter_ns().
+        :param tid: Integer, the track of the span in the trace, by default the current thread. Concurrent spans of
+            the same thread (e.g. asyncio requests) should be given different tracks.
+        """
+        if not self.enabled:
+            return
+        self._durations[name].append(end_ns - start_ns)
+        if len(self.events) < self.max_events:
+            tid = threading.get_native_id() if tid is None else tid
+            self.events.append(("X", name, cat, start_ns, end_ns - start_ns, tid, args))
+
+    def count(self, name, value=1):
+        """Adds a value to a counter (e.g. tokens), whose running total is also a counter event of the trace."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+            total = self.counters[name]
+        if len(self.events) < self.max_events:
+            self.events.append(("C", name, "counter", time.perf_counter_ns(), 0, 0, {name: total}))
+
+    def episode_latencies(self):
+        """Returns the durations (in ms) of the spans recorded since the last call, by span name, and starts a new episode."""
+        durations, self._durations = self._durations, defaultdict(list)
+        return {name: np.array(values, dtype=np.float64) / 1e6 for name, values in durations.items()}
+
+    def log_episode(self, tb_logger, step):
+        """
+        Logs the latencies of the spans of the episode to tensorboardX: a histogram per span, and the total time
+        spent in each span, which shows whether the run is bound by the LLM, the policy or the environment.
+
+        :param tb_logger: tensorboardX.SummaryWriter.
+        :param step: Integer, the episode.
+        :return: Dict, the total time in ms spent in each span during the episode.
+        """
+        totals = {}
+        for name, latencies in self.episode_latencies().items():
+            tb_logger.add_histogram(f"latency_ms/{name}", latencies, step)
+            totals[name] = float(latencies.sum())
+            tb_logger.add_scalar(f"total_time_ms/{name}", totals[name], step)
+        for name, value in self.counters.items():
+            tb_logger.add_scalar(f"counters/{name}", value, step)
+        return totals
+
+    def export_chrome_trace(self, path):
+        """
+        Writes the events as a Chrome trace (the format of trace.json), to open in Perfetto or chrome://tracing.
+
+        :param path: String, the JSON file.
+        """
+        events = [
+            {"name": "process_name", "ph": "M", "ts": 0, "pid": self.pid, "tid": 0, "args": {"name": "python"}},
+            {"name": "process_labels", "ph": "M", "ts": 0, "pid": self.pid, "tid": 0, "args": {"labels": "CPU"}},
+        ]
+        for ph, name, cat, start_ns, dur_ns, tid, args in self.events:
+            event = {"ph": ph, "cat": cat, "name": name, "pid": self.pid, "tid": tid, "ts": start_ns / 1000}
+            if ph == "X":
+                event["dur"] = dur_ns / 1000
+            if args:
+                event["args"] = args
+            events.append(event)
+        trace = {
+            "schemaVersion": 1,
+            "traceEvents": events,
+            "traceName": path,
+            "displayTimeUnit": "ms",
+            "baseTimeNanoseconds": self.base_time_ns,
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(trace, f)
+
+
+# Tracer of the agent loop, enabled by the experiment scripts
+tracer = Tracer(enabled=False)
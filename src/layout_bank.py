@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+class LayoutBank:
+    def __init__(self, path):
+        """
+        Bank of pre-generated maze layouts, memory-mapped from the .npy files written by generate_layout_bank.
+
+        Loading a layout is O(1) and the pages of the files are shared by all the processes that open the bank.
+
+        :param path: String, the directory of the bank.
+        """
+        self.path = path
+        with open(os.path.join(path, "metadata.json")) as f:
+            self.metadata = json.load(f)
+        self.mazes = np.load(os.path.join(path, "mazes.npy"), mmap_mode="r")
+        self.distances = np.load(os.path.join(path, "distances.npy"), mmap_mode="r")
+        self.optimal_steps = np.load(os.path.join(path, "optimal_steps.npy"), mmap_mode="r")
+        self.size = tuple(self.metadata["size"])
+
+    def __len__(self):
+        return len(self.mazes)
+
+
+def generate_layout_bank(path, num_layouts, size=(10, 10), seed=0, solvable_only=True):
+    """
+    Generates maze layouts with SimpleMaze and writes them with their distance fields to memory-mapped .npy files.
+
+    The layout i is generated with the seed (seed, i), so a bank can be extended or regenerated identically.
+
+    :param path: String, the directory of the bank.
+    :param num_layouts: Integer, the number of layouts.
+    :param size: Tuple, the dimensions of the mazes (rows, cols).
+    :param seed: Integer, the seed of the bank.
+    :param solvable_only: Boolean, if True, only layouts where the goal can be reached are kept.
+    :return: The LayoutBank.
+    """
+    from src.maze import SimpleMaze
+
+    os.makedirs(path, exist_ok=True)
+    shape = (num_layouts,) + tuple(size)
+    mazes = np.lib.format.open_memmap(os.path.join(path, "mazes.npy"), mode="w+", dtype=np.uint8, shape=shape)
+    distances = np.lib.format.open_memmap(os.path.join(path, "distances.npy"), mode="w+", dtype=np.int32, shape=shape)
+    optimal_steps = np.lib.format.open_memmap(
+        os.path.join(path, "optimal_steps.npy"), mode="w+", dtype=np.int32, shape=(num_layouts,)
+    )
+    for i in range(num_layouts):
+        env = SimpleMaze(size=size, dtype=np.uint8, seed=(seed, i), distance_field=True, solvable_only=solvable_only, render_mode=None)
+        mazes[i] = env.maze
+        distances[i] = env.distances.distances
+        optimal_steps[i] = env.optimal_steps
+    for array in [mazes, distances, optimal_steps]:
+        array.flush()
+    del mazes, distances, optimal_steps
+
+    metadata = {"num_layouts": num_layouts, "size": list(size), "seed": seed, "solvable_only": solvable_only}
+    with open(os.path.join(path, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return LayoutBank(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate a bank of maze layouts.")
+    parser.add_argument("path", help="Directory of the bank")
+    parser.add_argument("--num_layouts", type=int, default=10000)
+    parser.add_argument("--size", type=int, nargs=2, default=[10, 10])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allow_unsolvable", action="store_true", help="Keep the layouts where the goal can not be reached")
+    args = parser.parse_args()
+
+    bank = generate_layout_bank(args.path, args.num_layouts, tuple(args.size), args.seed, not args.allow_unsolvable)
+    print(f"Generated {len(bank)} layouts of size {bank.size} in {args.path}")
@@ -0,0 +1,346 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+from src.instrumentation import tracer
+
+# off : no caching, read_through : answer from the cache and call the API on misses,
+# record : always call the API and overwrite the cache, replay : only answer from the cache (offline)
+CACHE_MODES = ["off", "read_through", "record", "replay"]
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a request is not in the cache."""
+
+
+def request_key(request):
+    """
+    Computes the content address of a completion request.
+
+    :param request: Dict, the keyword arguments of chat.completions.create (model, messages, sampling params...).
+    :return: String, the sha256 hex digest of the canonical JSON of the request.
+    """
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def to_namespace(data):
+    """Converts a JSON-like structure to nested namespaces, to access it like an OpenAI response object."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in data.items()})
+    elif isinstance(data, list):
+        return [to_namespace(v) for v in data]
+    return data
+
+
+class CompletionCache:
+    def __init__(self, path="cache/llm_completions.sqlite", mode="read_through"):
+        """
+        Persistent SQLite cache of LLM completions, keyed by a hash of the request.
+
+        :param path: String, the SQLite database file.
+        :param mode: String, one of CACHE_MODES.
+        """
+        assert mode in CACHE_MODES, f"Unknown cache mode {mode}, expected one of {CACHE_MODES}."
+        self.path = path
+        self.mode = mode
+        self.n_hits = 0
+        self.n_misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if mode != "off":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, model TEXT, request TEXT, response TEXT, "
+                "prompt_tokens INTEGER, completion_tokens INTEGER, created REAL)"
+            )
+            self._connection.commit()
+
+    def get(self, key):
+        """Returns the cached response (as a dict) of a request key, or None."""
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, request, response):
+        """
+        Stores the response of a request.
+
+        :param key: String, the key of the request, see request_key.
+        :param request: Dict, the request, stored for inspection.
+        :param response: Dict, the raw completion.
+        """
+        usage = response.get("usage") or {}
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    request.get("model"),
+                    json.dumps(request, ensure_ascii=False, default=str),
+                    json.dumps(response, ensure_ascii=False),
+                    usage.get("prompt_tokens"),
+                    usage.get("completion_tokens"),
+                    time.time(),
+                ),
+            )
+            self._connection.commit()
+
+    def token_usage(self):
+        """Returns the total prompt and completion tokens stored in the cache."""
+        with self._lock:
+            prompt_tokens, completion_tokens = self._connection.execute(
+                "SELECT COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0) FROM completions"
+            ).fetchone()
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def _response_to_dict(completion):
+    if hasattr(completion, "model_dump"):
+        return completion.model_dump(mode="json")
+    return completion
+
+
+def _trace_request(start_ns, request, response, tid=None):
+    """Records the latency and the token usage (if reported) of a request to the API in the tracer."""
+    tracer.record("llm.request", start_ns, time.perf_counter_ns(), "llm", {"model": request.get("model")}, tid)
+    usage = (response.get("usage") if isinstance(response, dict) else None) or {}
+    tracer.count("llm.prompt_tokens", usage.get("prompt_tokens") or 0)
+    tracer.count("llm.completion_tokens", usage.get("completion_tokens") or 0)
+
+
+def _dict_to_response(data):
+    try:
+        from openai.types.chat import ChatCompletion
+
+        return ChatCompletion.model_validate(data)
+    except ImportError:
+        return to_namespace(data)
+
+
+def _stream_chunk(response):
+    """Builds a single stream chunk holding the whole answer of a cached completion."""
+    data = {
+        "id": response.id,
+        "object": "chat.completion.chunk",
+        "created": response.created,
+        "model": response.model,
+        "choices": [
+            {
+                "index": choice.index,
+                "delta": {"role": "assistant", "content": choice.message.content},
+                "finish_reason": choice.finish_reason,
+            }
+            for choice in response.choices
+        ],
+    }
+    try:
+        from openai.types.chat import ChatCompletionChunk
+
+        return ChatCompletionChunk.model_validate(data)
+    except ImportError:
+        return to_namespace(data)
+
+
+class CachedStream:
+    def __init__(self, response):
+        """Stream served from the cache, a single chunk with the whole answer."""
+        self.chunks = [_stream_chunk(response)]
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+class AsyncCachedStream(CachedStream):
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+class RecordingStream:
+    def __init__(self, stream, on_end, request, start_ns, tid=None):
+        """
+        Passes through the chunks of a streamed completion and accumulates their content.
+
+        :param stream: The stream returned by the API.
+        :param on_end: Function called once with the accumulated completion (as a dict) when the stream is
+            exhausted, None to only trace the request. A stream closed early is only traced (with the finish reason
+            "length"): its answer is truncated, and it would be served to later requests in place of the whole one.
+        :param request: Dict, the request, for the trace.
+        :param start_ns: Integer, the time of the request (time.perf_counter_ns()), for the trace.
+        :param tid: Integer, the track of the request in the trace.
+        """
+        self.stream = stream
+        self.on_end = on_end
+        self.request = request
+        self.start_ns = start_ns
+        self.tid = tid
+        self._parts = {}
+        self._finish_reasons = {}
+        self._header = {"id": "", "created": 0, "model": ""}
+        self._usage = None
+        self._ended = False
+
+    def _add(self, chunk):
+        self._header = {"id": chunk.id, "created": chunk.created, "model": chunk.model}
+        if getattr(chunk, "usage", None) is not None:
+            self._usage = _response_to_dict(chunk.usage)
+        for choice in chunk.choices:
+            self._parts.setdefault(choice.index, []).append(choice.delta.content or "")
+            if choice.finish_reason is not None:
+                self._finish_reasons[choice.index] = choice.finish_reason
+
+    def _end(self, finish_reason, store=True):
+        if self._ended:
+            return
+        self._ended = True
+        choices = [
+            {
+                "index": index,
+                "finish_reason": self._finish_reasons.get(index, finish_reason),
+                "message": {"role": "assistant", "content": "".join(parts)},
+            }
+            for index, parts in sorted(self._parts.items())
+        ]
+        response = {**self._header, "object": "chat.completion", "choices": choices, "usage": self._usage}
+        _trace_request(self.start_ns, self.request, response, self.tid)
+        if store and self.on_end is not None:
+            self.on_end(response)
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self._add(chunk)
+            yield chunk
+        self._end("stop")
+
+    def close(self):
+        self.stream.close()
+        self._end("length", store=False)
+
+
+class AsyncRecordingStream(RecordingStream):
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self._add(chunk)
+            yield chunk
+        self._end("stop")
+
+    async def close(self):
+        await self.stream.close()
+        self._end("length", store=False)
+
+
+class CachedChatCompletions:
+    stream_class = CachedStream
+    recording_stream_class = RecordingStream
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def _lookup(self, request):
+        """Returns the key of the request (None if the cache is off) and its cached response if any."""
+        salt = request.pop("cache_salt", None)
+        if self.cache.mode == "off":
+            return None, None
+        # Streamed and non-streamed requests share their entries, streams are stored as whole completions
+        keyed = {k: v for k, v in request.items() if k not in ["stream", "stream_options"]}
+        key = request_key(keyed if salt is None else {**keyed, "cache_salt": salt})
+        if self.cache.mode in ["read_through", "replay"]:
+            response = self.cache.get(key)
+            if response is not None:
+                return key, _dict_to_response(response)
+            if self.cache.mode == "replay":
+                raise CacheMiss(f"Request {key} for model {request.get('model')} is not in the cache {self.cache.path}.")
+        return key, None
+
+    def create(self, **request):
+        """
+        Same as client.chat.completions.create, going through the cache according to its mode.
+
+        The keyword argument cache_salt, if given, is only used in the key of the request and is not
+        sent to the API (e.g. to cache several samples of the same request separately).
+        With stream=True, a cached answer is served as a single chunk, and the answer of the API is stored
+        once its stream is exhausted (a stream closed early is not stored).
+        """
+        key, response = self._lookup(request)
+        if response is not None:
+            tracer.count("llm.cache_hits")
+            return self.stream_class(response) if request.get("stream") else response
+        start_ns = time.perf_counter_ns()
+        completion = self.client.chat.completions.create(**request)
+        return self._store(key, request, completion, start_ns)
+
+    def _store(self, key, request, completion, start_ns, tid=None):
+        """Stores the answer of the API in the cache (if it is on) and traces the request."""
+        if key is None and not tracer.enabled:
+            return completion
+        if request.get("stream"):
+            on_end = None if key is None else lambda response: self.cache.put(key, request, response)
+            return self.recording_stream_class(completion, on_end, request, start_ns, tid)
+        response = _response_to_dict(completion)
+        _trace_request(start_ns, request, response, tid)
+        if key is not None:
+            self.cache.put(key, request, response)
+        return completion
+
+
+class AsyncCachedChatCompletions(CachedChatCompletions):
+    stream_class = AsyncCachedStream
+    recording_stream_class = AsyncRecordingStream
+    # Concurrent requests are traced on separate tracks
+    _tracks = itertools.count()
+
+    async def create(self, **request):
+        """Same as CachedChatCompletions.create, for an asyncio client such as AsyncOpenAI."""
+        key, response = self._lookup(request)
+        if response is not None:
+            tracer.count("llm.cache_hits")
+            return self.stream_class(response) if request.get("stream") else response
+        start_ns = time.perf_counter_ns()
+        completion = await self.client.chat.completions.create(**request)
+        return self._store(key, request, completion, start_ns, tid=1_000_000 + next(self._tracks) % 64)
+
+
+class CachedClient:
+    completions_class = CachedChatCompletions
+
+    def __init__(self, client, cache):
+        """
+        Wraps an OpenAI-like client so that its chat completions go through a CompletionCache.
+
+        :param client: The OpenAI client, can be None in replay mode (fully offline).
+        :param cache: CompletionCache.
+        """
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=self.completions_class(client, cache))
+
+
+class AsyncCachedClient(CachedClient):
+    """Same as CachedClient, for an asyncio client such as AsyncOpenAI."""
+
+    completions_class = AsyncCachedChatCompletions
@@ -0,0 +1,505 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+# openai is imported on first use, so that importing this module is cheap
+
+
+class ProviderConfig:
+    def __init__(
+        self,
+        name,
+        model,
+        base_url=None,
+        api_key_env=None,
+        default_api_key=None,
+        azure_endpoint=None,
+        api_version=None,
+        rpm=None,
+        tpm=None,
+        max_concurrent=8,
+        max_connections=32,
+        max_retries=6,
+        base_backoff=0.5,
+        max_backoff=30.0,
+        timeout=120.0,
+        deadline=600.0,
+    ):
+        """
+        Endpoint and limits of an LLM provider.
+
+        :param name: String, the name of the provider.
+        :param model: String, the default model (the deployment name for Azure).
+        :param base_url: String, the URL of the OpenAI-compatible API, None for the OpenAI API.
+        :param api_key_env: String, the environment variable holding the API key.
+        :param default_api_key: String, the key used when the variable is not set (e.g. for a local server).
+        :param azure_endpoint: String, the endpoint of an Azure OpenAI resource, which makes the client an AzureOpenAI.
+        :param api_version: String, the API version of Azure.
+        :param rpm: Float, the requests per minute allowed by the provider, None for no limit.
+        :param tpm: Float, the tokens per minute (prompt and completion) allowed by the provider, None for no limit.
+        :param max_concurrent: Integer, the maximum number of requests in flight.
+        :param max_connections: Integer, the size of the HTTP connection pool.
+        :param max_retries: Integer, the number of retries of a failed request (429, 5xx, timeouts, connection errors).
+        :param base_backoff: Float, the delay in seconds before the first retry, doubled at each retry (with jitter).
+        :param max_backoff: Float, the maximum delay in seconds between two attempts.
+        :param timeout: Float, the timeout in seconds of an attempt.
+        :param deadline: Float, the time in seconds after which a request is abandoned, retries and waits included.
+        """
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key_env = api_key_env
+        self.default_api_key = default_api_key
+        self.azure_endpoint = azure_endpoint
+        self.api_version = api_version
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrent = max_concurrent
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.deadline = deadline
+
+    @property
+    def api_key(self):
+        value = os.environ.get(self.api_key_env) if self.api_key_env is not None else None
+        return value or self.default_api_key
+
+    def replace(self, **overrides):
+        """Returns a copy of the configuration with some fields changed (the None overrides are ignored)."""
+        return ProviderConfig(**{**vars(self), **{k: v for k, v in overrides.items() if v is not None}})
+
+
+PROVIDERS = {
+    "openai": ProviderConfig("openai", "gpt-4o-mini", api_key_env="OPENAI_API_KEY", rpm=500, tpm=200_000),
+    "azure": ProviderConfig(
+        "azure",
+        "gpt-4o",
+        api_key_env="AZURE_API_KEY",
+        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT", "https://petunia-gpt4o-mini.openai.azure.com/"),
+        api_version="2024-02-15-preview",
+        rpm=60,
+        tpm=60_000,
+    ),
+    "deepseek": ProviderConfig("deepseek", "deepseek-chat", base_url="https://api.deepseek.com", api_key_env="DEEPSEEK_API_KEY"),
+    "local": ProviderConfig("local", "local", base_url="http://127.0.0.1:8000/v1", default_api_key="local", timeout=600.0),
+}
+
+
+def provider_config(provider="openai", **overrides):
+    """
+    Returns the configuration of a provider.
+
+    :param provider: String, a key of PROVIDERS, or a ProviderConfig.
+    :param overrides: Fields of ProviderConfig to change (e.g. base_url, model, rpm).
+    :return: ProviderConfig.
+    """
+    config = provider if isinstance(provider, ProviderConfig) else PROVIDERS[provider]
+    return config.replace(**overrides)
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        """
+        Token bucket refilled continuously at per_minute / 60 units per second.
+
+        Units are taken as soon as they are reserved, even beyond the content of the bucket: the caller then waits for
+        the debt to be refilled. Requests are thus served in order and a request larger than the bucket still passes.
+
+        :param per_minute: Float, the refill rate.
+        :param capacity: Float, the maximum content (the burst), by default one minute of refill.
+        """
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Takes units from the bucket and returns the time in seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        """Gives back units (negative to take more, e.g. when a request used more tokens than estimated)."""
+        with self._lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    def __init__(self, rpm=None, tpm=None):
+        """
+        Limits the requests and tokens per minute sent to a provider. A limiter can be shared by the clients of a
+        process (sync and async, of several agents) so that together they stay under the limits of the provider.
+
+        :param rpm: Float, the requests per minute, None for no limit.
+        :param tpm: Float, the tokens per minute, None for no limit.
+        """
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def reserve(self, tokens):
+        """Reserves a request of an estimated number of tokens, returns the time in seconds to wait before sending it."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def cancel(self, tokens):
+        """Gives back a reservation that was not used."""
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(tokens)
+
+    def correct(self, estimated, used):
+        """Replaces the estimated tokens of a request by the tokens it used."""
+        if self.tokens is not None:
+            self.tokens.refund(estimated - used)
+
+
+def estimate_tokens(request):
+    """Estimates the tokens of a request (4 characters per token for the prompt, and its max_tokens for the answer)."""
+    prompt = sum(len(str(message.get("content") or "")) for message in request.get("messages", [])) // 4
+    completion = request.get("max_completion_tokens") or request.get("max_tokens") or 1000
+    return prompt + completion * (request.get("n") or 1)
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def _retry_delay(error, attempt, config):
+    """
+    Returns the delay before retrying a failed attempt, or None if the error is not transient.
+
+    The delay is drawn uniformly up to an exponential backoff ("full jitter"), so that clients failing together do not
+    retry together, and it is at least the Retry-After of the response when the provider gives one.
+    """
+    import openai
+
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code not in (408, 409, 429) and error.status_code < 500:
+            return None
+    elif not isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return None
+    delay = random.uniform(0, min(config.max_backoff, config.base_backoff * 2**attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+def _http_client_kwargs(config):
+    """Arguments of the HTTP client of the SDK: a pool of config.max_connections connections kept alive between requests."""
+    try:
+        import httpx
+    except ImportError:
+        return {}  # the pool of the SDK keeps its default size
+    return {"limits": httpx.Limits(max_connections=config.max_connections, max_keepalive_connections=config.max_connections)}
+
+
+def _make_sdk_client(config, asynchronous):
+    """Creates the openai client of a provider, with its own pooled HTTP client and without its built-in retries."""
+    import openai
+
+    if asynchronous:
+        http_client = openai.DefaultAsyncHttpxClient(**_http_client_kwargs(config))
+    else:
+        http_client = openai.DefaultHttpxClient(**_http_client_kwargs(config))
+    kwargs = {"api_key": config.api_key, "max_retries": 0, "timeout": config.timeout, "http_client": http_client}
+    if config.azure_endpoint is not None:
+        cls = openai.AsyncAzureOpenAI if asynchronous else openai.AzureOpenAI
+        return cls(azure_endpoint=config.azure_endpoint, api_version=config.api_version, **kwargs)
+    cls = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+    return cls(base_url=config.base_url, **kwargs)
+
+
+class HeldStream:
+    def __init__(self, stream, on_end):
+        """
+        Stream of a request, which keeps the slots of its client until it is exhausted, closed or fails: a streamed
+        request is in flight while its tokens are read, not only while it is sent.
+
+        Its first chunk is read by start(), inside the retries of the client, so that a failure before any content
+        is retried like a failure of the request. A failure after the first chunk is raised to the reader, as the
+        content already read can not be taken back.
+
+        :param stream: The stream returned by the SDK.
+        :param on_end: Function called once with the total tokens of the usage chunk (None if there is none) when
+            the stream ends, to release the slots and correct the estimate of the rate limiter.
+        """
+        self.stream = stream
+        self._on_end = on_end
+        self._iterator = None
+        self._first = None
+        self._used = None
+
+    def start(self):
+        self._iterator = iter(self.stream)
+        self._first = next(self._iterator, None)
+        return self
+
+    def _record(self, chunk):
+        used = _usage_tokens(chunk)
+        if used is not None:
+            self._used = used
+
+    def _end(self):
+        if self._on_end is not None:
+            on_end, self._on_end = self._on_end, None
+            on_end(self._used)
+
+    def __iter__(self):
+        try:
+            if self._first is not None:
+                chunk, self._first = self._first, None
+                self._record(chunk)
+                yield chunk
+            for chunk in self._iterator:
+                self._record(chunk)
+                yield chunk
+        finally:
+            self._end()
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)  # e.g. the HTTP response of the SDK stream
+
+
+class AsyncHeldStream(HeldStream):
+    """Same as HeldStream, for the streams of an asyncio client."""
+
+    async def start(self):
+        self._iterator = self.stream.__aiter__()
+        try:
+            self._first = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._first = None
+        return self
+
+    async def __aiter__(self):
+        try:
+            if self._first is not None:
+                chunk, self._first = self._first, None
+                self._record(chunk)
+                yield chunk
+            async for chunk in self._iterator:
+                self._record(chunk)
+                yield chunk
+        finally:
+            self._end()
+
+    async def close(self):
+        try:
+            await self.stream.close()
+        finally:
+            self._end()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class LLMClient:
+    def __init__(self, provider="openai", limiter=None, shared_slots=None, **overrides):
+        """
+        Client of a provider with the interface of openai.OpenAI (client.chat.completions.create), whose requests go
+        through a rate limiter, a cap on the requests in flight and retries with backoff.
+
+        :param provider: String, a key of PROVIDERS, or a ProviderConfig.
+        :param limiter: RateLimiter, shared with other clients, by default one from the rpm and tpm of the provider.
+        :param shared_slots: Semaphore (e.g. multiprocessing.BoundedSemaphore) also held during each request, to bound
+            the requests in flight of several clients, possibly in several processes.
+        :param overrides: Fields of ProviderConfig to change (e.g. base_url, model).
+        """
+        self.config = provider_config(provider, **overrides)
+        self.limiter = limiter if limiter is not None else RateLimiter(self.config.rpm, self.config.tpm)
+        self.shared_slots = shared_slots
+        self.client = _make_sdk_client(self.config, asynchronous=False)
+        self.model = self.config.model
+        self._slots = threading.BoundedSemaphore(self.config.max_concurrent)
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "wait_time": 0.0}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def async_client(self):
+        """Returns an AsyncLLMClient of the same provider, sharing the rate limiter and the shared slots of this client."""
+        return AsyncLLMClient(self.config, limiter=self.limiter, shared_slots=self.shared_slots)
+
+    def create(self, deadline=None, **request):
+        """
+        Same as openai.OpenAI().chat.completions.create, with the model of the provider by default. With stream=True,
+        the request holds its slots until its stream is read (see HeldStream), and the tokens of its usage chunk replace
+        the estimate of the rate limiter (with stream_options={"include_usage": True}).
+
+        :param deadline: Float, the time in seconds after which the request is abandoned, default config.deadline.
+        :raises TimeoutError: If the rate limits do not allow sending the request before the deadline.
+        :raises openai.APIError: The last error, when it is not transient or there is no retry or time left.
+        """
+        request.setdefault("model", self.config.model)
+        end = time.monotonic() + (deadline or self.config.deadline)
+        tokens = estimate_tokens(request)
+        for attempt in range(self.config.max_retries + 1):
+            wait = self.limiter.reserve(tokens)
+            if time.monotonic() + wait > end:
+                self.limiter.cancel(tokens)
+                raise TimeoutError(f"The rate limits of {self.config.name} do not allow the request before its deadline.")
+            time.sleep(wait)
+            self.stats["wait_time"] += wait
+            self._acquire()
+            self.stats["requests"] += 1
+            response = None
+            try:
+                response = self.client.chat.completions.create(
+                    timeout=max(0.1, min(self.config.timeout, end - time.monotonic())), **request
+                )
+                if request.get("stream"):
+                    # The stream keeps the slots until it is read
+                    return HeldStream(response, lambda used: self._end_request(tokens, used)).start()
+            except BaseException as e:
+                if response is not None:
+                    response.close()
+                self._release()
+                if not isinstance(e, Exception):
+                    raise  # e.g. KeyboardInterrupt
+                error, delay = e, _retry_delay(e, attempt, self.config)
+            else:
+                self._end_request(tokens, _usage_tokens(response))
+                return response
+            if delay is None or attempt == self.config.max_retries or time.monotonic() + delay > end:
+                break
+            self.stats["retries"] += 1
+            time.sleep(delay)
+        self.stats["failures"] += 1
+        raise error
+
+    def _acquire(self):
+        self._slots.acquire()
+        if self.shared_slots is not None:
+            self.shared_slots.acquire()
+
+    def _release(self):
+        if self.shared_slots is not None:
+            self.shared_slots.release()
+        self._slots.release()
+
+    def _end_request(self, estimated, used):
+        """Releases the slots of a request and corrects the estimate of its tokens once it is over."""
+        self._release()
+        if used is not None:
+            self.limiter.correct(estimated, used)
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncLLMClient:
+    def __init__(self, provider="openai", limiter=None, shared_slots=None, **overrides):
+        """Same as LLMClient, for asyncio (client.chat.completions.create is a coroutine)."""
+        self.config = provider_config(provider, **overrides)
+        self.limiter = limiter if limiter is not None else RateLimiter(self.config.rpm, self.config.tpm)
+        self.shared_slots = shared_slots
+        self.client = _make_sdk_client(self.config, asynchronous=True)
+        self.model = self.config.model
+        self._slots = None  # created in the event loop of the first request
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "wait_time": 0.0}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, deadline=None, **request):
+        """Same as LLMClient.create."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.config.max_concurrent)
+        request.setdefault("model", self.config.model)
+        end = time.monotonic() + (deadline or self.config.deadline)
+        tokens = estimate_tokens(request)
+        for attempt in range(self.config.max_retries + 1):
+            wait = self.limiter.reserve(tokens)
+            if time.monotonic() + wait > end:
+                self.limiter.cancel(tokens)
+                raise TimeoutError(f"The rate limits of {self.config.name} do not allow the request before its deadline.")
+            await asyncio.sleep(wait)
+            self.stats["wait_time"] += wait
+            await self._acquire()
+            self.stats["requests"] += 1
+            response = None
+            try:
+                response = await self.client.chat.completions.create(
+                    timeout=max(0.1, min(self.config.timeout, end - time.monotonic())), **request
+                )
+                if request.get("stream"):
+                    return await AsyncHeldStream(response, lambda used: self._end_request(tokens, used)).start()
+            except BaseException as e:
+                if response is not None:
+                    await response.close()
+                self._release()
+                if not isinstance(e, Exception):
+                    raise  # cancelled
+                error, delay = e, _retry_delay(e, attempt, self.config)
+            else:
+                self._end_request(tokens, _usage_tokens(response))
+                return response
+            if delay is None or attempt == self.config.max_retries or time.monotonic() + delay > end:
+                break
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+        self.stats["failures"] += 1
+        raise error
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        if self.shared_slots is not None:
+            try:
+                await self._acquire_shared_slot()
+            except BaseException:
+                self._slots.release()
+                raise
+
+    def _release(self):
+        if self.shared_slots is not None:
+            self.shared_slots.release()
+        self._slots.release()
+
+    def _end_request(self, estimated, used):
+        """Same as LLMClient._end_request."""
+        self._release()
+        if used is not None:
+            self.limiter.correct(estimated, used)
+
+    async def _acquire_shared_slot(self, poll_interval=0.01):
+        """
+        Waits for a slot of the semaphore shared with other processes. It is polled without blocking rather than waited
+        for in a thread, so that a cancelled request can not take a slot once it is gone, which would never be released.
+        """
+        while not self.shared_slots.acquire(False):
+            await asyncio.sleep(poll_interval)
+
+    async def close(self):
+        await self.client.close()
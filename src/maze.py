@@ -1,28 +1,74 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import random
+from src.rendering import Renderer, maze_frame
+from src.distance import UNREACHABLE, DistanceField
+from src.layout_bank import LayoutBank
 
 class SimpleMaze:
-    def __init__(self, size=(10, 10), dynamic=False):
+    def __init__(self, size=(10, 10), dynamic=False, wall_change_rate=0.05, dtype=np.float64, seed=None, distance_field=False, solvable_only=False, layout_bank=None, render_mode="human", render_every=1, video_path=None):
         """
         Initialize the maze environment.
 
         :param size: Tuple, the dimensions of the maze (rows, cols).
         :param dynamic: Boolean, if True, walls can change dynamically.
+        :param wall_change_rate: Float, the fraction of the cells drawn to be toggled at each step of a dynamic maze.
+            The distance field is only updated incrementally below src.distance.INCREMENTAL_MAX_RATIO (sparse changes).
+        :param dtype: Dtype of the maze array, np.uint8 or bool use 1 byte per cell instead of 8 for large mazes.
+        :param seed: Seed of the numpy Generator placing the walls.
+        :param distance_field: Boolean, if True, the BFS distance to the goal of every cell is maintained in self.distances
+            and the info dict gives the distance to the goal and the optimal number of steps of the episode.
+        :param solvable_only: Boolean, if True, the walls are drawn again until the goal can be reached from the start.
+        :param layout_bank: LayoutBank or path of a bank (see src/layout_bank.py), reset(seed=i) then loads the layout i.
+        :param render_mode: None, "rgb_array", "human" or "video", see src.rendering.Renderer.
+        :param render_every: Integer, only one call to render() every render_every calls draws a frame.
+        :param video_path: String, the video file written in "video" mode (frames kept in memory if None).
         """
         self.rows, self.cols = size
         self.dynamic = dynamic
+        self.wall_change_rate = wall_change_rate
+        self.dtype = dtype
+        self.rng = np.random.default_rng(seed)
+        self.distance_field = distance_field
+        self.solvable_only = solvable_only
+        self.layout_bank = LayoutBank(layout_bank) if isinstance(layout_bank, str) else layout_bank
+        if self.layout_bank is not None:
+            assert self.layout_bank.size == (self.rows, self.cols), "The layouts of the bank do not have the size of the maze."
+        self.renderer = Renderer(render_mode, render_every=render_every, video_path=video_path, pause=0.1)
         self.reset()
 
-    def reset(self):
-        """Resets the maze and places the agent and goal."""
-        self.maze = np.zeros((self.rows, self.cols))
+    def reset(self, seed=None, options=None):
+        """
+        Resets the maze and places the agent and goal.
+
+        :param seed: Integer, reseeds the random generator. With a layout bank, the layout seed % len(bank) is loaded.
+        :param options: Dict, {"layout": i} loads the layout i of the layout bank.
+        """
         self.t = 0
-        
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        layout = (options or {}).get("layout")
+        if layout is None and seed is not None and self.layout_bank is not None:
+            layout = seed % len(self.layout_bank)
+
+        if layout is not None:
+            self._load_layout(layout)
+        else:
+            self._generate_walls()
+            while self.solvable_only and self.distances.distance(self.agent_pos) == UNREACHABLE:
+                self._generate_walls()  # Draw again until the goal can be reached
+
+        if self.distances is None:
+            return self.get_observation(), {}
+        self.optimal_steps = self.distances.distance(self.agent_pos)
+        return self.get_observation(), self._distance_info()
+
+    def _generate_walls(self):
+        """Draws the walls of a new maze, and computes its distance field if needed."""
+        self.maze = np.zeros((self.rows, self.cols), dtype=self.dtype)
+
         # Add walls
-        for _ in range(self.rows * self.cols // 4):  # Fill approximately 25% with walls
-            r, c = random.randint(0, self.rows - 1), random.randint(0, self.cols - 1)
-            self.maze[r, c] = 1  # 1 represents a wall
+        cells = self.rng.integers(0, self.rows * self.cols, size=self.rows * self.cols // 4)  # Fill approximately 25% with walls
+        self.maze.reshape(-1)[cells] = 1  # 1 represents a wall
 
         # Ensure the agent and goal positions are not walls
         self.agent_pos = (0, 0)
@@ -30,11 +76,26 @@ class SimpleMaze:
         self.maze[self.agent_pos] = 0
         self.maze[self.goal_pos] = 0
 
-        return self.get_observation(), {}
+        self.distances = DistanceField(self.maze, self.goal_pos) if self.distance_field or self.solvable_only else None
+
+    def _load_layout(self, i):
+        """Loads the walls and the distance field of the layout i of the layout bank."""
+        self.maze = np.array(self.layout_bank.mazes[i], dtype=self.dtype)
+        self.agent_pos = (0, 0)
+        self.goal_pos = (self.rows - 1, self.cols - 1)
+        self.distances = None
+        if self.distance_field or self.solvable_only:
+            self.distances = DistanceField(self.maze, self.goal_pos, distances=self.layout_bank.distances[i])
+
+    def _distance_info(self):
+        """Returns the distance of the agent to the goal and the optimal number of steps of the episode (from the start)."""
+        return {"distance_to_goal": self.distances.distance(self.agent_pos), "optimal_steps": self.optimal_steps}
 
     def get_observation(self):
-        """Returns the current state of the maze."""
-        return self.maze, self.agent_pos
+        """Returns the current state of the maze (as a read-only view of the maze)."""
+        maze = self.maze.view()
+        maze.flags.writeable = False
+        return maze, self.agent_pos
 
     def step(self, action):
         """
@@ -65,39 +126,37 @@ class SimpleMaze:
 
         # Optionally, update the maze dynamically
         if self.dynamic:
-            self._update_walls()
+            cells = self._update_walls()
+            if self.distances is not None:
+                self.distances.update(cells, self.maze)
         
         # Increase the time step and stop after 100 steps
         self.t += 1
         if self.t >= 100:
             done = True
             
-        return self.get_observation(), reward, done, False, {}
+        info = self._distance_info() if self.distances is not None else {}
+        return self.get_observation(), reward, done, False, info
 
     def _update_walls(self):
         """Randomly change the walls in the maze."""
-        for _ in range(self.rows * self.cols // 20):  # Adjust frequency of wall changes
-            r, c = random.randint(0, self.rows - 1), random.randint(0, self.cols - 1)
-            if (r, c) != self.agent_pos and (r, c) != self.goal_pos:
-                self.maze[r, c] = 1 - self.maze[r, c]  # Toggle wall state
+        cells = self.rng.integers(0, self.rows * self.cols, size=int(self.rows * self.cols * self.wall_change_rate))
+        cells, counts = np.unique(cells, return_counts=True)
+        cells = cells[counts % 2 == 1]  # A cell drawn twice is toggled back
+        agent_cell = self.agent_pos[0] * self.cols + self.agent_pos[1]
+        goal_cell = self.goal_pos[0] * self.cols + self.goal_pos[1]
+        cells = cells[(cells != agent_cell) & (cells != goal_cell)]
+        maze = self.maze.reshape(-1)
+        maze[cells] = maze[cells] == 0  # Toggle wall state
+        return cells
 
     def render(self):
-        """Visualize the current state of the maze."""
-        plt.ion()
-        maze_copy = self.maze.copy()
-        maze_copy[self.agent_pos] = 0.5  # Mark agent
-        maze_copy[self.goal_pos] = 0.8  # Mark goal
-
-        plt.imshow(maze_copy, cmap="viridis", origin="upper")
-        plt.xticks([])
-        plt.yticks([])
-        plt.pause(0.1)
-        plt.draw()
+        """Visualize the current state of the maze (returns the RGB frame in "rgb_array" mode)."""
+        return self.renderer.render(lambda: maze_frame(self.maze, self.agent_pos, self.goal_pos, scale=16))
     
     def close(self):
-        """Close the visualization."""
-        plt.ioff()  # Disable interactive mode
-        plt.show()
+        """Close the visualization (returns the recorded frames in "video" mode without video_path)."""
+        return self.renderer.close(keep_window=True)
 
 def struct(container_or_obj):
     if isinstance(container_or_obj, dict):
@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = (
+    "Going right, then down.\n"
+    "```python\n"
+    "def action_function(observation, memory_dict):\n"
+    "    maze, (r, c) = observation\n"
+    "    if c < maze.shape[1] - 1 and maze[r, c + 1] == 0:\n"
+    "        return 1, memory_dict\n"
+    "    return 2, memory_dict\n"
+    "```\n"
+)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up, e.g. a cancelled request
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        status, answer = mock._next(body)
+        time.sleep(mock.latency)
+        if status != 200:
+            headers = {"Retry-After": str(mock.retry_after)} if status == 429 and mock.retry_after is not None else None
+            self._send_json(status, {"error": {"message": f"Mock error {status}", "type": "mock_error"}}, headers)
+            return
+        model = body.get("model", "mock")
+        usage = {"prompt_tokens": 10, "completion_tokens": len(answer) // 4, "total_tokens": 10 + len(answer) // 4}
+        n = body.get("n") or 1
+        if not body.get("stream"):
+            choices = [{"index": i, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"} for i in range(n)]
+            self._send_json(
+                200,
+                {"id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model, "choices": choices, "usage": usage},
+            )
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        pieces = [answer[i : i + 16] for i in range(0, len(answer), 16)]
+        try:
+            for j, piece in enumerate(pieces):
+                choice = {"index": 0, "delta": {"content": piece}, "finish_reason": "stop" if j == len(pieces) - 1 else None}
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [choice]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [], "usage": usage}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MockLLMServer:
+    def __init__(self, answers=None, failures=(), latency=0.0, retry_after=None, host="127.0.0.1", port=0):
+        """
+        Local OpenAI-compatible server answering /v1/chat/completions with canned answers, to test the clients and the
+        controller offline. It runs in a background thread, e.g.
+
+            with MockLLMServer(failures=[429, 500]) as server:
+                client = LLMClient("local", base_url=server.base_url)
+
+        check_client runs such checks of LLMClient (python -m src.mock_llm_server --check).
+
+        :param answers: List of strings, answered in turn (the last one is repeated), by default an action function.
+        :param failures: List of HTTP status codes (e.g. 429, 500, 503) returned by the first requests, in order.
+        :param latency: Float, the time in seconds taken by each response.
+        :param retry_after: Float, the Retry-After header of the 429 responses, None to omit it.
+        :param host: String, the address to listen on.
+        :param port: Integer, the port, 0 for any free port.
+        """
+        self.answers = list(answers or [DEFAULT_ANSWER])
+        self.failures = list(failures)
+        self.latency = latency
+        self.retry_after = retry_after
+        self.requests = []  # bodies of the requests received, failed ones included
+        self.n_answered = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _next(self, body):
+        """Returns the status and the answer of a request."""
+        with self._lock:
+            self.requests.append(body)
+            if self.failures:
+                return self.failures.pop(0), None
+            answer = self.answers[min(self.n_answered, len(self.answers) - 1)]
+            self.n_answered += 1
+            return 200, answer
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def check_client():
+    """
+    Checks the retries and the slots of LLMClient against the mock server: a 429 is retried after its Retry-After,
+    5xx responses are retried, a 400 is not, and a streamed request holds its slot until its stream is read.
+
+    :raises AssertionError: If a check fails.
+    """
+    from src.llm_client import LLMClient
+
+    messages = [{"role": "user", "content": "Write the action function."}]
+    with MockLLMServer(failures=[429], retry_after=0.5) as server:
+        client = LLMClient("local", base_url=server.base_url, base_backoff=0.01)
+        start = time.monotonic()
+        assert client.create(messages=messages).choices[0].message.content == DEFAULT_ANSWER
+        assert time.monotonic() - start >= 0.5, "the Retry-After of the 429 was not waited for"
+        assert client.stats["retries"] == 1 and len(server.requests) == 2
+
+    with MockLLMServer(failures=[500, 503]) as server:
+        client = LLMClient("local", base_url=server.base_url, base_backoff=0.01)
+        assert client.create(messages=messages).choices[0].message.content == DEFAULT_ANSWER
+        assert client.stats["retries"] == 2 and len(server.requests) == 3
+
+    with MockLLMServer(failures=[400]) as server:
+        client = LLMClient("local", base_url=server.base_url, base_backoff=0.01)
+        try:
+            client.create(messages=messages)
+        except Exception as e:
+            assert getattr(e, "status_code", None) == 400, f"unexpected error {e!r}"
+        else:
+            raise AssertionError("a 400 response was not raised")
+        assert client.stats["retries"] == 0 and len(server.requests) == 1
+
+    with MockLLMServer(failures=[503]) as server:
+        client = LLMClient("local", base_url=server.base_url, base_backoff=0.01, max_concurrent=1)
+        stream = client.create(messages=messages, stream=True, stream_options={"include_usage": True})
+        assert client.stats["retries"] == 1
+        assert not client._slots.acquire(False), "the slot was released before the stream was read"
+        text = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+        assert text == DEFAULT_ANSWER
+        assert client._slots.acquire(False), "the slot was not released at the end of the stream"
+        client._slots.release()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible server answering with an action function.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failures", type=int, nargs="*", default=[], help="Status codes of the first responses")
+    parser.add_argument("--check", action="store_true", help="Check the retries of LLMClient against the server, then exit")
+    args = parser.parse_args()
+
+    if args.check:
+        check_client()
+        print("LLMClient checks passed.")
+        raise SystemExit
+
+    server = MockLLMServer(failures=args.failures, latency=args.latency, port=args.port)
+    print(f"Mock server on {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server._server.server_close()
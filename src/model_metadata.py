@@ -0,0 +1,234 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+# Bytes per value of the dtypes of the safetensors format
+SAFETENSORS_DTYPE_BYTES = {
+    "F64": 8,
+    "F32": 4,
+    "F16": 2,
+    "BF16": 2,
+    "F8_E4M3": 1,
+    "F8_E5M2": 1,
+    "I64": 8,
+    "I32": 4,
+    "I16": 2,
+    "I8": 1,
+    "U8": 1,
+    "BOOL": 1,
+}
+SHARD_INDEX_NAME = "model.safetensors.index.json"
+# Index of the transformer block in the tensor names, e.g. model.layers.12.mlp.up_proj.weight or transformer.h.3.attn
+_LAYER_PATTERN = re.compile(r"(?:^|\.)(?:layers|h|blocks|block|layer)\.(\d+)\.")
+# Files of the Hugging Face cache are symlinks to blobs named after their sha256
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+
+def read_safetensors_header(path):
+    """
+    Reads the header of a safetensors file without reading its tensors: the file starts with the size of the header
+    (8 bytes, little endian), followed by the header in JSON. Only the pages of the header are read from the mapping.
+
+    :param path: String, the .safetensors file.
+    :return: Tuple (header, raw), the header as a dictionary {name: {"dtype", "shape", "data_offsets"}} (with an
+        optional "__metadata__" entry) and its bytes.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        (header_size,) = struct.unpack("<Q", data[:8])
+        if header_size > len(data) - 8:
+            raise ValueError(f"{path} is not a safetensors file (header of {header_size} bytes).")
+        raw = data[8 : 8 + header_size]
+    return json.loads(raw), raw
+
+
+def summarize_header(header):
+    """
+    Counts the parameters of a safetensors header.
+
+    :param header: Dictionary, the header returned by read_safetensors_header.
+    :return: Dictionary with "parameter_count" (total), "dtypes" ({dtype: parameter count}), "layers" (list, the
+        parameter count of each transformer block), "other" (the parameters outside of the blocks, e.g. embeddings)
+        and "size_bytes" (the size of the tensors).
+    """
+    summary = {"parameter_count": 0, "dtypes": {}, "layers": [], "other": 0, "size_bytes": 0}
+    for name, tensor in header.items():
+        if name == "__metadata__":
+            continue
+        count = 1
+        for dim in tensor["shape"]:
+            count *= dim
+        summary["parameter_count"] += count
+        summary["dtypes"][tensor["dtype"]] = summary["dtypes"].get(tensor["dtype"], 0) + count
+        summary["size_bytes"] += tensor["data_offsets"][1] - tensor["data_offsets"][0]
+        match = _LAYER_PATTERN.search(name)
+        if match is None:
+            summary["other"] += count
+            continue
+        layer = int(match.group(1))
+        if layer >= len(summary["layers"]):
+            summary["layers"] += [0] * (layer + 1 - len(summary["layers"]))
+        summary["layers"][layer] += count
+    return summary
+
+
+def merge_summaries(summaries):
+    """Adds up the summaries of the shards of a checkpoint."""
+    merged = {"parameter_count": 0, "dtypes": {}, "layers": [], "other": 0, "size_bytes": 0}
+    for summary in summaries:
+        for key in ["parameter_count", "other", "size_bytes"]:
+            merged[key] += summary[key]
+        for dtype, count in summary["dtypes"].items():
+            merged["dtypes"][dtype] = merged["dtypes"].get(dtype, 0) + count
+        if len(summary["layers"]) > len(merged["layers"]):
+            merged["layers"] += [0] * (len(summary["layers"]) - len(merged["layers"]))
+        for layer, count in enumerate(summary["layers"]):
+            merged["layers"][layer] += count
+    return merged
+
+
+def hf_cache_dir():
+    """Returns the hub directory of the Hugging Face cache, following the HF_HUB_CACHE and HF_HOME variables."""
+    if os.environ.get("HF_HUB_CACHE"):
+        return os.environ["HF_HUB_CACHE"]
+    hf_home = os.environ.get("HF_HOME") or os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "huggingface")
+    return os.path.join(hf_home, "hub")
+
+
+def resolve_checkpoint(model, cache_dir=None, revision="main"):
+    """
+    Finds the safetensors files of a model on disk.
+
+    :param model: String, a directory, a .safetensors file, a shard index, or a model id (e.g. "Qwen/Qwen2.5-7B-Instruct")
+        looked up in the Hugging Face cache.
+    :param cache_dir: String, the hub directory of the Hugging Face cache (see hf_cache_dir).
+    :param revision: String, the branch, tag or commit of the snapshot in the cache. The most recent snapshot is
+        used if the revision is not in the cache.
+    :return: List of the paths of the .safetensors files.
+    :raises FileNotFoundError: If the model has no safetensors files on disk.
+    """
+    if os.path.isfile(model):
+        return _shard_paths(model) if model.endswith(".json") else [model]
+    directory = model if os.path.isdir(model) else _snapshot_dir(model, cache_dir or hf_cache_dir(), revision)
+    if directory is not None:
+        index_path = os.path.join(directory, SHARD_INDEX_NAME)
+        if os.path.exists(index_path):
+            return _shard_paths(index_path)
+        paths = sorted(glob.glob(os.path.join(directory, "*.safetensors")))
+        if paths:
+            return paths
+    raise FileNotFoundError(f"No safetensors checkpoint of {model} found on disk.")
+
+
+def _shard_paths(index_path):
+    """Returns the shards listed in the weight map of a model.safetensors.index.json."""
+    with open(index_path) as f:
+        weight_map = json.load(f)["weight_map"]
+    directory = os.path.dirname(index_path)
+    return [os.path.join(directory, name) for name in sorted(set(weight_map.values()))]
+
+
+def _snapshot_dir(model_id, cache_dir, revision):
+    """Returns the snapshot directory of a model in the Hugging Face cache, or None."""
+    repo_dir = os.path.join(cache_dir, "models--" + model_id.replace("/", "--"))
+    snapshots = os.path.join(repo_dir, "snapshots")
+    if not os.path.isdir(snapshots):
+        return None
+    ref_path = os.path.join(repo_dir, "refs", revision)
+    commit = revision
+    if os.path.exists(ref_path):
+        with open(ref_path) as f:
+            commit = f.read().strip()
+    if os.path.isdir(os.path.join(snapshots, commit)):
+        return os.path.join(snapshots, commit)
+    candidates = [os.path.join(snapshots, name) for name in os.listdir(snapshots)]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def file_key(path):
+    """
+    Returns the key of a safetensors file in the metadata cache: the name of its blob for the files of the Hugging Face
+    cache (the sha256 of the file), else the sha256 of its header. Either way, the size of the file is appended.
+    """
+    real_path = os.path.realpath(path)
+    size = os.path.getsize(real_path)
+    name = os.path.basename(real_path)
+    if _BLOB_NAME.match(name):
+        return f"{name}-{size}"
+    _, raw = read_safetensors_header(real_path)
+    return f"{hashlib.sha256(raw).hexdigest()}-{size}"
+
+
+class MetadataCache:
+    def __init__(self, path="cache/model_metadata.json"):
+        """
+        Summaries of safetensors files (see summarize_header) kept on disk, keyed by file_key.
+
+        :param path: String, the JSON file of the cache.
+        """
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def summary(self, path):
+        """Returns the summary of a safetensors file, reading its header only if it is not cached."""
+        key = file_key(path)
+        if key not in self.entries:
+            self.entries[key] = summarize_header(read_safetensors_header(path)[0])
+            self._save()
+        return self.entries[key]
+
+    def _save(self):
+        """Writes the cache atomically."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def model_metadata(model, cache=None, cache_dir=None, revision="main"):
+    """
+    Counts the parameters of a model from the headers of its safetensors files, without network access.
+
+    :param model: String, a path or a model id of the Hugging Face cache (see resolve_checkpoint).
+    :param cache: MetadataCache, None to read the headers every time.
+    :param cache_dir: String, the hub directory of the Hugging Face cache.
+    :param revision: String, the revision of the model in the Hugging Face cache.
+    :return: Dictionary, the summary of the checkpoint (see summarize_header) with its "files".
+    :raises FileNotFoundError: If the model has no safetensors files on disk.
+    """
+    paths = resolve_checkpoint(model, cache_dir=cache_dir, revision=revision)
+    if cache is None:
+        summaries = [summarize_header(read_safetensors_header(path)[0]) for path in paths]
+    else:
+        summaries = [cache.summary(path) for path in paths]
+    metadata = merge_summaries(summaries)
+    metadata["files"] = paths
+    return metadata
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Count the parameters of local safetensors checkpoints.")
+    parser.add_argument("models", nargs="+", help="Paths or model ids of the Hugging Face cache")
+    parser.add_argument("--cache_path", default="cache/model_metadata.json")
+    args = parser.parse_args()
+
+    cache = MetadataCache(args.cache_path)
+    for model in args.models:
+        start = time.perf_counter()
+        metadata = model_metadata(model, cache=cache)
+        elapsed = (time.perf_counter() - start) * 1000
+        dtypes = ", ".join(f"{dtype} {count / 1e9:.3f}B" for dtype, count in metadata["dtypes"].items())
+        print(
+            f"{model}: {metadata['parameter_count'] / 1e9:.3f}B parameters ({dtypes}), {len(metadata['layers'])} layers, "
+            f"{len(metadata['files'])} files, {metadata['size_bytes'] / 1024 ** 3:.2f} GB ({elapsed:.1f} ms)"
+        )
@@ -0,0 +1,165 @@
+import importlib.util
+import json
+import os
+import py_compile
+import time
+
+from src.history import function_hash
+
+
+def load_action_module(path):
+    """
+    Imports a policy module from its file, using its cached bytecode, and returns its action_function.
+
+    :param path: String, the path of the module.
+    :return: The action_function callable.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert callable(getattr(module, "action_function", None)), "Generated code does not define a callable 'action_function'."
+    return module.action_function
+
+
+class PolicyRegistry:
+    def __init__(self, path="cache/policies", run_id=None):
+        """
+        Registry of all the versions of the action function, kept across runs.
+
+        Each version is stored as a module named after the hash of its source (see history.function_hash), compiled
+        once to bytecode in __pycache__. The scores of the versions are kept in index.json, keyed by the evaluation
+        that produced them, so that a version seen in an earlier run is neither recompiled nor rescored.
+        The active version and best() are scoped to the run: a run never installs a function only written by another.
+
+        :param path: String, the directory of the registry.
+        :param run_id: String, the run using the registry (kept in the checkpoints to resume it), a new id if None.
+        """
+        self.path = os.path.abspath(path)  # the modules are also imported by the sandbox workers
+        os.makedirs(path, exist_ok=True)
+        self.index = {"versions": {}}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        self.run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._run = self.index.setdefault("runs", {}).setdefault(self.run_id, {"active": None, "versions": []})
+        self._functions = {}
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.path, "index.json")
+
+    def _save(self):
+        """Writes the index atomically."""
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self._index_path)
+
+    def module_path(self, version):
+        return os.path.join(self.path, f"policy_{version}.py")
+
+    def source(self, version):
+        with open(self.module_path(version)) as f:
+            return f.read()
+
+    @property
+    def active(self):
+        """The version currently in use by the run."""
+        return self._run["active"]
+
+    def register(self, source):
+        """
+        Stores a source as a module and compiles it, if it is not already in the registry.
+
+        :param source: String, the code defining action_function(observation, memory_dict).
+        :return: String, the version (hash of the source).
+        :raises SyntaxError: If the source does not compile, in which case it is not registered.
+        """
+        version = function_hash(source)
+        path = self.module_path(version)
+        if version in self.index["versions"] and os.path.exists(path):
+            self._add_to_run(version)
+            return version
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(source)
+        os.replace(tmp_path, path)
+        try:
+            py_compile.compile(path, doraise=True)
+        except py_compile.PyCompileError as e:
+            os.remove(path)
+            raise e.exc_value
+        self.index["versions"][version] = {"created": time.time(), "scores": {}, "n_crashes": 0}
+        self._add_to_run(version)
+        return version
+
+    def _add_to_run(self, version):
+        """Adds a version to those of the run (among which best() chooses) and saves the index."""
+        if version not in self._run["versions"]:
+            self._run["versions"].append(version)
+        self._save()
+
+    def load(self, version):
+        """Returns the action_function of a version, imported in this process."""
+        if version not in self._functions:
+            self._functions[version] = load_action_module(self.module_path(version))
+        return self._functions[version]
+
+    def activate(self, version):
+        """Marks a version as the one in use by the run."""
+        self._run["active"] = version
+        self._add_to_run(version)
+
+    def record_score(self, version, key, stats):
+        """
+        Adds an evaluation of a version to its score, averaged over all its evaluations with the same key.
+
+        :param version: String, the version.
+        :param key: String, identifies the evaluation (environment, number of episodes...), scores are only compared
+            within a key.
+        :param stats: Dict with at least mean_return, as returned by evaluation.aggregate_results.
+        """
+        n_episodes = len(stats.get("episodes", [])) or 1
+        success_rate = stats.get("success_rate") or 0.0
+        score = self.index["versions"][version]["scores"].get(key)
+        if score is None:
+            score = {"mean_return": 0.0, "success_rate": 0.0, "num_errors": 0, "n_episodes": 0}
+        total = score["n_episodes"] + n_episodes
+        score["mean_return"] += (stats["mean_return"] - score["mean_return"]) * n_episodes / total
+        score["success_rate"] += (success_rate - score["success_rate"]) * n_episodes / total
+        score["num_errors"] += stats.get("num_errors", 0)
+        score["n_episodes"] = total
+        self.index["versions"][version]["scores"][key] = score
+        self._save()
+
+    def score(self, version, key):
+        """Returns the stored evaluation of a version, or None if it was not evaluated with this key."""
+        entry = self.index["versions"].get(version)
+        return None if entry is None else entry["scores"].get(key)
+
+    def record_crash(self, version):
+        """Counts a failure of a version while it was in use, which excludes it from best()."""
+        self.index["versions"][version]["n_crashes"] += 1
+        self._save()
+
+    def record_fix(self, version, signature, fixed_version):
+        """Remembers that fixed_version was written to fix the error of a given signature (see ExecError) of a version."""
+        self.index.setdefault("fixes", {})[f"{version}/{signature}"] = fixed_version
+        self._save()
+
+    def fix(self, version, signature):
+        """Returns the version that fixed an error of a version, or None if the error was never fixed."""
+        return self.index.get("fixes", {}).get(f"{version}/{signature}")
+
+    def best(self, key):
+        """Returns the version of the run with the best mean return under a key, among those that never failed, or None."""
+        best_version, best_return = None, None
+        for version in self._run["versions"]:
+            entry = self.index["versions"][version]
+            score = entry["scores"].get(key)
+            if score is None or score["num_errors"] > 0 or entry["n_crashes"] > 0:
+                continue
+            if best_return is None or score["mean_return"] > best_return:
+                best_version, best_return = version, score["mean_return"]
+        return best_version
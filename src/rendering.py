@@ -0,0 +1,207 @@
+import queue
+import threading
+
+import numpy as np
+
+RENDER_MODES = [None, "rgb_array", "human", "video"]
+
+# RGB colors of the maze cells, taken from the viridis colormap used by the original matplotlib rendering
+MAZE_COLORS = {
+    "empty": (68, 1, 84),  # viridis(0.0)
+    "wall": (253, 231, 37),  # viridis(1.0)
+    "agent": (33, 145, 140),  # viridis(0.5)
+    "goal": (122, 209, 81),  # viridis(0.8)
+}
+
+
+def maze_frame(maze, agent_pos, goal_pos, scale=1):
+    """
+    Builds an RGB image of a maze.
+
+    :param maze: 2D array, 1 for walls and 0 for empty cells.
+    :param agent_pos: Tuple (r, c), the position of the agent.
+    :param goal_pos: Tuple (r, c), the position of the goal.
+    :param scale: Integer, the number of pixels per cell side.
+    :return: uint8 array of shape (rows * scale, cols * scale, 3).
+    """
+    frame = np.empty(maze.shape + (3,), dtype=np.uint8)
+    frame[...] = MAZE_COLORS["empty"]
+    frame[maze == 1] = MAZE_COLORS["wall"]
+    frame[tuple(agent_pos)] = MAZE_COLORS["agent"]
+    frame[tuple(goal_pos)] = MAZE_COLORS["goal"]
+    return upscale(frame, scale)
+
+
+def upscale(frame, scale):
+    """Repeats each pixel of the frame scale times along both axes."""
+    if scale == 1:
+        return frame
+    return np.repeat(np.repeat(frame, scale, axis=0), scale, axis=1)
+
+
+class FrameRecorder:
+    def __init__(self, path=None, fps=10, max_queue_size=256):
+        """
+        Encodes frames on a background thread, so that recording does not block the control loop.
+
+        :param path: String, the video file (.mp4, .gif, ...) to write with imageio. If None, the frames
+            are kept in memory and returned as a single NumPy array by close().
+        :param fps: Integer, the frame rate of the video.
+        :param max_queue_size: Integer, the number of frames waiting to be encoded. Frames added while
+            the queue is full are dropped rather than blocking the caller.
+        """
+        self.path = path
+        self.fps = fps
+        self.frames = []
+        self.n_dropped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, frame):
+        """Queues a frame for encoding."""
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.n_dropped += 1
+
+    def _run(self):
+        writer = None
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    break
+                if self.path is None:
+                    self.frames.append(frame)
+                    continue
+                if writer is None:
+                    writer = self._open_writer()
+                writer.append_data(frame)
+        except Exception as e:
+            self.error = e
+            # Keep consuming the queue so that close() never blocks
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _open_writer(self):
+        try:
+            import imageio
+        except ImportError as e:
+            raise ImportError(
+                "You must install package `imageio` to record videos: for instance run `pip install imageio imageio-ffmpeg`."
+            ) from e
+        return imageio.get_writer(self.path, fps=self.fps)
+
+    def close(self):
+        """
+        Waits for the queued frames to be encoded and closes the video.
+
+        :return: uint8 array of shape (n_frames, H, W, 3) if frames are kept in memory, else None.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        if self.path is None:
+            return np.stack(self.frames) if self.frames else None
+        return None
+
+
+class Renderer:
+    def __init__(self, render_mode=None, render_every=1, video_path=None, fps=10, pause=0.1, title=None):
+        """
+        Rendering backend shared by the environments.
+
+        :param render_mode: None (nothing is rendered), "rgb_array" (render() returns the frame), "human"
+            (matplotlib window) or "video" (frames encoded on a background thread, see FrameRecorder).
+        :param render_every: Integer, only one call to render() every render_every calls produces a frame.
+        :param video_path: String, the video file in "video" mode. If None, the frames are kept in memory.
+        :param fps: Integer, the frame rate of the video.
+        :param pause: Float, the time in seconds the matplotlib window waits after each frame in "human" mode.
+        :param title: String, the title of the matplotlib window.
+        """
+        assert render_mode in RENDER_MODES, f"Unknown render mode {render_mode}, expected one of {RENDER_MODES}."
+        self.render_mode = render_mode
+        self.render_every = render_every
+        self.video_path = video_path
+        self.fps = fps
+        self.pause = pause
+        self.title = title
+        self.active = True
+        self.n_calls = 0
+        self.recorder = None
+        self._fig = None
+        self._image = None
+
+    def render(self, make_frame):
+        """
+        Renders a frame according to the render mode.
+
+        :param make_frame: Callable returning the current frame as an RGB uint8 array. It is only called
+            when a frame is actually needed, so headless runs pay nothing for rendering.
+        :return: The frame in "rgb_array" mode, else None.
+        """
+        if self.render_mode is None or not self.active:
+            return None
+        self.n_calls += 1
+        if (self.n_calls - 1) % self.render_every != 0:
+            return None
+
+        frame = make_frame()
+        if self.render_mode == "rgb_array":
+            return frame
+        elif self.render_mode == "video":
+            if self.recorder is None:
+                self.recorder = FrameRecorder(self.video_path, fps=self.fps)
+            self.recorder.add(frame)
+        elif self.render_mode == "human":
+            self._show(frame)
+        return None
+
+    def _show(self, frame):
+        import matplotlib.pyplot as plt
+
+        if self._fig is None:
+            plt.ion()
+            self._fig, ax = plt.subplots()
+            self._fig.canvas.mpl_connect("close_event", self.on_close)
+            ax.set_xticks([])
+            ax.set_yticks([])
+            if self.title is not None:
+                ax.set_title(self.title)
+            self._image = ax.imshow(frame, origin="upper")
+        else:
+            self._image.set_data(frame)
+        self._fig.canvas.draw_idle()
+        plt.pause(self.pause)
+
+    def on_close(self, event):
+        """Stops rendering when the window is closed."""
+        self.active = False
+
+    def close(self, keep_window=False):
+        """
+        Closes the matplotlib window or finishes the video.
+
+        :param keep_window: Boolean, if True, the matplotlib window stays open until the user closes it.
+        :return: The recorded frames in "video" mode without video_path, else None.
+        """
+        frames = None
+        if self.recorder is not None:
+            frames = self.recorder.close()
+            self.recorder = None
+        if self._fig is not None:
+            import matplotlib.pyplot as plt
+
+            plt.ioff()
+            if keep_window:
+                plt.show()
+            else:
+                plt.close(self._fig)
+            self._fig = None
+        return frames
@@ -0,0 +1,276 @@
+import multiprocessing
+import os
+import traceback
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from src.exec_errors import ExecError, capture_error, compile_generated
+from src.policy_registry import load_action_module
+
+
+class PolicyError(Exception):
+    """Raised when the action function fails in the sandbox worker."""
+
+    def __init__(self, message, error_type=None, stack_trace=None, exec_error=None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.stack_trace = stack_trace
+        self.exec_error = exec_error if exec_error is not None else ExecError(error_type or "PolicyError", message)
+
+
+class PolicyTimeout(PolicyError):
+    """Raised when the action function exceeds its time budget, the worker is restarted."""
+
+
+class PolicyCrashed(PolicyError):
+    """Raised when the worker process dies (segfault, CPU limit...), the worker is restarted."""
+
+
+def _address_space_size():
+    """Returns the virtual memory size of the current process in bytes, or 0 if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _set_limits(memory_limit, cpu_limit):
+    """Sets the rlimits of the worker process (not available on Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return
+    if memory_limit is not None:
+        # The limit is relative to the memory already mapped by the forked process
+        limit = _address_space_size() + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_limit is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+
+
+def _error_reply(e, source=None):
+    return "error", (f"{type(e).__name__}: {e}", type(e).__name__, traceback.format_exc(), capture_error(e, source).to_dict())
+
+
+def _worker_main(conn, memory_limit, cpu_limit):
+    """Loop of the worker process, executing the commands sent by SandboxedPolicy."""
+    _set_limits(memory_limit, cpu_limit)
+    action_function = None
+    source = None
+    memory_dict = {}
+    shm, maze = None, None
+    while True:
+        try:
+            command, arg = conn.recv()
+        except EOFError:
+            break
+        try:
+            if command == "act":
+                # The maze is read from shared memory, only the agent position travels through the pipe
+                action, memory_dict = action_function((maze, arg), memory_dict)
+                reply = "ok", action
+            elif command == "act_object":
+                action, memory_dict = action_function(arg, memory_dict)
+                reply = "ok", action
+            elif command == "load":
+                exec_globals = {}
+                exec(compile_generated(arg), exec_globals)
+                assert "action_function" in exec_globals and callable(
+                    exec_globals["action_function"]
+                ), "Generated code does not define a callable 'action_function'."
+                action_function = exec_globals["action_function"]
+                source = arg
+                reply = "ok", None
+            elif command == "load_module":
+                # The function is only replaced once the module is imported successfully
+                action_function = load_action_module(arg)
+                reply = "ok", None
+            elif command == "reset":
+                memory_dict = {}
+                reply = "ok", None
+            elif command == "memory":
+                reply = "ok", memory_dict
+            elif command == "attach":
+                name, shape, dtype = arg
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name)
+                maze = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                maze.flags.writeable = False  # observations are read-only, as the ones of SimpleMaze
+                reply = "ok", None
+            else:
+                reply = "error", (f"Unknown command {command}", None, None, None)
+        except Exception as e:
+            # The lines of the errors are read from the source of the code being loaded or run
+            reply = _error_reply(e, arg if command == "load" else source)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # The action or the memory dict can not be pickled
+            conn.send(_error_reply(e))
+
+
+def _shutdown(process, conn):
+    conn.close()
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SandboxedPolicy:
+    def __init__(self, timeout=1.0, memory_limit=1 << 30, cpu_limit=None):
+        """
+        Runs the generated action function in a long-lived worker process.
+
+        The worker keeps the function and its memory_dict, so that only the agent position and the action
+        cross the process boundary at each step, the maze being shared through shared memory. A call that
+        exceeds the timeout or kills the worker raises an error, and the worker is restarted with the same
+        function (its memory_dict is lost).
+
+        :param timeout: Float, the time budget in seconds of each call to the action function.
+        :param memory_limit: Integer, the number of bytes the worker can allocate (RLIMIT_AS), None for no limit.
+        :param cpu_limit: Integer, the CPU seconds the worker can use before being killed (RLIMIT_CPU), None for no limit.
+        """
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.source = None
+        self.module_path = None
+        self.n_restarts = 0
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        self._shm = None
+        self._shm_array = None
+        # Workers must share the resource tracker of this process, otherwise the shared memory
+        # would be unlinked by the tracker of a worker when it is killed
+        resource_tracker.ensure_running()
+        self._start()
+
+    def _spawn(self):
+        """Starts a worker without function, attached to the shared memory of the maze if there is one."""
+        self._conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_worker_main, args=(child_conn, self.memory_limit, self.cpu_limit), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._finalizer = weakref.finalize(self, _shutdown, self._process, self._conn)
+        if self._shm is not None:
+            self._call("attach", (self._shm.name, self._shm_array.shape, self._shm_array.dtype.str), self.timeout, restart=False)
+
+    def _kill(self):
+        self._finalizer.detach()
+        _shutdown(self._process, self._conn)
+
+    def _start(self):
+        """
+        Starts a worker with the current function. A function that can not be loaded again within the timeout (e.g. its
+        module hangs at import) is dropped, the worker is left without function and a PolicyError is raised.
+        """
+        self._spawn()
+        try:
+            if self.module_path is not None:
+                self._call("load_module", self.module_path, self.timeout, restart=False)
+            elif self.source is not None:
+                self._call("load", self.source, self.timeout, restart=False)
+        except PolicyError as e:
+            self.source = None
+            self.module_path = None
+            self._kill()
+            self._spawn()
+            message = f"The action function could not be loaded again in the restarted worker: {e}"
+            raise type(e)(message, e.error_type, e.stack_trace, e.exec_error) from e
+
+    def restart(self):
+        """Kills the worker and starts a new one with the current function."""
+        self._kill()
+        self.n_restarts += 1
+        self._start()
+
+    def _call(self, command, arg=None, timeout=None, restart=True):
+        """
+        Sends a command to the worker and returns its result.
+
+        :param restart: Boolean, if True, the worker is restarted when the call times out or the worker dies, else it is
+            left as is (for the calls made while starting the worker).
+        """
+        try:
+            self._conn.send((command, arg))
+            if not self._conn.poll(timeout):
+                if restart:
+                    self.restart()
+                raise PolicyTimeout(f"The action function did not return within {timeout} seconds.", "TimeoutError")
+            status, result = self._conn.recv()
+        except (EOFError, OSError) as e:
+            self._process.join(timeout=1)
+            exitcode = self._process.exitcode
+            if restart:
+                self.restart()
+            raise PolicyCrashed(f"The worker executing the action function died (exit code {exitcode}).", "WorkerCrash") from e
+        if status == "error":
+            message, error_type, stack_trace, exec_error = result
+            raise PolicyError(message, error_type, stack_trace, exec_error and ExecError.from_dict(exec_error))
+        return result
+
+    def load(self, source):
+        """Defines the action function in the worker from its source."""
+        self._call("load", source, timeout=self.timeout)
+        self.source = source
+        self.module_path = None
+
+    def load_module(self, path):
+        """Defines the action function in the worker by importing a module (with its cached bytecode), see PolicyRegistry."""
+        self._call("load_module", path, timeout=self.timeout)
+        self.module_path = path
+
+    def reset(self):
+        """Resets the memory_dict at the beginning of an episode."""
+        self._call("reset", timeout=self.timeout)
+
+    def memory_dict(self):
+        """Returns a copy of the current memory_dict of the action function."""
+        return self._call("memory", timeout=self.timeout)
+
+    def act(self, observation):
+        """
+        Calls the action function on an observation, with the memory_dict kept in the worker.
+
+        :param observation: The observation, a (maze, agent_pos) tuple goes through shared memory, other objects are pickled.
+        :return: The action.
+        """
+        if isinstance(observation, tuple) and len(observation) == 2 and isinstance(observation[0], np.ndarray):
+            maze, agent_pos = observation
+            if self._shm_array is None or self._shm_array.shape != maze.shape or self._shm_array.dtype != maze.dtype:
+                self._allocate(maze)
+            np.copyto(self._shm_array, maze)
+            return self._call("act", agent_pos, timeout=self.timeout)
+        return self._call("act_object", observation, timeout=self.timeout)
+
+    def _allocate(self, maze):
+        """Creates the shared memory holding the maze, for a new shape or dtype."""
+        self._shm_array = None
+        if self._shm is not None:
+            self._shm_finalizer()
+        self._shm = shared_memory.SharedMemory(create=True, size=max(maze.nbytes, 1))
+        self._shm_finalizer = weakref.finalize(self, _release, self._shm)
+        self._shm_array = np.ndarray(maze.shape, dtype=maze.dtype, buffer=self._shm.buf)
+        self._call("attach", (self._shm.name, maze.shape, maze.dtype.str), timeout=self.timeout)
+
+    def close(self):
+        """Stops the worker and releases the shared memory."""
+        self._finalizer()
+        self._shm_array = None
+        if self._shm is not None:
+            self._shm_finalizer()
+            self._shm = None
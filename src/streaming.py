@@ -0,0 +1,144 @@
+import ast
+
+CODE_FENCE_OPEN = "```python\n"
+CODE_FENCE_CLOSE = "```"
+
+
+class CodeFenceParser:
+    def __init__(self, open_fence=CODE_FENCE_OPEN, close_fence=CODE_FENCE_CLOSE):
+        """
+        Incremental parser of the first code block of a streamed answer, with the same result as
+        re.search(r"```python\\n(.*?)```", text, re.DOTALL) on the whole text.
+
+        Only the last few characters are searched again at each delta, so that feeding the whole answer is linear.
+
+        :param open_fence: String, the opening of the code block.
+        :param close_fence: String, the closing of the code block.
+        """
+        self.open_fence = open_fence
+        self.close_fence = close_fence
+        self.code = None  # source of the block (stripped) once it is closed
+        self._parts = []
+        self._code_parts = []
+        self._window = ""  # text not yet known to be outside of a fence
+        self._in_block = False
+
+    @property
+    def text(self):
+        """The text received so far."""
+        return "".join(self._parts)
+
+    def feed(self, delta):
+        """
+        Adds a delta of the answer.
+
+        :param delta: String, the new text.
+        :return: String, the source of the code block when this delta closes it, else None.
+        """
+        self._parts.append(delta)
+        if self.code is not None or not delta:
+            return None
+        self._window += delta
+        if not self._in_block:
+            i = self._window.find(self.open_fence)
+            if i < 0:
+                self._window = self._window[-(len(self.open_fence) - 1) :]
+                return None
+            self._window = self._window[i + len(self.open_fence) :]
+            self._in_block = True
+        j = self._window.find(self.close_fence)
+        if j < 0:
+            # The end of the window may be the beginning of the closing fence
+            keep = len(self.close_fence) - 1
+            self._code_parts.append(self._window[: len(self._window) - keep] if len(self._window) > keep else "")
+            self._window = self._window[-keep:]
+            return None
+        self._code_parts.append(self._window[:j])
+        self.code = "".join(self._code_parts).strip()
+        return self.code
+
+
+def validate_action_function(source):
+    """
+    Checks without executing it that a source compiles and defines action_function(observation, memory_dict).
+
+    :param source: String, the source of the function.
+    :return: The exception (SyntaxError or ValueError) describing the problem, or None if the source is valid.
+    """
+    try:
+        tree = ast.parse(source, "<action_function>")
+        compile(tree, "<action_function>", "exec")
+    except SyntaxError as e:
+        return e
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == "action_function":
+            if len(node.args.args) + len(node.args.posonlyargs) >= 2 or node.args.vararg is not None:
+                return None
+            return ValueError("action_function must take the arguments (observation, memory_dict).")
+    return ValueError("The code does not define a function named action_function.")
+
+
+class StreamResult:
+    def __init__(self, text, code, error, cancelled):
+        """
+        Outcome of consume_stream.
+
+        :param text: String, the text received (cut after the code block if cancelled).
+        :param code: String, the source of the first code block, None if there is none.
+        :param error: Exception raised by the validation of the code, None if valid or no code.
+        :param cancelled: Boolean, True if the stream was closed after the code block.
+        """
+        self.text = text
+        self.code = code
+        self.error = error
+        self.cancelled = cancelled
+
+
+def _delta_content(chunk):
+    if not chunk.choices:
+        return ""  # e.g. the final usage chunk
+    return chunk.choices[0].delta.content or ""
+
+
+def consume_stream(stream, validate=validate_action_function, cancel_after_code=False):
+    """
+    Reads a streamed chat completion, extracting the code block as soon as it is closed.
+
+    :param stream: Iterable of completion chunks, as returned by chat.completions.create(stream=True).
+    :param validate: Function source -> exception or None, called as soon as the code block is closed.
+    :param cancel_after_code: Boolean, if True, the stream is closed once a valid code block is received,
+        which stops the generation (and the billing) of the rest of the answer.
+    :return: StreamResult.
+    """
+    parser = CodeFenceParser()
+    error = None
+    cancelled = False
+    for chunk in stream:
+        code = parser.feed(_delta_content(chunk))
+        if code is None:
+            continue
+        error = validate(code) if validate is not None else None
+        if error is None and cancel_after_code:
+            cancelled = True
+            if hasattr(stream, "close"):
+                stream.close()
+            break
+    return StreamResult(parser.text, parser.code, error, cancelled)
+
+
+async def consume_async_stream(stream, validate=validate_action_function, cancel_after_code=False):
+    """Same as consume_stream, for the streams of an asyncio client."""
+    parser = CodeFenceParser()
+    error = None
+    cancelled = False
+    async for chunk in stream:
+        code = parser.feed(_delta_content(chunk))
+        if code is None:
+            continue
+        error = validate(code) if validate is not None else None
+        if error is None and cancel_after_code:
+            cancelled = True
+            if hasattr(stream, "close"):
+                await stream.close()
+            break
+    return StreamResult(parser.text, parser.code, error, cancelled)
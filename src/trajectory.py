@@ -0,0 +1,260 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+TRAJECTORY_FORMATS = ["npy", "npz", "parquet"]
+
+
+def _write_json(path, data):
+    """Writes a JSON file (or an already serialized JSON string) atomically, so that readers never see a partial index."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data if isinstance(data, str) else json.dumps(data, indent=2))
+    os.replace(tmp_path, path)
+
+
+class TrajectoryRecorder:
+    def __init__(self, path, chunk_size=65536, format="npy", max_pending_chunks=2):
+        """
+        Records the steps of episodes column by column into preallocated NumPy buffers, which are written
+        as chunks by a background thread when full.
+
+        The columns are declared by the first call to record() (their shape and dtype are taken from the values),
+        and two columns are added: "episode" (the episode id) and "step" (the index of the step in the episode).
+        Each chunk lists its episodes with their seed and function hash, in its own metadata and in index.json.
+
+        :param path: String, the directory of the trajectories.
+        :param chunk_size: Integer, the number of steps per chunk.
+        :param format: String, "npy" (one .npy per column, memory-mapped by TrajectoryReader), "npz" (compressed)
+            or "parquet" (requires pyarrow, memory-mapped by TrajectoryReader).
+        :param max_pending_chunks: Integer, the number of full chunks waiting to be written. When the writer is behind,
+            record() blocks rather than dropping steps.
+        """
+        assert format in TRAJECTORY_FORMATS, f"Unknown trajectory format {format}, must be in {TRAJECTORY_FORMATS}."
+        self.path = path
+        self.chunk_size = chunk_size
+        self.format = format
+        self.error = None
+        os.makedirs(path, exist_ok=True)
+        self.index = {"format": format, "columns": {}, "chunks": [], "episodes": {}}
+        if os.path.exists(os.path.join(path, "index.json")):
+            with open(os.path.join(path, "index.json")) as f:
+                self.index = json.load(f)
+            assert self.index["format"] == format, f"{path} already holds {self.index['format']} trajectories."
+
+        self._buffers = None
+        self._n = 0
+        self._chunk_episodes = {}
+        self._episode = None
+        self._step = 0
+        # Sets of buffers that can be filled, the ones being written come back through this queue
+        self._free = queue.Queue()
+        self._n_buffer_sets = max_pending_chunks + 1
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def begin_episode(self, episode_id, seed=None, function_hash=None):
+        """
+        Starts recording an episode.
+
+        :param episode_id: Integer, the id of the episode.
+        :param seed: Integer, the seed of the episode, None if unknown.
+        :param function_hash: String, the hash of the action function used in the episode (see history.function_hash).
+        """
+        self._episode = int(episode_id)
+        self._step = 0
+        self.index["episodes"][str(self._episode)] = {"seed": seed, "function_hash": function_hash, "length": 0}
+
+    def record(self, **columns):
+        """Appends a step to the current episode, e.g. record(action=1, reward=0.0)."""
+        if self._buffers is None:
+            self._allocate(columns)
+        buffers = self._buffers
+        n = self._n
+        for name, value in columns.items():
+            buffers[name][n] = value
+        buffers["episode"][n] = self._episode
+        buffers["step"][n] = self._step
+        self._step += 1
+        if self._episode not in self._chunk_episodes:
+            metadata = self.index["episodes"][str(self._episode)]
+            self._chunk_episodes[self._episode] = {"seed": metadata["seed"], "function_hash": metadata["function_hash"]}
+        self._n = n + 1
+        if self._n == self.chunk_size:
+            self.flush()
+
+    def end_episode(self):
+        """Ends the current episode, its steps are written with the next chunk."""
+        self.index["episodes"][str(self._episode)]["length"] = self._step
+        self._episode = None
+
+    def _allocate(self, columns):
+        """Declares the columns from the values of the first step, and preallocates the buffers."""
+        if not self.index["columns"]:
+            for name, value in columns.items():
+                value = np.asarray(value)
+                self.index["columns"][name] = {"shape": list(value.shape), "dtype": value.dtype.str}
+            self.index["columns"]["episode"] = {"shape": [], "dtype": np.dtype(np.int64).str}
+            self.index["columns"]["step"] = {"shape": [], "dtype": np.dtype(np.int32).str}
+        for _ in range(self._n_buffer_sets):
+            self._free.put(
+                {
+                    name: np.empty((self.chunk_size,) + tuple(column["shape"]), dtype=column["dtype"])
+                    for name, column in self.index["columns"].items()
+                }
+            )
+        self._buffers = self._free.get()
+
+    def flush(self, sync=False):
+        """
+        Sends the steps recorded so far to the writer thread.
+
+        :param sync: Boolean, if True, waits until all the chunks sent are written with their index.json, e.g. before
+            writing a checkpoint that refers to them.
+        """
+        if self.error is not None:
+            raise RuntimeError("Writing the trajectories failed.") from self.error
+        if self._n > 0:
+            self._send_chunk()
+        if sync:
+            self._queue.join()
+            if self.error is not None:
+                raise RuntimeError("Writing the trajectories failed.") from self.error
+
+    def _send_chunk(self):
+        episodes = [{"episode": episode_id, **metadata} for episode_id, metadata in self._chunk_episodes.items()]
+        chunk = {"name": f"chunk_{len(self.index['chunks']):06d}", "n_steps": self._n, "episodes": episodes}
+        self.index["chunks"].append(chunk)
+        # The index is serialized here as it keeps changing while the chunk is written
+        self._queue.put((chunk, json.dumps(self.index, indent=2), self._buffers, self._n))
+        self._buffers = self._free.get()
+        self._n = 0
+        self._chunk_episodes = {}
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            chunk, index, buffers, n = item
+            try:
+                self._write(chunk, {name: buffer[:n] for name, buffer in buffers.items()})
+                _write_json(os.path.join(self.path, "index.json"), index)
+            except Exception as e:
+                self.error = e
+            self._free.put(buffers)
+            self._queue.task_done()
+
+    def _write(self, chunk, arrays):
+        """Writes a chunk in the format of the recorder."""
+        path = os.path.join(self.path, chunk["name"])
+        if self.format == "npy":
+            os.makedirs(path, exist_ok=True)
+            for name, array in arrays.items():
+                np.save(os.path.join(path, f"{name}.npy"), array)
+            _write_json(os.path.join(path, "metadata.json"), chunk)
+        elif self.format == "npz":
+            np.savez_compressed(f"{path}.npz", metadata=np.array(json.dumps(chunk)), **arrays)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Multi-dimensional columns are stored flat as fixed size lists, their shapes are in the index
+            columns = {}
+            for name, array in arrays.items():
+                if array.ndim == 1:
+                    columns[name] = pa.array(array)
+                else:
+                    flat = pa.array(np.ascontiguousarray(array).reshape(-1))
+                    columns[name] = pa.FixedSizeListArray.from_arrays(flat, int(np.prod(array.shape[1:])))
+            table = pa.table(columns).replace_schema_metadata({"metadata": json.dumps(chunk)})
+            pq.write_table(table, f"{path}.parquet", compression="zstd")
+
+    def close(self):
+        """Writes the remaining steps and waits for the writer thread."""
+        if self._episode is not None:
+            self.end_episode()
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        _write_json(os.path.join(self.path, "index.json"), self.index)
+        if self.error is not None:
+            raise RuntimeError("Writing the trajectories failed.") from self.error
+
+
+class TrajectoryReader:
+    def __init__(self, path):
+        """
+        Reads the trajectories written by TrajectoryRecorder. The npy and parquet chunks are memory-mapped,
+        so that reading a column does not copy it (except when it is concatenated over several chunks).
+
+        :param path: String, the directory of the trajectories.
+        """
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.index = json.load(f)
+        self.format = self.index["format"]
+        self.columns = self.index["columns"]
+        self.episodes = {int(episode_id): metadata for episode_id, metadata in self.index["episodes"].items()}
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.index["chunks"])
+
+    def chunk(self, i):
+        """Returns the columns of the chunk i as a dictionary of arrays."""
+        if i not in self._chunks:
+            name = self.index["chunks"][i]["name"]
+            path = os.path.join(self.path, name)
+            if self.format == "npy":
+                arrays = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in self.columns}
+            elif self.format == "npz":
+                with np.load(f"{path}.npz") as data:
+                    arrays = {column: data[column] for column in self.columns}
+            else:
+                import pyarrow.parquet as pq
+
+                table = pq.read_table(f"{path}.parquet", memory_map=True)
+                arrays = {}
+                for column, spec in self.columns.items():
+                    values = table.column(column).combine_chunks()
+                    if spec["shape"]:
+                        values = values.flatten()
+                    arrays[column] = values.to_numpy(zero_copy_only=False).reshape((-1,) + tuple(spec["shape"]))
+            self._chunks[i] = arrays
+        return self._chunks[i]
+
+    def iter_chunks(self):
+        """Yields the chunk metadata and columns of all the chunks."""
+        for i, chunk in enumerate(self.index["chunks"]):
+            yield chunk, self.chunk(i)
+
+    def column(self, name):
+        """Returns a column over all the chunks."""
+        arrays = [self.chunk(i)[name] for i in range(len(self))]
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+    def episode(self, episode_id):
+        """
+        Returns the steps of an episode.
+
+        :param episode_id: Integer, the id of the episode.
+        :return: Dictionary of arrays, views of the chunk when the episode is in a single chunk.
+        """
+        parts = []
+        for i, chunk in enumerate(self.index["chunks"]):
+            if any(episode["episode"] == episode_id for episode in chunk["episodes"]):
+                arrays = self.chunk(i)
+                mask = np.flatnonzero(arrays["episode"] == episode_id)
+                # The steps of an episode are contiguous in a chunk, so a slice is enough
+                parts.append({name: array[mask[0] : mask[-1] + 1] for name, array in arrays.items()})
+        if not parts:
+            raise KeyError(f"Episode {episode_id} not found in {self.path}.")
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
@@ -0,0 +1,104 @@
+import numpy as np
+
+# Row/col displacement of each GridWorld action (0=up, 1=down, 2=left, 3=right).
+# The last row is used for invalid actions, which leave the agent in place like in GridWorld.step.
+ACTION_DELTAS = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [0, 0]], dtype=np.int16)
+
+
+class VecGridWorld:
+    def __init__(self, num_envs, size=5, max_steps=50, seed=None, grid_dtype=np.uint8):
+        """
+        Batched version of GridWorld, whose state is only the positions of the agents and goals of B worlds.
+
+        All the worlds are stepped at once with vectorized clipping, and the worlds that are done are
+        automatically reset. The one-hot grids are only built when grid_observation() is called.
+
+        :param num_envs: Integer, the number of worlds B stepped in parallel.
+        :param size: Integer, the size of the grids (size x size).
+        :param max_steps: Integer, the number of steps after which an episode ends.
+        :param seed: Seed of the numpy Generator of the initial positions.
+        :param grid_dtype: Dtype of the one-hot grids returned by grid_observation().
+        """
+        assert size < np.iinfo(np.int16).max, "Positions are stored as int16."
+        self.num_envs = num_envs
+        self.size = size
+        self.max_steps = max_steps
+        self.grid_dtype = grid_dtype
+        self.rng = np.random.default_rng(seed)
+        self.idx_to_name_channel = {0: "agent", 1: "goal"}
+        self.name_to_idx_channel = {v: k for k, v in self.idx_to_name_channel.items()}
+        self.n_channels = len(self.idx_to_name_channel)
+
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int16)
+        self.goal_pos = np.full((num_envs, 2), size // 2, dtype=np.int16)  # Center goal position
+        self.steps = np.zeros(num_envs, dtype=np.int32)
+        self._env_idx = np.arange(num_envs)
+        self._grid = None
+        self.reset()
+
+    def reset(self, seed=None):
+        """Resets all the worlds, and returns a copy of the agent positions of shape (B, 2)."""
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self._reset_envs(self._env_idx)
+        return self.agent_pos.copy()
+
+    def _reset_envs(self, idx):
+        """Puts the agents of the worlds of index idx at a random corner."""
+        self.agent_pos[idx] = self.rng.choice([0, self.size - 1], size=(len(idx), 2))
+        self.steps[idx] = 0
+        self._grid = None
+
+    def step(self, actions):
+        """
+        Takes a step in every world and auto-resets the worlds that are done.
+
+        :param actions: Array of B integers (0=up, 1=down, 2=left, 3=right).
+        :return: Tuple (positions, dones, info). positions is a copy of the agent positions, already reset for
+            the worlds that are done, whose final positions and lengths are in info["final_agent_pos"] and info["episode_length"].
+        """
+        actions = np.asarray(actions)
+        valid = (actions >= 0) & (actions <= 3)
+        self.agent_pos += ACTION_DELTAS[np.where(valid, actions, 4)]
+        np.clip(self.agent_pos, 0, self.size - 1, out=self.agent_pos)
+        self.steps += 1
+        self._grid = None
+
+        dones = (self.steps >= self.max_steps) | np.all(self.agent_pos == self.goal_pos, axis=1)
+        info = {}
+        done_idx = np.flatnonzero(dones)
+        if len(done_idx) > 0:
+            info["final_agent_pos"] = self.agent_pos[done_idx].copy()
+            info["episode_length"] = self.steps[done_idx].copy()
+            info["done_idx"] = done_idx
+            self._reset_envs(done_idx)
+        return self.agent_pos.copy(), dones, info
+
+    def grid_observation(self):
+        """
+        Returns the one-hot grids of the worlds, of shape (B, size, size, n_channels), like GridWorld.grid.
+
+        The grids are built on the first call after a step and cached until the next one, the returned array is read-only.
+        """
+        if self._grid is None:
+            self._grid = np.zeros((self.num_envs, self.size, self.size, self.n_channels), dtype=self.grid_dtype)
+            agent, goal = self.name_to_idx_channel["agent"], self.name_to_idx_channel["goal"]
+            self._grid[self._env_idx, self.agent_pos[:, 0], self.agent_pos[:, 1], agent] = 1
+            self._grid[self._env_idx, self.goal_pos[:, 0], self.goal_pos[:, 1], goal] = 1
+            self._grid.flags.writeable = False
+        return self._grid
+
+
+# Example Usage
+if __name__ == "__main__":
+    import time
+
+    env = VecGridWorld(num_envs=4096, size=5, max_steps=50, seed=0)
+    start = time.perf_counter()
+    n_episodes = 0
+    for _ in range(1000):
+        actions = env.rng.integers(0, 4, size=env.num_envs)  # Random actions
+        positions, dones, info = env.step(actions)
+        n_episodes += dones.sum()
+    duration = time.perf_counter() - start
+    print(f"{1000 * env.num_envs / duration:.0f} steps/s, {n_episodes} episodes")
@@ -0,0 +1,145 @@
+import numpy as np
+
+# Row/col displacement of each SimpleMaze action (0=up, 1=right, 2=down, 3=left).
+# The last row is used for invalid actions, which leave the agent in place like in SimpleMaze.step.
+ACTION_DELTAS = np.array([[-1, 0], [0, 1], [1, 0], [0, -1], [0, 0]], dtype=np.int64)
+
+
+class VecMaze:
+    def __init__(self, num_envs, size=(10, 10), dynamic=False, max_steps=100, seed=None, dtype=np.float64):
+        """
+        Batched version of SimpleMaze holding N mazes in a single NumPy array.
+
+        All the mazes are stepped at once with a vector of actions, and the mazes
+        that are done are automatically reset, so the batch never has to be restarted.
+
+        :param num_envs: Integer, the number of mazes N stepped in parallel.
+        :param size: Tuple, the dimensions of each maze (rows, cols).
+        :param dynamic: Boolean, if True, walls can change dynamically.
+        :param max_steps: Integer, the number of steps after which an episode ends.
+        :param seed: Seed of the numpy Generator used for walls.
+        :param dtype: Dtype of the maze array (float64 to match SimpleMaze observations).
+        """
+        self.num_envs = num_envs
+        self.rows, self.cols = size
+        self.dynamic = dynamic
+        self.max_steps = max_steps
+        self.dtype = dtype
+        self.rng = np.random.default_rng(seed)
+
+        self.mazes = np.zeros((num_envs, self.rows, self.cols), dtype=dtype)
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.goal_pos = np.array([self.rows - 1, self.cols - 1], dtype=np.int64)
+        self.t = np.zeros(num_envs, dtype=np.int64)
+        self.episode_returns = np.zeros(num_envs, dtype=np.float64)
+        self._env_idx = np.arange(num_envs)
+        self.reset()
+
+    def reset(self, seed=None):
+        """Resets all the mazes and places the agents and goals."""
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self._reset_envs(self._env_idx)
+        return self.get_observation(), {}
+
+    def _reset_envs(self, idx):
+        """Regenerates the walls of the mazes of index idx and puts their agents back at the start."""
+        n_cells = self.rows * self.cols
+        self.mazes[idx] = 0
+
+        # Add walls : same number of draws (with replacement) as SimpleMaze, ~25% of the cells
+        cells = self.rng.integers(0, n_cells, size=(len(idx), n_cells // 4))
+        self.mazes.reshape(self.num_envs, n_cells)[idx[:, None], cells] = 1
+
+        # Ensure the agent and goal positions are not walls
+        self.agent_pos[idx] = 0
+        self.mazes[idx, 0, 0] = 0
+        self.mazes[idx, self.goal_pos[0], self.goal_pos[1]] = 0
+        self.t[idx] = 0
+        self.episode_returns[idx] = 0
+
+    def get_observation(self):
+        """Returns the batched state of the mazes, of shapes (N, rows, cols) and (N, 2)."""
+        return self.mazes, self.agent_pos
+
+    def observation(self, i):
+        """Returns the observation of the i-th maze in the SimpleMaze format (maze, (r, c))."""
+        return self.mazes[i], (int(self.agent_pos[i, 0]), int(self.agent_pos[i, 1]))
+
+    def step(self, actions):
+        """
+        Executes one action in every maze and auto-resets the mazes that are done.
+
+        :param actions: Array of N integers (0=up, 1=right, 2=down, 3=left).
+        :return: Tuple (observation, rewards, dones, truncated, info). The observation of a
+            maze that was done is already the one of its new episode, info["final_agent_pos"],
+            info["episode_return"] and info["episode_length"] describe the episode that ended.
+        """
+        actions = np.asarray(actions)
+        valid = (actions >= 0) & (actions <= 3)
+        delta = ACTION_DELTAS[np.where(valid, actions, 4)]
+
+        # Move inside the borders, then cancel the moves that hit a wall
+        new_pos = self.agent_pos + delta
+        np.clip(new_pos[:, 0], 0, self.rows - 1, out=new_pos[:, 0])
+        np.clip(new_pos[:, 1], 0, self.cols - 1, out=new_pos[:, 1])
+        hit_wall = self.mazes[self._env_idx, new_pos[:, 0], new_pos[:, 1]] == 1
+        self.agent_pos = np.where(hit_wall[:, None], self.agent_pos, new_pos)
+
+        # Check if the goal is reached
+        reached = np.all(self.agent_pos == self.goal_pos, axis=1)
+        rewards = np.where(reached, 1.0, -0.01)  # Small penalty for each step
+
+        # Optionally, update the mazes dynamically
+        if self.dynamic:
+            self._update_walls()
+
+        # Increase the time step and stop after max_steps steps
+        self.t += 1
+        dones = reached | (self.t >= self.max_steps)
+        self.episode_returns += rewards
+
+        info = {}
+        done_idx = np.flatnonzero(dones)
+        if len(done_idx) > 0:
+            info["final_agent_pos"] = self.agent_pos[done_idx].copy()
+            info["episode_return"] = self.episode_returns[done_idx].copy()
+            info["episode_length"] = self.t[done_idx].copy()
+            info["done_idx"] = done_idx
+            self._reset_envs(done_idx)
+
+        return self.get_observation(), rewards, dones, np.zeros(self.num_envs, dtype=bool), info
+
+    def _update_walls(self):
+        """Randomly change the walls in all the mazes, with the same rate as SimpleMaze._update_walls."""
+        n_cells = self.rows * self.cols
+        cells = self.rng.integers(0, n_cells, size=(self.num_envs, n_cells // 20))
+        cells += (self._env_idx * n_cells)[:, None]
+
+        # A cell drawn an even number of times is toggled back to its original state
+        cells, counts = np.unique(cells, return_counts=True)
+        cells = cells[counts % 2 == 1]
+
+        # The agent and goal cells are never toggled
+        agent_cells = self._env_idx * n_cells + self.agent_pos[:, 0] * self.cols + self.agent_pos[:, 1]
+        goal_cells = self._env_idx * n_cells + self.goal_pos[0] * self.cols + self.goal_pos[1]
+        cells = cells[~np.isin(cells, agent_cells) & ~np.isin(cells, goal_cells)]
+
+        flat_mazes = self.mazes.reshape(-1)
+        flat_mazes[cells] = flat_mazes[cells] == 0  # Toggle wall state
+
+
+# Example Usage
+if __name__ == "__main__":
+    import time
+
+    env = VecMaze(num_envs=1000, size=(10, 10), dynamic=True, seed=0)
+    obs, info = env.reset()
+    returns = []
+    start = time.perf_counter()
+    for _ in range(1000):
+        actions = env.rng.integers(0, 4, size=env.num_envs)  # Random actions
+        obs, rewards, dones, truncs, info = env.step(actions)
+        returns.extend(info.get("episode_return", []))
+    duration = time.perf_counter() - start
+    print(f"{1000 * env.num_envs / duration:.0f} steps/s, {len(returns)} episodes, mean return {np.mean(returns):.3f}")